@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""
+Adaptive alternative to the full-factorial sweep: SCAPS is run on a batch of grid points, the posterior is updated, and
+the next batch is chosen where it is expected to matter most, until the simulation budget is spent. Points that have not
+been simulated yet get lower and upper bounds on their log-likelihood from their nearest simulated neighbours on the
+grid, which is enough to rank candidates either by posterior mass or by expected entropy reduction. The posterior
+usually concentrates on a small region of the grid, so the MAP estimate and marginal entropies of the full sweep are
+reached with a fraction of the runs; see benchmarks/bench_active_learning.py.
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Riley Brandt, Rachel Kurchin"
+__date__ = "May 17, 2017"
+
+import numpy as np
+import os
+import sys
+import argparse
+from bayes import LikelihoodEngine, FrameStore, ProportionalErrorModel, logsumexp, read_obs
+from entropy import calc_entropies
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from parameter_grid import SWEEP_GRID, MATERIAL_GRID
+from results_store import voltage_index
+
+class SCAPSForwardModel(object):
+    """
+    Runs SCAPS on material grid points at every simulated temperature and illumination, returning their currents in
+    the layout of a ResultStore
+    """
+
+    def __init__(self, runner, baseline, voltages, sweep_grid=SWEEP_GRID, grid=MATERIAL_GRID):
+        """
+        runner: SCAPSrunner set up with scaps_script_generator and scaps_output_processor
+
+        baseline: run parameters shared by all runs, as in run_forward_simulations.py
+        """
+        self.runner = runner
+        self.baseline = baseline
+        self.voltages = np.asarray(voltages)
+        self.sweep_grid = sweep_grid
+        self.grid = grid
+        self.temperatures = sweep_grid.axis('T_l')
+        self.illuminations = sweep_grid.axis('ill_l')
+
+    def __call__(self, ids):
+        """
+        Currents of the grid points ids, of shape (point, temperature, illumination, voltage), NaN where a run failed
+        """
+        ids = np.asarray(ids)
+        n_T, n_ill = len(self.temperatures), len(self.illuminations)
+        row, T_i, ill_i = [a.ravel() for a in np.meshgrid(np.arange(len(ids)), np.arange(n_T), np.arange(n_ill),
+                                                           indexing='ij')]
+        index = dict(zip(self.grid.names, self.grid.multi_index(ids[row])))
+        index.update(T_l=T_i, ill_l=ill_i)
+        sweep_ids = self.sweep_grid.flat_index([index[name] for name in self.sweep_grid.names])
+        position = dict((int(id), k) for k, id in enumerate(sweep_ids))
+
+        outputs = self.runner.run_inputs(self.sweep_grid.inputs(self.baseline, [int(id) for id in sweep_ids]),
+                                         print_progress=False)
+        currents = np.full((len(ids), n_T, n_ill, len(self.voltages)), np.nan)
+        for id, (JArray, VArray) in outputs.items():
+            k = position[id]
+            currents[row[k], T_i[k], ill_i[k], voltage_index(self.voltages, VArray)] = JArray
+        return currents
+
+def fill_bounds(values, known, grid_shape):
+    """
+    Lower and upper estimates of the values on the unknown grid points, the minimum and maximum over their nearest known
+    points in grid steps. The known region is grown one step along every axis at a time, so every unknown point takes
+    the bounds of the ring of known points that reaches it first. Known points keep their values.
+    """
+    lo = np.where(known, values, np.inf).reshape(grid_shape)
+    hi = np.where(known, values, -np.inf).reshape(grid_shape)
+    filled = known.reshape(grid_shape).copy()
+    while not filled.all():
+        new_lo, new_hi = np.full(grid_shape, np.inf), np.full(grid_shape, -np.inf)
+        reached = np.zeros(grid_shape, dtype=bool)
+        for axis in range(len(grid_shape)):
+            for src, dst in ((slice(1, None), slice(None, -1)), (slice(None, -1), slice(1, None))):
+                s, d = [slice(None)] * len(grid_shape), [slice(None)] * len(grid_shape)
+                s[axis], d[axis] = src, dst
+                s, d = tuple(s), tuple(d)
+                from_filled = filled[s] & ~filled[d]
+                new_lo[d] = np.where(from_filled, np.minimum(new_lo[d], lo[s]), new_lo[d])
+                new_hi[d] = np.where(from_filled, np.maximum(new_hi[d], hi[s]), new_hi[d])
+                reached[d] |= from_filled
+        if not reached.any():
+            break # nothing known at all
+        lo[reached], hi[reached] = new_lo[reached], new_hi[reached]
+        filled |= reached
+    return lo.ravel(), hi.ravel()
+
+def expected_entropy_reduction(log_w, log_lo, log_hi):
+    """
+    Expected drop of the entropy of the posterior with unnormalized log weights log_w when the weight of a single point
+    i, still unknown, is resolved to either log_lo[i] or log_hi[i] with equal probability. This is the mutual information
+    between the outcome and the posterior, i.e. the Jensen-Shannon divergence between the two possible posteriors. The
+    two differ only at point i and in their normalization, so the divergence is computed for every point at once in
+    closed form, in a way that stays accurate for points of negligible weight.
+    """
+    ref = np.max(np.concatenate([log_w[np.isfinite(log_w)], log_hi[np.isfinite(log_hi)], [0.0]]))
+    S_rest = np.exp(log_w - ref).sum() - np.exp(log_w - ref) # weight of all other points
+    S_rest = np.maximum(S_rest, 0.0)
+
+    w = [np.exp(log_lo - ref), np.exp(log_hi - ref)]
+    S = [S_rest + w[0], S_rest + w[1]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_p = [log_lo - ref - np.log(S[0]), log_hi - ref - np.log(S[1])] # log-probability of point i
+        log_m = np.logaddexp(log_p[0], log_p[1]) - np.log(2.0) # ... and of the mixture of both outcomes
+
+        js = 0.0
+        for x, y in ((0, 1), (1, 0)):
+            # All other points are scaled by 1/S[x] against (1/S[0] + 1/S[1])/2 in the mixture
+            rest = S_rest / S[x] * -np.log1p(0.5 * (w[x] - w[y]) / S[y])
+            point = np.where(np.isfinite(log_p[x]), np.exp(log_p[x]) * (log_p[x] - log_m), 0.0)
+            js = js + 0.5 * (rest + point)
+    return np.where(np.isfinite(js), np.maximum(js, 0.0), 0.0)
+
+class ActiveLearner(object):
+    """
+    Alternates between simulating batches of material grid points and updating the posterior over the grid
+    """
+    STRATEGIES = ('entropy', 'mass')
+
+    def __init__(self, forward_model, observations, voltages, temperatures, illuminations, grid=MATERIAL_GRID):
+        """
+        forward_model: callable mapping an array of grid point indices to their currents, of shape (point, temperature,
+                       illumination, voltage), e.g. a SCAPSForwardModel
+
+        observations: (J, V, T, ill, J_error) arrays of every observation, as passed to LikelihoodEngine.log_likelihood
+
+        voltages, temperatures, illuminations: the axes of the simulated currents
+        """
+        self.forward_model = forward_model
+        self.observations = [np.asarray(x) for x in observations]
+        self.voltages, self.temperatures, self.illuminations = voltages, temperatures, illuminations
+        self.grid = grid
+        self.log_lkl = np.full(len(grid), -np.inf)
+        self.simulated = np.zeros(len(grid), dtype=bool)
+
+    def initial_design(self, stride=3):
+        """
+        Grid points of a coarse sub-lattice taking every stride-th value along each axis, including both ends
+        """
+        axes = []
+        for n in self.grid.shape:
+            axis = np.arange(0, n, stride)
+            axes.append(np.union1d(axis, [n - 1]))
+        mesh = np.meshgrid(*axes, indexing='ij')
+        return self.grid.flat_index([m.ravel() for m in mesh])
+
+    def simulate(self, ids):
+        """
+        Run the forward model on the grid points ids and add their log-likelihoods of all observations
+        """
+        ids = np.asarray(ids)
+        engine = LikelihoodEngine(self.forward_model(ids), self.voltages, self.temperatures, self.illuminations)
+        self.log_lkl[ids] = engine.log_likelihood(*self.observations).sum(axis=0)
+        self.simulated[ids] = True
+
+    def bounds(self):
+        """
+        Lower and upper log-likelihood estimates of every grid point, exact for the simulated points
+        """
+        return fill_bounds(self.log_lkl, self.simulated, self.grid.shape)
+
+    def log_posterior(self):
+        """
+        Normalized log-posterior over the whole grid (uniform prior), with the midpoint of the log-likelihood bounds
+        standing in for the points that have not been simulated
+        """
+        lo, hi = self.bounds()
+        with np.errstate(invalid='ignore'):
+            log_post = np.where(self.simulated, self.log_lkl, np.where(np.isfinite(lo), 0.5 * (lo + hi), -np.inf))
+        return log_post - logsumexp(log_post)
+
+    def select(self, batch_size, strategy='entropy'):
+        """
+        Next batch_size grid points to simulate. 'mass' takes the points with the largest posterior mass under the
+        optimistic (upper) log-likelihood estimates; 'entropy' takes those whose simulation is expected to reduce the
+        entropy of the posterior the most.
+        """
+        if strategy not in self.STRATEGIES:
+            raise ValueError("Unknown strategy {}, use one of {}".format(strategy, self.STRATEGIES))
+        lo, hi = self.bounds()
+        if strategy == 'mass':
+            score = hi
+        else:
+            with np.errstate(invalid='ignore'):
+                log_w = np.where(self.simulated, self.log_lkl, np.where(np.isfinite(lo), 0.5 * (lo + hi), -np.inf))
+            score = expected_entropy_reduction(log_w, lo, hi)
+        score = np.where(self.simulated | np.isnan(score), -np.inf, score)
+        batch_size = max(0, min(batch_size, int((~self.simulated).sum())))
+        # Points too improbable to register are ranked by their optimistic estimate
+        return np.lexsort((-hi, -score))[:batch_size]
+
+    def summary(self):
+        """
+        Number of simulated points, MAP grid point (among the simulated points), total entropy and marginal entropies
+        of the current posterior estimate
+        """
+        log_post = self.log_posterior()
+        total, marginal = calc_entropies(np.exp(log_post)[None, :], self.grid.shape)
+        return {'simulated': int(self.simulated.sum()),
+                'map': int(np.argmax(np.where(self.simulated, self.log_lkl, -np.inf))),
+                'entropy': float(total[0]),
+                'marginal_entropies': marginal[0].tolist()}
+
+    def run(self, budget, batch_size=200, strategy='entropy', stride=3, callback=None):
+        """
+        Simulate the initial design, then keep adding batches chosen by strategy until budget grid points have been
+        simulated. Returns the summary after every batch; callback, if given, is called with each summary.
+        """
+        history = []
+        ids = self.initial_design(stride)
+        while len(ids):
+            self.simulate(ids)
+            history.append(self.summary())
+            if callback is not None:
+                callback(history[-1])
+            ids = self.select(min(batch_size, budget - int(self.simulated.sum())), strategy)
+        return history
+
+if __name__ == "__main__":
+    from run_scaps_parallel import SCAPSrunner
+    from run_forward_simulations import scaps_script_generator, scaps_output_processor, BASELINE_RUN
+
+    parser = argparse.ArgumentParser(description="Adaptive SCAPS sweep driven by the posterior")
+    parser.add_argument('-budget', help="Number of grid points to simulate", type=int, default=len(MATERIAL_GRID) // 10)
+    parser.add_argument('-batch', help="Grid points simulated per batch", type=int, default=200)
+    parser.add_argument('-strategy', help="Acquisition strategy", choices=ActiveLearner.STRATEGIES, default='entropy')
+    parser.add_argument('-stride', help="Stride of the initial design along every axis", type=int, default=3)
+    parser.add_argument('-ncores', help="Number of SCAPS processes", type=int, default=32)
+    args = parser.parse_args()
+
+    # Observations as in bayes.py, with the same error estimate
+    conds = ['280_31', '280_108', '300_31', '300_108', '320_31', '320_108']
+    obs_T, obs_ill, obs_V, obs_J = [np.concatenate(x) for x in
+                                    zip(*[read_obs('observation_data/obs_'+cond+'.txt') for cond in conds])]
+    Jerr = ProportionalErrorModel()(obs_J)
+
+    voltages = np.linspace(0, 0.5, 26)
+    runner = SCAPSrunner(ncores=args.ncores, input_processor=scaps_script_generator,
+                         output_processor=scaps_output_processor)
+    forward_model = SCAPSForwardModel(runner, BASELINE_RUN, voltages)
+    learner = ActiveLearner(forward_model, (obs_J, obs_V, obs_T, obs_ill, Jerr), voltages,
+                            forward_model.temperatures, forward_model.illuminations)
+
+    def report(summary):
+        print("{} grid points simulated: MAP {}, entropy {:.4f}, marginal entropies {}".format(
+            summary['simulated'], [int(i) for i in MATERIAL_GRID.multi_index(summary['map'])], summary['entropy'],
+            np.round(summary['marginal_entropies'], 4)))
+
+    learner.run(args.budget, batch_size=args.batch, strategy=args.strategy, stride=args.stride, callback=report)
+
+    # The final posterior estimate, in the format entropy.py reads
+    frames = FrameStore.create('probs_active', 1, len(MATERIAL_GRID))
+    frames.append(np.exp(learner.log_posterior()), args.strategy, 0)
+    frames.flush()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Inference for many devices against the same simulations in one pass. The observations of every device are read into
+one set of columnar arrays, the simulation store is opened once, and the grid is split into chunks that are processed
+in parallel: each chunk interpolates the simulated currents once for every distinct observation condition, shared by
+all devices measured at it, and sums the log-likelihoods of each device's observations. The result is a matrix of
+log-posteriors of shape (device, grid point), written either as a frame store with one frame per device or as one
+.npy file of posterior probabilities per device.
+
+Every device directory holds observation files in the format of read_obs() in bayes.py, named obs_<condition>.txt.
+
+$:analysis# python batch_inference.py devices/* -out probs_batch -ncores 16
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Riley Brandt, Rachel Kurchin"
+__date__ = "May 17, 2017"
+
+import numpy as np
+import os
+import sys
+import glob
+import argparse
+from bayes import LikelihoodEngine, FrameStore, ProportionalErrorModel, gaussian_log_likelihood, logsumexp
+from grid_chunks import chunk_bounds, worker_pool, worker_state
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from results_store import ResultStore
+
+class ObservationBatch(object):
+    """
+    Observations of several devices in columnar form: equal-length T, ill, V and J arrays sorted by device, with the
+    observations of device d in the rows offsets[d]:offsets[d + 1]
+    """
+
+    def __init__(self, names, T, ill, V, J, offsets):
+        self.names = list(names)
+        self.T = np.asarray(T, dtype=np.float64)
+        self.ill = np.asarray(ill, dtype=np.float64)
+        self.V = np.asarray(V, dtype=np.float64)
+        self.J = np.asarray(J, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if len(self.offsets) != len(self.names) + 1 or self.offsets[-1] != len(self.J):
+            raise ValueError("Offsets {} do not match {} devices and {} observations".format(self.offsets,
+                                                                                         len(self.names), len(self.J)))
+        if np.any(np.diff(self.offsets) == 0):
+            raise ValueError("Devices without observations: {}".format(
+                [name for name, n in zip(self.names, np.diff(self.offsets)) if n == 0]))
+
+    @classmethod
+    def from_dirs(cls, dirs, pattern='obs_*.txt'):
+        """
+        Read every observation file matching pattern in each directory, one device per directory, named after it
+        """
+        names, columns, offsets = [], [], [0]
+        for path in dirs:
+            files = sorted(glob.glob(os.path.join(path, pattern)))
+            if not files:
+                raise ValueError("No observation files {} in {}".format(pattern, path))
+            # "T ill V J" columns after a header line, as for read_obs()
+            data = np.concatenate([np.loadtxt(f, skiprows=1, ndmin=2)[:, :4] for f in files])
+            names.append(os.path.basename(os.path.normpath(path)))
+            columns.append(data)
+            offsets.append(offsets[-1] + len(data))
+        data = np.concatenate(columns) if columns else np.zeros((0, 4))
+        return cls(names, data[:, 0], data[:, 1], data[:, 2], data[:, 3], offsets)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def num_obs(self):
+        return len(self.J)
+
+    def errors(self, error_model=None):
+        """
+        Assumed error of every observed current under error_model, by default the ProportionalErrorModel of bayes.py
+        """
+        return (error_model or ProportionalErrorModel())(self.J)
+
+    def conditions(self):
+        """
+        Distinct (T, ill, V) observation conditions, as (T, ill, V, inverse) where inverse maps every observation to its
+        condition
+        """
+        keys, inverse = np.unique(np.column_stack([self.T, self.ill, self.V]), axis=0, return_inverse=True)
+        return keys[:, 0], keys[:, 1], keys[:, 2], inverse.ravel()
+
+def chunk_log_likelihood(engine, batch, start, stop, conditions=None, J_err=None):
+    """
+    Summed log-likelihoods of every device's observations for the grid points start:stop, of shape (device, point).
+    conditions and J_err default to batch.conditions() and batch.errors().
+    """
+    T, ill, V, inverse = conditions if conditions is not None else batch.conditions()
+    J_err = J_err if J_err is not None else batch.errors()
+
+    chunk = LikelihoodEngine(engine.currents[start:stop], engine.voltages, engine.temperatures, engine.illuminations)
+    I_model = chunk.model_currents(V, T, ill)[inverse]
+    log_lkl = gaussian_log_likelihood(batch.J[:, None], I_model, J_err[:, None])
+    return np.add.reduceat(log_lkl, batch.offsets[:-1], axis=0)
+
+def _chunk_worker(bounds):
+    state = worker_state
+    return bounds[0], chunk_log_likelihood(state['engine'], state['batch'], bounds[0], bounds[1], state['conditions'],
+                                           state['J_err'])
+
+def batch_log_posterior(engine, batch, ncores=None, chunk_size=None, log_prior=None, error_model=None):
+    """
+    Normalized log-posteriors of every device in batch over the grid points of engine, of shape (device, grid point),
+    starting from log_prior (uniform by default) and with the current errors of error_model (see batch.errors()). The
+    grid is processed in chunks of chunk_size points over ncores processes (all cores by default); chunk_size defaults
+    to about 2M likelihood evaluations per chunk.
+    """
+    num_points = len(engine)
+    chunks = chunk_bounds(num_points, batch.num_obs, ncores, chunk_size)
+
+    log_post = np.empty((len(batch), num_points), dtype=np.float64)
+    with worker_pool(ncores, len(chunks), engine=engine, batch=batch, conditions=batch.conditions(),
+                     J_err=batch.errors(error_model)) as imap:
+        for start, chunk in imap(_chunk_worker, chunks):
+            log_post[:, start:start + chunk.shape[1]] = chunk
+
+    if log_prior is not None:
+        log_post += log_prior
+    log_post -= logsumexp(log_post, axis=1)[:, None]
+    return log_post
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Posteriors of many devices against one simulation store")
+    parser.add_argument('devices', help="Observation directories, one per device", nargs='+')
+    parser.add_argument('-store', help="Result store written by process_pickles.py",
+                        default='../running_sims/pickles/simulation_store')
+    parser.add_argument('-out', help="Output directory", default='probs_batch')
+    parser.add_argument('-per_device', help="Write one <device>.npy posterior per device instead of a frame store",
+                        action='store_true')
+    parser.add_argument('-ncores', help="Processes to use (default: all cores)", type=int, default=None)
+    parser.add_argument('-chunk', help="Grid points per chunk of work", type=int, default=None)
+    args = parser.parse_args()
+
+    print('Reading observations of {} devices...'.format(len(args.devices)))
+    batch = ObservationBatch.from_dirs(args.devices)
+    if len(set(batch.names)) != len(batch.names):
+        raise ValueError("Device directories must have distinct names: {}".format(batch.names))
+    print('{} observations at {} distinct conditions'.format(batch.num_obs, len(batch.conditions()[0])))
+
+    print('Opening results store and running inference...')
+    engine = LikelihoodEngine.from_store(ResultStore(args.store))
+    log_post = batch_log_posterior(engine, batch, ncores=args.ncores, chunk_size=args.chunk)
+
+    if args.per_device:
+        if not os.path.exists(args.out):
+            os.makedirs(args.out)
+        for name, row in zip(batch.names, log_post):
+            np.save(os.path.join(args.out, name + '.npy'), np.exp(row))
+    else:
+        # One frame per device, labelled by device name and its number of observations
+        frames = FrameStore.create(args.out, len(batch), len(engine))
+        for name, row, num_obs in zip(batch.names, log_post, np.diff(batch.offsets)):
+            frames.append(np.exp(row), name, int(num_obs))
+        frames.flush()
@@ -6,9 +6,17 @@ __author__ = "Riley Brandt, Rachel Kurchin"
 __date__ = "May 17, 2017"
 
 import numpy as np
-import pickle
 import math
+import json
 import os
+import sys
+import argparse
+from collections import OrderedDict
+
+# The simulation result store lives with the forward simulation code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from results_store import ResultStore, pack_results
+from parameter_grid import ParameterGrid
 
 def normalize(array):
     """
@@ -16,6 +24,15 @@ def normalize(array):
     """
     return array/array.cumsum()[-1]
 
+def logsumexp(array, axis=None):
+    """
+    Numerically stable log(sum(exp(array))), used to normalize log-probabilities without underflow
+    """
+    amax = np.amax(array, axis=axis, keepdims=True)
+    amax[~np.isfinite(amax)] = 0.0
+    out = np.log(np.sum(np.exp(array - amax), axis=axis, keepdims=True)) + amax
+    return np.squeeze(out, axis=axis) if axis is not None else out.item()
+
 def likelihood(I_meas, V_meas, T_meas, ill_meas, I_model, I_error):
     """
     Takes observation J(V,T,i) and calculation results and compute likelihood
@@ -25,17 +42,357 @@ def likelihood(I_meas, V_meas, T_meas, ill_meas, I_model, I_error):
     # Take a uniform initial pdf
     lkl = normalize(np.ones(len(I_model)))
 
-    # Assume we feed in an observation at exactly a bias we simulated at
-    # TODO: Implement interpolation for biases
-
-    # Iiterate over each point in parameter space to calculate a likelihood, assuming a Gaussian distribution
+    # Iiterate over each point in parameter space to calculate a likelihood, assuming a Gaussian distribution. The
+    # simulated J(V) is linearly interpolated to the measured bias; a run that is missing or does not reach the bias
+    # gives zero likelihood, as in LikelihoodEngine
     for i in range(len(lkl)):
-        V_index = np.where(I_model[i][T_meas][ill_meas][1] == V_meas)[0][0]
-        lkl[i]= 1.0/(1.772 * I_error) * math.exp(-1.0 * (I_meas - I_model[i][T_meas][ill_meas][0][V_index])**2 /
-                                                 (2*I_error**2))
+        run = I_model[i][T_meas][ill_meas]
+        if len(run) == 0 or len(run[1]) == 0 or not run[1][0] <= V_meas <= run[1][-1]:
+            lkl[i] = 0.0
+            continue
+        I_sim = np.interp(V_meas, run[1], run[0])
+        lkl[i]= 1.0/(1.772 * I_error) * math.exp(-1.0 * (I_meas - I_sim)**2 / (2*I_error**2))
 
     return lkl
 
+def gaussian_error_terms(I_error):
+    """
+    Terms of the Gaussian log-likelihood of a current measured with the assumed error I_error, which is
+    log_norm - weight * (I_meas - I_model)**2. Returns (log_norm, weight). Every vectorized likelihood evaluation goes
+    through this function, so that they all follow the same error model.
+    """
+    I_error = np.asarray(I_error, dtype=np.float64)
+    return -np.log(1.772 * I_error), 1.0 / (2 * I_error**2)
+
+def gaussian_log_likelihood(I_meas, I_model, I_error):
+    """
+    Gaussian log-likelihood of measured currents given model currents, broadcast over the arguments. Missing
+    simulations (NaN model currents) give -inf.
+    """
+    log_norm, weight = gaussian_error_terms(I_error)
+    log_lkl = np.asarray(log_norm - weight * (I_meas - I_model)**2)
+    log_lkl[np.isnan(log_lkl)] = -np.inf
+    return log_lkl
+
+def interpolation_weights(voltages, V_meas):
+    """
+    Precompute linear interpolation along a shared, increasing voltage axis for a batch of measured biases. Returns
+    (lo, hi, w) such that J(V_meas) = (1-w)*J[lo] + w*J[hi]. Biases that fall exactly on a simulated voltage get w=0,
+    and biases outside the simulated range raise a ValueError.
+    """
+    voltages, V_meas = np.asarray(voltages), np.atleast_1d(V_meas).astype(np.float64)
+    if np.any(V_meas < voltages[0]) or np.any(V_meas > voltages[-1]):
+        raise ValueError("Observation bias {} outside simulated range [{}, {}]".format(V_meas, voltages[0],
+                                                                                      voltages[-1]))
+    lo = np.clip(np.searchsorted(voltages, V_meas, side='right') - 1, 0, len(voltages) - 1)
+    hi = np.minimum(lo + 1, len(voltages) - 1)
+    step = voltages[hi] - voltages[lo]
+    w = np.where(step > 0, (V_meas - voltages[lo]) / np.where(step > 0, step, 1.0), 0.0)
+    return lo, hi, w
+
+class ProportionalErrorModel(object):
+    """
+    Assumed error of an observed current. Since J(V) is roughly exponential, the error is taken proportional to the
+    current relative to offset, with a floor:
+
+        J_err = max(floor, |J + offset| * scale)
+
+    Anything that maps an array of observed currents to their errors can be used in its place.
+    """
+
+    def __init__(self, floor=0.5, offset=19.5, scale=0.15):
+        self.floor = floor
+        self.offset = offset
+        self.scale = scale
+
+    def __call__(self, J):
+        return np.maximum(self.floor, np.abs((np.asarray(J, dtype=np.float64) + self.offset) * self.scale))
+
+    def __repr__(self):
+        return "ProportionalErrorModel(floor={:g}, offset={:g}, scale={:g})".format(self.floor, self.offset, self.scale)
+
+class LikelihoodEngine(object):
+    """
+    Vectorized counterpart of likelihood(). The simulated currents are packed once into a dense array of shape
+    (grid point, temperature, illumination, voltage), after which the likelihoods of every grid point for a whole batch
+    of observations are computed in a single broadcast operation.
+    """
+
+    def __init__(self, currents, voltages, temperatures, illuminations):
+        """
+        currents: array of shape (grid point, temperature, illumination, voltage), NaN where a run is missing
+
+        voltages, temperatures, illuminations: the axes of the current array
+        """
+        self.currents = currents
+        self.voltages = np.asarray(voltages)
+        self.temperatures = np.asarray(temperatures)
+        self.illuminations = np.asarray(illuminations)
+
+    @classmethod
+    def from_results(cls, results, dtype=np.float64):
+        """
+        Build the engine from the nested results dictionary produced by earlier versions of process_pickles.py
+        """
+        return cls(*pack_results(results, dtype=dtype))
+
+    @classmethod
+    def from_store(cls, store):
+        """
+        Build the engine on the memory-mapped currents of a ResultStore, without loading them into memory
+        """
+        return cls(store.currents, store.voltages, store.temperatures, store.illuminations)
+
+    def __len__(self):
+        return self.currents.shape[0]
+
+    def __getstate__(self):
+        # Currents memory-mapped from a whole .npy file, as those of a ResultStore, are pickled by reference, so that
+        # worker processes map the file themselves instead of each receiving a copy
+        state = self.__dict__.copy()
+        currents = self.currents
+        if isinstance(currents, np.memmap) and currents.filename is not None and currents.flags.c_contiguous and \
+                os.path.getsize(currents.filename) == currents.offset + currents.nbytes:
+            state['currents'] = ('memmap', currents.filename, currents.dtype.str, currents.shape, currents.offset)
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state['currents'], tuple):
+            _, filename, dtype, shape, offset = state['currents']
+            state['currents'] = np.memmap(filename, dtype=np.dtype(dtype), mode='r', shape=shape, offset=offset)
+        self.__dict__.update(state)
+
+    @staticmethod
+    def _axis_index(axis, values, name):
+        """
+        Find the positions of values on a simulation axis, raising ValueError if any value was not simulated
+        """
+        index = np.clip(np.searchsorted(axis, values), 0, len(axis) - 1)
+        if not np.all(axis[index] == values):
+            raise ValueError("Observation {} {} not in simulated values {}".format(name, values, axis))
+        return index
+
+    def model_currents(self, V_meas, T_meas, ill_meas, points=None):
+        """
+        Simulated currents at a batch of observation conditions, as an array of shape (observation, grid point).
+        Temperature and illumination must be simulated values, while the bias is interpolated along the voltage axis.
+        points restricts the grid points to a sorted array of indices.
+        """
+        currents = self.currents if points is None else self.currents[points]
+        T_index = self._axis_index(self.temperatures, np.atleast_1d(T_meas), 'temperature')
+        ill_index = self._axis_index(self.illuminations, np.atleast_1d(ill_meas), 'illumination')
+        lo, hi, w = interpolation_weights(self.voltages, V_meas)
+        T_index, ill_index, lo, hi, w = np.broadcast_arrays(T_index, ill_index, lo, hi, w)
+
+        # The voltage axis is shared, so the same weights apply to every grid point. Biases on a simulated voltage only
+        # read the lower point, so runs that stop at exactly that voltage are still usable
+        I_model = currents[:, T_index, ill_index, lo].T
+        between = w > 0
+        if np.any(between):
+            I_hi = currents[:, T_index[between], ill_index[between], hi[between]].T
+            I_model[between] += w[between, None] * (I_hi - I_model[between])
+        return I_model
+
+    def likelihood(self, I_meas, V_meas, T_meas, ill_meas, I_error):
+        """
+        Same as likelihood(), but for all grid points and a batch of observations at once. All observation arguments
+        may be scalars or equal-length arrays; the result has shape (observation, grid point), or (grid point,) if
+        every argument is a scalar. Grid points with no simulation for an observed condition get zero likelihood.
+        """
+        return np.exp(self.log_likelihood(I_meas, V_meas, T_meas, ill_meas, I_error))
+
+    def log_likelihood(self, I_meas, V_meas, T_meas, ill_meas, I_error, points=None):
+        """
+        Natural log of likelihood(), computed directly so that sharp likelihoods do not underflow. Missing simulations
+        give -inf. points restricts the grid points to a sorted array of indices, as for the active set of a pruned
+        PosteriorUpdater.
+        """
+        scalar = all(np.ndim(x) == 0 for x in (I_meas, V_meas, T_meas, ill_meas, I_error))
+        I_model = self.model_currents(V_meas, T_meas, ill_meas, points)
+        I_meas, I_error = np.atleast_1d(I_meas)[:, None], np.atleast_1d(I_error)[:, None]
+
+        log_lkl = gaussian_log_likelihood(I_meas, I_model, I_error)
+
+        return log_lkl[0] if scalar else log_lkl
+
+    @staticmethod
+    def log_likelihood_bound(I_error):
+        """
+        Upper bound on log_likelihood() at any grid point, reached where the model matches the observation exactly
+        """
+        return gaussian_error_terms(I_error)[0]
+
+class PosteriorUpdater(object):
+    """
+    Streaming Bayesian update carried out in log space. Log-likelihoods are accumulated onto the log-posterior, which is
+    renormalized with log-sum-exp after every observation, so repeated sharp likelihoods cannot underflow to zero.
+
+    With prune set, the updater keeps an active set of the grid points whose log-posterior is within prune of the
+    maximum, and drops the others (probability zero) for good, so that later likelihoods only need to be evaluated on
+    self.active. Since no likelihood exceeds LikelihoodEngine.log_likelihood_bound(), a dropped point can at most gain
+    that much per observation; discarded_bound accumulates this into an upper bound on the posterior mass the exact
+    computation would have assigned to the dropped points, which is also the total variation distance between the
+    pruned and the exact posterior.
+    """
+
+    def __init__(self, log_prior, prune=None):
+        """
+        log_prior: array of log-probabilities over the grid points, or an integer number of grid points for a uniform
+                   prior
+
+        prune: log-probability threshold below the maximum, in nats, under which grid points are dropped; None keeps
+               every point
+        """
+        if np.ndim(log_prior) == 0:
+            log_prior = np.zeros(int(log_prior))
+        self.log_prob = np.array(log_prior, dtype=np.float64)
+        self.log_prob -= logsumexp(self.log_prob)
+        self.prune = prune
+        self.active = np.arange(len(self.log_prob)) if prune is not None else None
+        # Log of the bound on the mass of the dropped points, relative to the (normalized) active points
+        self.log_discarded = -np.inf
+
+    def update(self, log_lkl, log_lkl_bound=None, points=None):
+        """
+        Multiply the posterior by a likelihood given in log space, renormalize and return the new posterior PMF.
+
+        When pruning, log_lkl may be given only on the grid points points (a sorted array of indices, such as an
+        earlier self.active), which must include the current active set, and log_lkl_bound is required: an upper bound
+        on the log-likelihood at any grid point, see LikelihoodEngine.log_likelihood_bound().
+        """
+        if self.active is None:
+            self.log_prob += log_lkl
+            self.log_prob -= logsumexp(self.log_prob)
+            return self.prob
+
+        if log_lkl_bound is None:
+            raise ValueError("A pruned update needs the likelihood bound log_lkl_bound")
+        log_lkl = np.asarray(log_lkl)
+        if points is not None:
+            log_lkl = log_lkl[np.searchsorted(points, self.active)]
+        elif len(log_lkl) == len(self.log_prob):
+            log_lkl = log_lkl[self.active]
+        elif len(log_lkl) != len(self.active):
+            raise ValueError("{} log-likelihoods for {} active points".format(len(log_lkl), len(self.active)))
+
+        active_prob = self.log_prob[self.active] + log_lkl
+        self.log_discarded += log_lkl_bound
+
+        # Drop the points that fell too far below the maximum, adding their mass to the bound
+        drop = ~(active_prob >= np.amax(active_prob) - self.prune)
+        if np.any(drop):
+            self.log_discarded = np.logaddexp(self.log_discarded, logsumexp(active_prob[drop]))
+            self.log_prob[self.active[drop]] = -np.inf
+            self.active, active_prob = self.active[~drop], active_prob[~drop]
+
+        norm = logsumexp(active_prob)
+        self.log_prob[self.active] = active_prob - norm
+        self.log_discarded -= norm
+        return self.prob
+
+    @property
+    def discarded_bound(self):
+        """
+        Upper bound on the posterior mass of the grid points dropped by pruning
+        """
+        return 1.0 / (1.0 + np.exp(-self.log_discarded))
+
+    @property
+    def prob(self):
+        return np.exp(self.log_prob)
+
+class FrameStore(object):
+    """
+    Posterior "probability frames" kept in a single preallocated memory-mapped array, frames.npy, of shape
+    (frame, grid point), together with a small JSON index of the (condition, observation) label of each frame. The array
+    is a standard .npy file, so any frame can be read lazily with np.load(..., mmap_mode='r'). The index optionally
+    records the parameter grid of the frames, for posteriors that are not on the simulated grid (see surrogate.py).
+
+    Appended frames are written to disk together with the index only now and then, so call flush() after the last one.
+    """
+    FRAMES_FILE = 'frames.npy'
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, path, frames, labels, grid=None):
+        self.path = path
+        self.frames = frames
+        self.labels = labels
+        self.grid = grid
+        self._indexed = len(labels) # number of frames labelled in the index on disk
+
+    @classmethod
+    def create(cls, path, num_frames, num_points, dtype=np.float64, grid=None):
+        """
+        Preallocate a store for num_frames frames of num_points grid points each in the directory path
+        """
+        if grid is not None and len(grid) != num_points:
+            raise ValueError("Grid of {} points for frames of {} points".format(len(grid), num_points))
+        if not os.path.exists(path):
+            os.makedirs(path)
+        frames = np.lib.format.open_memmap(os.path.join(path, cls.FRAMES_FILE), mode='w+', dtype=dtype,
+                                           shape=(num_frames, num_points))
+        store = cls(path, frames, [], grid)
+        store._write_index()
+        return store
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        """
+        Open an existing store without reading any frame data
+        """
+        frames = np.load(os.path.join(path, cls.FRAMES_FILE), mmap_mode=mode)
+        with open(os.path.join(path, cls.INDEX_FILE), 'r') as f:
+            index = json.load(f, object_pairs_hook=OrderedDict)
+        grid = ParameterGrid(index['grid']) if index.get('grid') is not None else None
+        return cls(path, frames, [tuple(label) for label in index['labels']], grid)
+
+    def _write_index(self):
+        index_file = os.path.join(self.path, self.INDEX_FILE)
+        index = {'capacity': self.frames.shape[0], 'labels': self.labels}
+        if self.grid is not None:
+            index['grid'] = self.grid.to_dict()
+        with open(index_file + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.rename(index_file + '.tmp', index_file)
+        self._indexed = len(self.labels)
+
+    def append(self, frame, cond, obs):
+        """
+        Write the next frame, labelled by its observation condition and the observation number within it. The store is
+        flushed whenever the number of frames doubles, so that the index, which holds every label, is written O(log N)
+        times over N frames rather than N times.
+        """
+        if len(self.labels) >= self.frames.shape[0]:
+            raise IndexError("Frame store at {} is full ({} frames)".format(self.path, self.frames.shape[0]))
+        self.frames[len(self.labels)] = frame
+        self.labels.append((cond, obs))
+        if len(self.labels) >= 2 * self._indexed:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the frames to disk, then the index labelling them, so that FrameStore.open sees every frame appended
+        """
+        self.frames.flush()
+        self._write_index()
+
+    def set_labels(self, labels):
+        """
+        Label frames that were written straight into self.frames, such as by the workers of sharded_posterior.py
+        """
+        if len(labels) > self.frames.shape[0]:
+            raise IndexError("{} labels for a frame store of {} frames".format(len(labels), self.frames.shape[0]))
+        self.labels = [tuple(label) for label in labels]
+        self._write_index()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError("Frame {} out of range for {} frames".format(i, len(self)))
+        return self.frames[i % len(self)]
+
 def read_obs(obs_file):
     """
     Function to read in observation data from text file
@@ -54,34 +411,83 @@ def read_obs(obs_file):
     return (obs_T, obs_ill, obs_V, obs_J)
 
 if __name__ == "__main__":
-    # Read in simulation results (produced by process_pickles.py)
-    print 'Reading in results file...'
-    results = pickle.load(open('../running_sims/pickles/simulation_all_results.pickle','rb'))
+    parser = argparse.ArgumentParser(description="Bayesian inference of the material parameters from JVTi data")
+    parser.add_argument('-store', help="Result store written by process_pickles.py",
+                        default='../running_sims/pickles/simulation_store')
+    parser.add_argument('-refine', help="Evaluate the posterior on a grid this many times finer along every axis, "
+                                        "interpolating the simulations (see surrogate.py)", type=int, default=1)
+    parser.add_argument('-linear', help="Interpolate the logspace axes linearly when refining", action='store_true')
+    parser.add_argument('-max_memory', help="Largest size of the interpolated currents of a refined grid, which are "
+                                            "held in memory (GB)", type=float, default=4.0)
+    parser.add_argument('-out', help="Directory of the probability frames", default='probs')
+    parser.add_argument('-prune', help="Drop grid points whose log-posterior falls this many nats below the maximum "
+                                       "from later likelihood evaluations", type=float, default=None)
+    parser.add_argument('-error_floor', help="Smallest assumed current error (mA)", type=float, default=0.5)
+    parser.add_argument('-error_offset', help="Offset of the current the assumed error is proportional to (mA)",
+                        type=float, default=19.5)
+    parser.add_argument('-error_scale', help="Assumed error relative to the offset current", type=float, default=0.15)
+    parser.add_argument('-ncores', help="Evaluate the posterior out of core, in shards of the grid over this many "
+                                        "processes (see sharded_posterior.py)", type=int, default=None)
+    parser.add_argument('-chunk', help="Grid points per shard when evaluating out of core", type=int, default=None)
+    args = parser.parse_args()
+    sharded = args.ncores is not None or args.chunk is not None
+    # Estimate error, noting that since J(V) is roughly exponential, it should be proportional (see error_sweep.py for
+    # how sensitive the PMFs are to these parameters)
+    error_model = ProportionalErrorModel(args.error_floor, args.error_offset, args.error_scale)
+    if sharded and (args.prune is not None or args.refine > 1):
+        parser.error("-ncores and -chunk cannot be combined with -prune or -refine")
 
-    # make a uniform prior
-    print 'Making (uniform) prior...'
-    prob = normalize(np.ones(len(results)))
+    # Open simulation results (produced by process_pickles.py)
+    print('Opening results store...')
+    store = ResultStore(args.store)
+    grid = None
+    if args.refine > 1:
+        from surrogate import GridSurrogate, refine
+        surrogate = GridSurrogate.from_store(store, log_axes=[] if args.linear else None)
+        grid = refine(surrogate.grid, args.refine, log_axes=surrogate.log_axes)
+        size = len(grid) * np.prod(surrogate.currents.shape[1:]) * np.dtype(np.float64).itemsize / 2**30
+        if size > args.max_memory:
+            parser.error("-refine {} interpolates {:.1f} GB of currents into memory, more than -max_memory {:g} GB; "
+                         "use a smaller -refine or raise -max_memory".format(args.refine, size, args.max_memory))
+        print('Interpolating the simulations onto {}...'.format(grid))
+        engine = surrogate.engine(grid)
+    else:
+        engine = LikelihoodEngine.from_store(store)
 
     # T_ill conditions based on observation files
-    print 'Reading in observations and running inference...'
+    print('Reading in observations and running inference...')
     conds = ['280_31', '280_108', '300_31', '300_108', '320_31', '320_108']
+    observations = [read_obs('observation_data/obs_'+cond+'.txt') for cond in conds]
 
-    if not os.path.exists('probs'):
-        os.mkdir('probs')
-
-    for i, cond in enumerate(conds):
-        # read in observations
-        obs_T, obs_ill, obs_V, obs_J = read_obs('observation_data/obs_'+cond+'.txt')
+    # One frame per observation fed in - each "probability frame"
+    frames = FrameStore.create(args.out, sum(len(obs[3]) for obs in observations), len(engine), grid=grid)
 
-        # Run Bayesian analysis
-        for j in range(len(obs_J)):
+    if sharded:
+        # All observations in one pass over each shard of the grid, with a uniform prior
+        from sharded_posterior import sharded_posterior
+        obs_T, obs_ill, obs_V, obs_J = [np.concatenate([np.array(obs[k]) for obs in observations]) for k in range(4)]
+        Jerr = error_model(obs_J)
+        sharded_posterior(engine, (obs_J, obs_V, obs_T, obs_ill, Jerr), frames, ncores=args.ncores,
+                          chunk_size=args.chunk)
+        frames.set_labels([(cond, j) for cond, obs in zip(conds, observations) for j in range(len(obs[3]))])
+    else:
+        # make a uniform prior
+        print('Making (uniform) prior...')
+        posterior = PosteriorUpdater(len(engine), prune=args.prune)
 
-            # Estimate error, noting that since J(V) is roughly exponential, it should be proportional
-            # (ultimate PMF's are not terribly sensitive to these parameters)
-            Jerr = np.amax(np.array([0.5, np.abs((obs_J[j]+19.5)*0.15)]))
+        for cond, (obs_T, obs_ill, obs_V, obs_J) in zip(conds, observations):
+            Jerr = error_model(obs_J)
 
-            prob = normalize(np.multiply(prob, likelihood(obs_J[j], obs_V[j], obs_T[j], obs_ill[j], results, Jerr)))
+            # Likelihoods for every observation of this condition in one pass, on the active grid points when pruning
+            points = posterior.active
+            log_lkls = engine.log_likelihood(obs_J, obs_V, obs_T, obs_ill, Jerr, points=points)
+            bounds = engine.log_likelihood_bound(Jerr)
 
-            # Save a pickle for each observation fed in - each "probability frame"
-            pickle.dump(prob, open('probs/prob_%(#)03d'%{"#":14*i+j}+'_'+cond+'_obs_'+str(j)+'.pickle','wb'))
+            # Run Bayesian analysis
+            for j in range(len(obs_J)):
+                frames.append(posterior.update(log_lkls[j], bounds[j], points), cond, j)
+        frames.flush()
 
+    if args.prune is not None:
+        print('{} of {} grid points active, discarded posterior mass at most {:.3g}'.format(
+            len(posterior.active), len(engine), posterior.discarded_bound))
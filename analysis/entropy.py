@@ -7,92 +7,73 @@ __date__ = "May 17, 2017"
 
 import numpy as np
 import pickle
-import pandas as pd
 import os
+import sys
+from bayes import FrameStore
 
-def make_df(probfile):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from parameter_grid import MATERIAL_GRID
+
+# Grid of the forward simulations, in the order of the grid points (Nt_i fastest)
+GRID_SHAPE = MATERIAL_GRID.shape
+
+def calc_entropy(pmf, axis=-1):
     """
-    Make PMF into a DataFrame for easier manipulation
+    Calculate sum of P log P for entropy calculation. Assumes probabilities are propertly normalized. For stacked PMFs
+    the entropy is taken along axis, so a whole array of frames is handled at once.
     """
-    # load probability pickle file
-    prob = pickle.load(open(probfile,'rb'))
-
-    # Convert into dataframe
-    mu_n_range = np.linspace(20,80,20)
-    Nt_SnS_range = np.logspace(16,18,20)
-    EA_ZnOS_range = np.linspace(3.4,4.3,15)
-    Nt_i_range = np.logspace(10,14,16)
-
-    probslist = np.zeros([len(prob),5])
-    i = 0
-    for mu_n in mu_n_range:
-        for Nt in Nt_SnS_range:
-            for EA in EA_ZnOS_range:
-                for Nt_i in Nt_i_range:
-                    probslist[i,0] = mu_n
-                    probslist[i,1] = Nt
-                    probslist[i,2] = EA
-                    probslist[i,3] = Nt_i
-                    probslist[i,4] = prob[i]
-                    i += 1
-
-    df = pd.DataFrame(probslist, columns=['mu','Nt','EA','Nt_i','prob'] )
-    return df
-
-
-def calc_entropy(pmf):
+    pmf = np.asarray(pmf, dtype=np.float64)
+    plogp = np.zeros_like(pmf)
+    nonzero = pmf != 0
+    plogp[nonzero] = pmf[nonzero] * np.log(pmf[nonzero])
+    return -1.0 * np.sum(plogp, axis=axis) / np.log(pmf.shape[axis])
+
+def marginalize(frames, grid_shape=GRID_SHAPE):
+    """
+    Marginal PMFs of a stack of frames of shape (frame, grid point). Each PMF is reshaped onto the grid axes and the
+    other dimensions are summed out. Returns (marginals, pairwise), where marginals[a] has shape (frame, len(axis a))
+    and pairwise[(a, b)], for a < b, is the 2-D marginal of shape (frame, len(axis a), len(axis b)).
+
+    Every frame is handled at once, but each pairwise marginal is its own reduction over the full grid: six of them for
+    the four axes of the material grid. The 1-D marginals are then summed from the small pairwise ones.
     """
-    Calculate sum of P log P for entropy calculation. Assumes probabilities are propertly normalized
+    frames = np.asarray(frames).reshape((-1,) + tuple(grid_shape))
+    ndim = len(grid_shape)
+
+    pairwise = {}
+    for a in range(ndim):
+        for b in range(a + 1, ndim):
+            pairwise[(a, b)] = frames.sum(axis=tuple(1 + k for k in range(ndim) if k not in (a, b)))
+
+    # The 1-D marginals follow from the 2-D ones, without a further reduction over the full grid
+    if ndim == 1:
+        marginals = [frames]
+    else:
+        marginals = [pairwise[(a, a + 1)].sum(axis=2) if a + 1 < ndim else pairwise[(a - 1, a)].sum(axis=1)
+                     for a in range(ndim)]
+    return marginals, pairwise
+
+def calc_entropies(frames, grid_shape=GRID_SHAPE):
     """
-    return -1.0 * np.sum([ pmf[k] * np.log(pmf[k]) for k in range(len(pmf)) if not pmf[k]==0]) / np.log(len(pmf))
+    Total and marginal entropies of a stack of frames of shape (frame, grid point). Returns (total, marginal) where
+    total has shape (frame,) and marginal has shape (frame, number of grid axes).
+    """
+    frames = np.asarray(frames).reshape(-1, int(np.prod(grid_shape)))
+    marginals, _ = marginalize(frames, grid_shape)
+    return calc_entropy(frames), np.column_stack([calc_entropy(m) for m in marginals])
 
 if __name__ == "__main__":
-    prob_files = os.listdir('probs/')
-    prob_files.sort()
-
-    num_obs = len(prob_files)
-
-    # Parameter ranges used in the forward simulations
-    num_mu, num_Nt, num_EA, num_Nt_i = 20, 20, 15, 16
-    mu_n_range = np.linspace(20, 80, num_mu)
-    Nt_SnS_range = np.logspace(16, 18, num_Nt)
-    EA_ZnOS_range = np.linspace(3.4, 4.3, num_EA)
-    Nt_i_range = np.logspace(10, 14, num_Nt_i)
-    num_simulations = num_mu * num_Nt * num_EA * num_Nt_i
-
-    # where the entropy numbers will go:
-    total_entropies, mu_entropies, Nt_entropies, EA_entropies, Nt_i_entropies = np.zeros(num_obs), np.zeros(num_obs), \
-                                                                np.zeros(num_obs), np.zeros(num_obs), np.zeros(num_obs)
-
-
-    # Iterate over observations, for now in sequential order, update the Bayes inference and calculate entropy
-    for i in range(num_obs):
-        df = make_df('probs/'+prob_files[i])
-
-        total_probs, mu_probs, Nt_probs, EA_probs, Nt_i_probs = df['prob'].to_dict().values(), \
-                                                                dict.fromkeys(mu_n_range, 0), \
-                                                                dict.fromkeys(Nt_SnS_range, 0), \
-                                                                dict.fromkeys(EA_ZnOS_range, 0), \
-                                                                dict.fromkeys(Nt_i_range, 0)
-
-        # For all except total, sum out other dimensions.
-        for j in range(num_simulations):
-            # Pull values for each parameter
-            mu_j, Nt_j, EA_j, Nt_i_j, prob_j = df.loc[j]['mu'], df.loc[j]['Nt'], df.loc[j]['EA'], \
-                                                df.loc[j]['Nt_i'], df.loc[j]['prob']
-
-            # Add probability to appropriate tally
-            mu_probs[mu_j] += prob_j
-            Nt_probs[Nt_j] += prob_j
-            EA_probs[EA_j] += prob_j
-            Nt_i_probs[Nt_i_j] += prob_j
-
-        # Compute the entropies from marginalized PMF
-        total_entropies[i] = calc_entropy(total_probs)
-        mu_entropies[i] = calc_entropy(mu_probs.values())
-        Nt_entropies[i] = calc_entropy(Nt_probs.values())
-        EA_entropies[i] = calc_entropy(EA_probs.values())
-        Nt_i_entropies[i] = calc_entropy(Nt_i_probs.values())
+    # Probability frames written by bayes.py
+    frames = FrameStore.open('probs')
+
+    num_obs = len(frames)
+
+    # Frames evaluated on a refined grid (bayes.py -refine) record their grid
+    grid_shape = frames.grid.shape if frames.grid is not None else GRID_SHAPE
+
+    # All frames are reduced at once with axis sums over the grid
+    total_entropies, marginal_entropies = calc_entropies(frames.frames[:num_obs], grid_shape)
+    mu_entropies, Nt_entropies, EA_entropies, Nt_i_entropies = marginal_entropies.T
 
     # Save entropies
     if not os.path.exists('entropies'):
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Sensitivity of the posterior to the assumed current errors. The final posterior of the observations in
+observation_data is evaluated for a whole set of error models in one pass over the simulated currents: the squared
+residuals of every grid point are computed once per chunk of the grid, and since the Gaussian log-likelihood is linear
+in them for fixed errors, the log-posteriors of all the error models follow from a single matrix product. For every
+model, the MAP estimate and the total and marginal entropies are reported, together with how far they move across the
+models.
+
+The models are the full-factorial combinations of the -floor, -offset and -scale values of a ProportionalErrorModel:
+
+$:analysis# python error_sweep.py -floor 0.25 0.5 1.0 -scale 0.1 0.15 0.2 -out probs_error_sweep
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Riley Brandt, Rachel Kurchin"
+__date__ = "May 17, 2017"
+
+import numpy as np
+import os
+import sys
+import itertools
+import argparse
+from bayes import LikelihoodEngine, FrameStore, ProportionalErrorModel, gaussian_error_terms, logsumexp, read_obs
+from entropy import calc_entropies
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from results_store import ResultStore
+
+def sweep_log_posterior(engine, observations, error_models, chunk_size=None, log_prior=None):
+    """
+    Normalized log-posteriors after all of observations, a tuple of equal-length (J, V, T, ill) arrays, for each of
+    error_models (callables from observed currents to their errors, such as ProportionalErrorModel), of shape
+    (model, grid point). The grid is processed in chunks of chunk_size points, by default about 2M residuals each.
+    """
+    J, V, T, ill = [np.asarray(x, dtype=np.float64) for x in observations]
+    J_err = np.array([model(J) for model in error_models], dtype=np.float64)
+    # log_likelihood() of LikelihoodEngine, summed over the observations: a constant per model minus the squared
+    # residuals weighted by the model's errors
+    log_norms, weights = gaussian_error_terms(J_err)
+    offsets = log_norms.sum(axis=1)
+
+    num_points = len(engine)
+    chunk_size = chunk_size or max(256, 2**21 // max(len(J), 1))
+    log_post = np.empty((len(error_models), num_points), dtype=np.float64)
+    for start in range(0, num_points, chunk_size):
+        stop = min(start + chunk_size, num_points)
+        chunk = LikelihoodEngine(engine.currents[start:stop], engine.voltages, engine.temperatures,
+                                 engine.illuminations)
+        residuals = (J[:, None] - chunk.model_currents(V, T, ill))**2
+        missing = np.isnan(residuals).any(axis=0)
+        residuals[:, missing] = 0.0
+        log_post[:, start:stop] = offsets[:, None] - np.dot(weights, residuals)
+        log_post[:, start:stop][:, missing] = -np.inf
+
+    if log_prior is not None:
+        log_post += log_prior
+    log_post -= logsumexp(log_post, axis=1)[:, None]
+    return log_post
+
+def summarize(log_post, grid):
+    """
+    MAP grid point, its posterior probability, and the total and marginal entropies of each row of log_post, as a list
+    of dictionaries
+    """
+    prob = np.exp(log_post)
+    total, marginal = calc_entropies(prob, grid.shape)
+    summaries = []
+    for row, p in enumerate(prob):
+        index = int(np.argmax(p))
+        summaries.append({'map': index, 'map_coords': grid.coords(index), 'map_prob': float(p[index]),
+                          'entropy': float(total[row]),
+                          'marginal_entropies': dict(zip(grid.names, marginal[row].tolist()))})
+    return summaries
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sensitivity of the posterior to the assumed current errors")
+    parser.add_argument('-store', help="Result store written by process_pickles.py",
+                        default='../running_sims/pickles/simulation_store')
+    parser.add_argument('-floor', help="Smallest assumed current errors (mA)", type=float, nargs='+', default=[0.5])
+    parser.add_argument('-offset', help="Offsets of the current the error is proportional to (mA)", type=float,
+                        nargs='+', default=[19.5])
+    parser.add_argument('-scale', help="Errors relative to the offset current", type=float, nargs='+',
+                        default=[0.1, 0.15, 0.2])
+    parser.add_argument('-chunk', help="Grid points per chunk", type=int, default=None)
+    parser.add_argument('-out', help="Frame store for the final posterior of every model", default=None)
+    args = parser.parse_args()
+
+    models = [ProportionalErrorModel(floor, offset, scale)
+              for floor, offset, scale in itertools.product(args.floor, args.offset, args.scale)]
+
+    print('Opening results store...')
+    store = ResultStore(args.store)
+    engine = LikelihoodEngine.from_store(store)
+    grid = store.grid()
+
+    conds = ['280_31', '280_108', '300_31', '300_108', '320_31', '320_108']
+    obs_T, obs_ill, obs_V, obs_J = [np.concatenate(x) for x in
+                                    zip(*[read_obs('observation_data/obs_'+cond+'.txt') for cond in conds])]
+
+    print('Evaluating the posterior for {} error models...'.format(len(models)))
+    log_post = sweep_log_posterior(engine, (obs_J, obs_V, obs_T, obs_ill), models, chunk_size=args.chunk)
+    summaries = summarize(log_post, grid)
+
+    print("{:>7} {:>7} {:>7} {:>8} {:>9} {:>8}  {}".format('floor', 'offset', 'scale', 'MAP', 'P(MAP)', 'entropy',
+                                                        '  '.join("{:>10}".format(name) for name in grid.names)))
+    for model, summary in zip(models, summaries):
+        print("{:>7g} {:>7g} {:>7g} {:>8} {:>9.3g} {:>8.4f}  {}".format(
+            model.floor, model.offset, model.scale, summary['map'], summary['map_prob'], summary['entropy'],
+            '  '.join("{:>10.4f}".format(summary['marginal_entropies'][name]) for name in grid.names)))
+
+    # How far the estimates move across the error models
+    maps = sorted(set(summary['map'] for summary in summaries))
+    print("{} distinct MAP estimates:".format(len(maps)))
+    for index in maps:
+        print("  {} {}".format(index, ", ".join("{}={:.4g}".format(name, value)
+                                                for name, value in grid.coords(index).items())))
+    for name in grid.names:
+        values = [summary['marginal_entropies'][name] for summary in summaries]
+        print("{} marginal entropy: {:.4f} to {:.4f}".format(name, min(values), max(values)))
+
+    if args.out:
+        frames = FrameStore.create(args.out, len(models), len(engine), grid=grid)
+        for model, row in zip(models, log_post):
+            frames.append(np.exp(row), repr(model), len(obs_J))
+        frames.flush()
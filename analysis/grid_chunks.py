@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Parallel evaluation over chunks of the grid-point axis, shared by sharded_posterior.py and batch_inference.py. The grid
+is split into (start, stop) chunks sized by chunk_bounds(), and worker_pool() runs a task per chunk in a pool whose
+processes are set up once with the data every task reads (the engine, the observations...), available to the tasks as
+worker_state.
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Riley Brandt, Rachel Kurchin"
+__date__ = "May 17, 2017"
+
+from contextlib import contextmanager
+from multiprocessing import Pool, cpu_count
+
+# Set in every worker process by the pool initializer, so that the tasks run under any start method. The engine of a
+# memory-mapped store travels as a reference to the file, see LikelihoodEngine.__getstate__ in bayes.py.
+worker_state = {}
+
+def _init_worker(state):
+    worker_state.clear()
+    worker_state.update(state)
+
+def chunk_bounds(num_points, num_obs, ncores=None, chunk_size=None):
+    """
+    (start, stop) bounds of the chunks of chunk_size grid points covering num_points points. chunk_size defaults to about
+    2M likelihood evaluations of num_obs observations per chunk, and no more than needed to give each of ncores
+    processes (all cores by default) a chunk.
+    """
+    if chunk_size is None:
+        ncores = ncores or cpu_count()
+        chunk_size = max(256, min(num_points // ncores + 1, 2**21 // max(num_obs, 1)))
+    return [(start, min(start + chunk_size, num_points)) for start in range(0, num_points, chunk_size)]
+
+@contextmanager
+def worker_pool(ncores, num_tasks, **state):
+    """
+    Context giving an imap-like function that runs tasks over min(ncores, num_tasks) processes (all cores by default)
+    with worker_state set to state, or in this process if only one is needed. Results come in completion order.
+    worker_state is cleared on exit.
+    """
+    ncores = ncores or cpu_count()
+    if ncores > 1 and num_tasks > 1:
+        pool = Pool(min(ncores, num_tasks), initializer=_init_worker, initargs=(state,))
+        imap = pool.imap_unordered
+    else:
+        pool, imap = None, map
+        _init_worker(state)
+    try:
+        yield imap
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        worker_state.clear()
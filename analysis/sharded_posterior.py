@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Out-of-core evaluation of the posterior frames of bayes.py, for grids whose currents or posterior do not fit in memory.
+The grid-point axis is split into shards of chunk_size points that are processed in parallel, each reading only its
+slice of the memory-mapped result store. A shard's log-posterior after every observation is the log prior plus the
+running sum of its log-likelihoods, so it needs nothing from the other shards except the normalizing constant of each
+frame; the shards write their unnormalized log-posteriors straight into the frame store and return their per-frame
+log-sum-exp, which the coordinator combines across shards. A second pass over the shards then normalizes the frames in
+place. Peak memory is set by chunk_size and the number of observations, not by the size of the grid.
+
+The frames are the same as those of the sequential PosteriorUpdater loop of bayes.py (to rounding), which renormalizes
+after every observation instead of once at the end. Pruning is not supported, since every shard is evaluated in full.
+
+$:analysis# python bayes.py -ncores 16 -chunk 20000
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Riley Brandt, Rachel Kurchin"
+__date__ = "May 17, 2017"
+
+import numpy as np
+from bayes import LikelihoodEngine, FrameStore, logsumexp
+from grid_chunks import chunk_bounds, worker_pool, worker_state
+
+def shard_log_posterior(engine, observations, start, stop, log_prior=None):
+    """
+    Unnormalized log-posteriors of the grid points start:stop after each observation in turn, of shape
+    (observation, point). observations is a tuple of equal-length (J, V, T, ill, J_err) arrays in the order they are fed
+    in; log_prior is over the whole grid (uniform by default).
+    """
+    J, V, T, ill, J_err = observations
+    shard = LikelihoodEngine(engine.currents[start:stop], engine.voltages, engine.temperatures, engine.illuminations)
+    log_post = shard.log_likelihood(J, V, T, ill, J_err)
+    np.cumsum(log_post, axis=0, out=log_post)
+    if log_prior is not None:
+        log_post += np.asarray(log_prior[start:stop], dtype=np.float64)
+    return log_post
+
+def _evaluate_worker(bounds):
+    """
+    First pass: write the unnormalized log-posteriors of a shard into the frames, return their per-frame log-sum-exp
+    """
+    state = worker_state
+    start, stop = bounds
+    log_post = shard_log_posterior(state['engine'], state['observations'], start, stop, state['log_prior'])
+    frames = FrameStore.open(state['path'], mode='r+').frames
+    frames[:, start:stop] = log_post
+    frames.flush()
+    return logsumexp(log_post, axis=1)
+
+def _normalize_worker(task):
+    """
+    Second pass: turn the log-posteriors of a shard into probabilities with the combined normalizing constants
+    """
+    start, stop, log_norm = task
+    frames = FrameStore.open(worker_state['path'], mode='r+').frames
+    frames[:, start:stop] = np.exp(frames[:, start:stop] - log_norm[:, None])
+    frames.flush()
+
+def sharded_posterior(engine, observations, frames, ncores=None, chunk_size=None, log_prior=None):
+    """
+    Fill the frame store frames, which must have room for one frame per observation, with the posterior after each
+    observation, over the grid points of engine (normally LikelihoodEngine.from_store on a memory-mapped store). The
+    grid is processed in shards of chunk_size points over ncores processes (all cores by default); chunk_size defaults
+    to about 2M likelihood evaluations per shard. Returns the log of the normalizing constant of each frame: the log
+    evidence of the observations up to it, if log_prior is normalized.
+    """
+    observations = tuple(np.asarray(x, dtype=np.float64) for x in observations)
+    num_points, num_obs = len(engine), len(observations[0])
+    if frames.frames.shape != (num_obs, num_points):
+        raise ValueError("Frame store of shape {} for {} observations on {} grid points".format(
+            frames.frames.shape, num_obs, num_points))
+    shards = chunk_bounds(num_points, num_obs, ncores, chunk_size)
+
+    # Everything written so far must be on disk before the workers open the frames on their own
+    frames.frames.flush()
+    log_norm = np.full(num_obs, -np.inf)
+    with worker_pool(ncores, len(shards), engine=engine, observations=observations, log_prior=log_prior,
+                     path=frames.path) as imap:
+        for shard_norm in imap(_evaluate_worker, shards):
+            log_norm = np.logaddexp(log_norm, shard_norm)
+        # The constants only exist once the workers have started, so they travel with the tasks
+        for _ in imap(_normalize_worker, [(start, stop, log_norm) for start, stop in shards]):
+            pass
+    return log_norm if log_prior is not None else log_norm - np.log(num_points)
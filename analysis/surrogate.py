@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Interpolating surrogate for the forward simulations, so that the posterior can be evaluated on a finer parameter grid
+than was simulated. J(V) is interpolated multilinearly between the simulated grid points, along every axis in the space
+it was sampled in: log10 for logspace axes (the defect densities) and linear otherwise (mobility, electron affinity).
+
+Run as a script to measure the interpolation error against held-out simulations: the store is thinned to every
+stride-th value along each axis, the surrogate built on the remaining points predicts the dropped ones, and the
+errors are reported for interpolation in log and in linear space, so you can decide how coarse a sweep can be and
+which space to interpolate the logspace axes in.
+
+$:analysis# python surrogate.py ../running_sims/pickles/simulation_store -stride 2 3 4
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Riley Brandt, Rachel Kurchin"
+__date__ = "May 17, 2017"
+
+import numpy as np
+import os
+import sys
+import argparse
+from bayes import LikelihoodEngine
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from parameter_grid import ParameterGrid
+from results_store import ResultStore
+
+def is_log_axis(values, rtol=1e-6):
+    """
+    True if the axis values are positive and evenly spaced in log space but not in linear space, as from np.logspace
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 3 or np.any(values <= 0):
+        return False
+    log_steps, steps = np.diff(np.log(values)), np.diff(values)
+    return np.allclose(log_steps, log_steps[0], rtol=rtol) and not np.allclose(steps, steps[0], rtol=rtol)
+
+def refine(grid, factor, log_axes=None):
+    """
+    Grid with factor - 1 points inserted between consecutive values of every axis, evenly spaced in the space the axis
+    is interpolated in
+    """
+    axes = []
+    for name, values in zip(grid.names, grid.axes):
+        log = is_log_axis(values) if log_axes is None else name in log_axes
+        x = np.log10(values) if log else np.asarray(values, dtype=np.float64)
+        fine = np.interp(np.arange((len(x) - 1) * factor + 1) / factor, np.arange(len(x)), x)
+        axes.append((name, 10**fine if log else fine))
+    return ParameterGrid(axes)
+
+def thin(grid, stride):
+    """
+    Per-axis indices of every stride-th value of each axis of grid, always including the last value so that the
+    thinned grid spans the same range
+    """
+    return [np.union1d(np.arange(0, n, stride), [n - 1]) for n in grid.shape]
+
+class GridSurrogate(object):
+    """
+    Multilinear interpolation of simulated currents over a full-factorial parameter grid
+    """
+
+    def __init__(self, currents, grid, voltages, temperatures, illuminations, log_axes=None):
+        """
+        currents: array of shape (grid point, temperature, illumination, voltage) on the points of grid, in C order
+
+        log_axes: names of the axes to interpolate in log10 space; by default the logspace axes are detected
+        """
+        if currents.shape[0] != len(grid):
+            raise ValueError("{} simulated points for a grid of {}".format(currents.shape[0], len(grid)))
+        self.currents = currents
+        self.grid = grid
+        self.voltages = np.asarray(voltages)
+        self.temperatures = np.asarray(temperatures)
+        self.illuminations = np.asarray(illuminations)
+        if log_axes is None:
+            log_axes = [name for name, values in zip(grid.names, grid.axes) if is_log_axis(values)]
+        self.log_axes = list(log_axes)
+
+    @classmethod
+    def from_store(cls, store, log_axes=None):
+        """
+        Surrogate on the memory-mapped currents of a ResultStore
+        """
+        return cls(store.currents, store.grid(), store.voltages, store.temperatures, store.illuminations, log_axes)
+
+    def _transform(self, name, values):
+        values = np.asarray(values, dtype=np.float64)
+        return np.log10(values) if name in self.log_axes else values
+
+    def weights(self, params):
+        """
+        Per-axis (lower index, weight of the upper neighbour) of the points given by params, a mapping of parameter name
+        to equal-length arrays. Raises ValueError for points outside the grid.
+        """
+        lo, w = [], []
+        for name, axis in zip(self.grid.names, self.grid.axes):
+            x, x_axis = self._transform(name, params[name]), self._transform(name, axis)
+            span = np.abs(x_axis[-1] - x_axis[0])
+            if np.any(x < x_axis[0] - 1e-9 * span) or np.any(x > x_axis[-1] + 1e-9 * span):
+                raise ValueError("{} values {} outside the simulated range [{}, {}]".format(name, params[name], axis[0],
+                                                                                         axis[-1]))
+            pos = np.interp(x, x_axis, np.arange(len(axis)))
+            i = np.clip(np.floor(pos).astype(int), 0, max(len(axis) - 2, 0))
+            lo.append(i)
+            w.append(np.clip(pos - i, 0.0, 1.0))
+        return lo, w
+
+    def interpolate(self, params, chunk=4096):
+        """
+        Interpolated currents at the points given by params, of shape (point, temperature, illumination, voltage). A
+        missing simulation at any corner with a nonzero weight makes the interpolated value NaN.
+        """
+        lo, w = self.weights(params)
+        num_points = len(lo[0])
+        out = np.empty((num_points,) + self.currents.shape[1:], dtype=np.float64)
+        corners = [[(c >> k) & 1 for k in range(self.grid.ndim)] for c in range(2**self.grid.ndim)]
+
+        for start in range(0, num_points, chunk):
+            part = slice(start, min(start + chunk, num_points))
+            total = np.zeros((part.stop - start,) + self.currents.shape[1:])
+            for corner in corners:
+                index, weight = [], np.ones(part.stop - start)
+                for k, up in enumerate(corner):
+                    index.append(np.minimum(lo[k][part] + up, self.grid.shape[k] - 1))
+                    weight *= w[k][part] if up else 1.0 - w[k][part]
+                used = weight > 0
+                if not used.any():
+                    continue
+                values = np.asarray(self.currents[self.grid.flat_index([i[used] for i in index])], dtype=np.float64)
+                total[used] += weight[used, None, None, None] * values
+            out[part] = total
+        return out
+
+    def engine(self, grid):
+        """
+        LikelihoodEngine on the interpolated currents of every point of grid, e.g. refine(self.grid, factor)
+        """
+        return LikelihoodEngine(self.interpolate(grid.coordinate_arrays()), self.voltages, self.temperatures,
+                                self.illuminations)
+
+def held_out_error(currents, grid, voltages, temperatures, illuminations, stride, log_axes=None):
+    """
+    Interpolation error of a sweep thinned to every stride-th value along each axis, measured on the simulated points
+    that were dropped. Returns a dictionary with the number of held-out points and the RMS, 95th percentile and maximum
+    absolute error of J, ignoring missing runs.
+    """
+    # The thinned axes keep their last value, so they are no longer evenly spaced and the log axes are detected here
+    if log_axes is None:
+        log_axes = [name for name, values in zip(grid.names, grid.axes) if is_log_axis(values)]
+    keep = thin(grid, stride)
+    coarse = ParameterGrid([(name, axis[k]) for name, axis, k in zip(grid.names, grid.axes, keep)])
+    coarse_ids = grid.flat_index([m.ravel() for m in np.meshgrid(*keep, indexing='ij')])
+    surrogate = GridSurrogate(np.asarray(currents[np.sort(coarse_ids)]), coarse, voltages, temperatures,
+                              illuminations, log_axes)
+
+    held_out = np.setdiff1d(np.arange(len(grid)), coarse_ids)
+    errors = []
+    for start in range(0, len(held_out), 4096):
+        ids = held_out[start:start + 4096]
+        error = surrogate.interpolate(grid.coords(ids)) - np.asarray(currents[ids])
+        errors.append(np.abs(error[np.isfinite(error)]))
+    errors = np.concatenate(errors) if errors else np.zeros(0)
+    if not len(errors):
+        return {'stride': stride, 'coarse_points': len(coarse), 'held_out': len(held_out), 'rms': np.nan,
+                'p95': np.nan, 'max': np.nan}
+    return {'stride': stride, 'coarse_points': len(coarse), 'held_out': len(held_out),
+            'rms': float(np.sqrt(np.mean(errors**2))), 'p95': float(np.percentile(errors, 95)),
+            'max': float(errors.max())}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Interpolation error of coarser sweeps against held-out simulations")
+    parser.add_argument('store', help="Result store written by process_pickles.py")
+    parser.add_argument('-stride', help="Thinning strides to evaluate", type=int, nargs='+', default=[2, 3, 4])
+    args = parser.parse_args()
+
+    store = ResultStore(args.store)
+    grid = store.grid()
+    log_axes = [name for name, axis in zip(grid.names, grid.axes) if is_log_axis(axis)]
+    print("{}, logspace axes: {}".format(grid, ", ".join(log_axes)))
+
+    # Power-law dependences interpolate better linearly, exponential ones in log space, so both are reported
+    print("{:>7} {:>8} {:>14} {:>10} {:>12} {:>12} {:>12}".format('stride', 'space', 'coarse points', 'held out',
+                                                                  'RMS (mA)', 'p95 (mA)', 'max (mA)'))
+    for stride in args.stride:
+        for space, axes in (('log', log_axes), ('linear', [])):
+            result = held_out_error(store.currents, grid, store.voltages, store.temperatures, store.illuminations,
+                                    stride, axes)
+            print("{stride:>7} {space:>8} {coarse_points:>14} {held_out:>10} {rms:>12.4f} {p95:>12.4f} "
+                  "{max:>12.4f}".format(space=space, **result))
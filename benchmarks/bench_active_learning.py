@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Compares the active-learning sweep of analysis/active_learning.py against the full-factorial sweep on a synthetic
+forward model: observations are generated from one grid point with noise, the full-grid posterior serves as the
+reference, and each acquisition strategy reports how many grid points (and SCAPS runs) it needed before its MAP estimate
+matched and its marginal entropies came within tolerance of the reference.
+
+$:pv_bayes# python benchmarks/bench_active_learning.py -budget 0.1 -batch 200
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Riley Brandt, Rachel Kurchin"
+__date__ = "May 17, 2017"
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'analysis'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from bayes import LikelihoodEngine, ProportionalErrorModel, logsumexp
+from entropy import calc_entropies
+from active_learning import ActiveLearner
+from parameter_grid import SWEEP_GRID, MATERIAL_GRID
+from synthetic import synthetic_currents
+
+voltages = np.linspace(0, 0.5, 26)
+temperatures = SWEEP_GRID.axis('T_l')
+illuminations = SWEEP_GRID.axis('ill_l')
+
+def forward_model(ids):
+    return synthetic_currents(MATERIAL_GRID.coords(np.asarray(ids)), temperatures, illuminations, voltages)
+
+def make_observations(truth, noise, seed=0):
+    """
+    Noisy J(V) of the grid point truth at every temperature and illumination, with the error model of bayes.py
+    """
+    J = forward_model([truth])[0]
+    T, ill, V = [a.ravel() for a in np.meshgrid(temperatures, illuminations, voltages, indexing='ij')]
+    J = J.ravel() + np.random.RandomState(seed).normal(0.0, noise, J.size)
+    J_err = ProportionalErrorModel()(J)
+    return J, V, T, ill, J_err
+
+def full_sweep(observations, chunk=8000):
+    """
+    Log-likelihood of every grid point, as from the full-factorial sweep
+    """
+    log_lkl = np.empty(len(MATERIAL_GRID))
+    for start in range(0, len(MATERIAL_GRID), chunk):
+        ids = np.arange(start, min(start + chunk, len(MATERIAL_GRID)))
+        engine = LikelihoodEngine(forward_model(ids), voltages, temperatures, illuminations)
+        log_lkl[ids] = engine.log_likelihood(*observations).sum(axis=0)
+    return log_lkl
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Active learning vs. full sweep on a synthetic forward model")
+    parser.add_argument('-budget', help="Fraction of the grid the active learner may simulate", type=float,
+                        default=0.1)
+    parser.add_argument('-batch', help="Grid points simulated per batch", type=int, default=200)
+    parser.add_argument('-stride', help="Stride of the initial design along every axis", type=int, default=3)
+    parser.add_argument('-noise', help="Noise of the synthetic observations (mA/cm2)", type=float, default=0.2)
+    parser.add_argument('-tol', help="Tolerance on the marginal entropies", type=float, default=0.01)
+    parser.add_argument('-truth', help="Multi-index of the true grid point", type=int, nargs=4, default=[12, 7, 9, 5])
+    args = parser.parse_args()
+
+    truth = int(MATERIAL_GRID.flat_index(args.truth))
+    observations = make_observations(truth, args.noise)
+
+    start = time.time()
+    log_lkl = full_sweep(observations)
+    log_post = log_lkl - logsumexp(log_lkl)
+    total, marginal = calc_entropies(np.exp(log_post)[None, :])
+    ref_map, ref_marginal = int(np.argmax(log_lkl)), marginal[0]
+    print("Full sweep: {} grid points ({} SCAPS runs), {:.1f} s".format(len(MATERIAL_GRID), 6 * len(MATERIAL_GRID),
+                                                                      time.time() - start))
+    print("  truth {}, MAP {}, entropy {:.4f}, marginal entropies {}".format(
+        args.truth, [int(i) for i in MATERIAL_GRID.multi_index(ref_map)], total[0], np.round(ref_marginal, 4)))
+
+    budget = int(args.budget * len(MATERIAL_GRID))
+    print("{:>8} {:>10} {:>12} {:>9} {:>14} {:>10} {:>9}".format('strategy', 'converged', 'SCAPS runs', 'fraction',
+                                                                   'final dH_max', 'final MAP', 'time (s)'))
+    for strategy in ActiveLearner.STRATEGIES:
+        start = time.time()
+        learner = ActiveLearner(forward_model, observations, voltages, temperatures, illuminations)
+        history = learner.run(budget, batch_size=args.batch, strategy=strategy, stride=args.stride)
+        converged = None
+        for summary in history:
+            dH = np.max(np.abs(np.array(summary['marginal_entropies']) - ref_marginal))
+            if summary['map'] == ref_map and dH < args.tol and converged is None:
+                converged = summary['simulated']
+            elif summary['map'] != ref_map or dH >= args.tol:
+                converged = None
+        final = history[-1]
+        dH = np.max(np.abs(np.array(final['marginal_entropies']) - ref_marginal))
+        print("{:>8} {:>10} {:>12} {:>9} {:>14.2e} {:>10} {:>9.1f}".format(
+            strategy, converged if converged is not None else '-',
+            6 * converged if converged is not None else '-',
+            "{:.1%}".format(converged / len(MATERIAL_GRID)) if converged is not None else '-',
+            dH, 'match' if final['map'] == ref_map else 'differs', time.time() - start))
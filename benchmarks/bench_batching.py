@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Measures how much packing several runs into one SCAPS invocation saves when starting WINE and SCAPS dominates the
+solve, using the fake SCAPS executable with a startup delay. Also checks that every batch size returns the same outputs
+as unbatched runs, and that runs of failed batches are recovered by running them on their own.
+
+$:pv_bayes# python benchmarks/bench_batching.py -n 192 -ncores 8 -startup 0.5 -latency 0.02 -batch 1 4 16
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Rachel Kurchin, Riley Brandt, Daniil Kitchaev"
+__date__ = "May 17, 2017"
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from run_scaps_parallel import SCAPSrunner
+from run_forward_simulations import scaps_script_generator, scaps_output_processor
+from parameter_grid import SWEEP_GRID
+from fake_scaps import make_exec_dirs, fake_scaps_cmd
+
+def measure(inputs, ncores, batch_size, startup, latency, crash=0.0):
+    """
+    Run the inputs through a SCAPSrunner with the fake SCAPS command and return the wall time, the outputs and the runs
+    that failed for good
+    """
+    exec_dir = tempfile.mkdtemp(prefix='bench_batching_')
+    try:
+        make_exec_dirs(exec_dir, ncores)
+        runner = SCAPSrunner(scaps_script_generator, scaps_output_processor, ncores=ncores, scaps_exec_dir=exec_dir,
+                             batch_size=batch_size, max_retries=10)
+        runner.SCAPS_CMD = fake_scaps_cmd(latency, startup=startup, crash=crash)
+        start = time.time()
+        outputs = runner.run_inputs(inputs, print_progress=False)
+        return time.time() - start, outputs, runner.failures
+    finally:
+        shutil.rmtree(exec_dir)
+
+def same_outputs(a, b):
+    return sorted(a) == sorted(b) and all(np.array_equal(a[id][0], b[id][0]) and np.array_equal(a[id][1], b[id][1])
+                                          for id in a)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs per SCAPS invocation vs. throughput")
+    parser.add_argument('-n', help="Number of runs", type=int, default=192)
+    parser.add_argument('-ncores', help="Number of worker processes", type=int, default=8)
+    parser.add_argument('-startup', help="Seconds to start the fake SCAPS", type=float, default=0.5)
+    parser.add_argument('-latency', help="Seconds per fake SCAPS calculation", type=float, default=0.02)
+    parser.add_argument('-batch', help="Batch sizes to compare", type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('-crash', help="Probability of a fake SCAPS invocation crashing, for the fallback check",
+                        type=float, default=0.2)
+    args = parser.parse_args()
+
+    inputs = SWEEP_GRID.inputs({'def': "SnS_base.scaps", "V_max": 0.5}, ids=range(args.n))
+
+    print("{:>6} {:>10} {:>10} {:>9}".format('batch', 'wall (s)', 'runs/s', 'speedup'))
+    reference = None
+    for batch_size in args.batch:
+        wall, outputs, failures = measure(inputs, args.ncores, batch_size, args.startup, args.latency)
+        if reference is None:
+            reference = (wall, outputs)
+        elif not same_outputs(outputs, reference[1]):
+            raise RuntimeError("Outputs with batch size {} differ from batch size {}".format(batch_size, args.batch[0]))
+        print("{:>6} {:>10.2f} {:>10.1f} {:>8.1f}x".format(batch_size, wall, args.n / wall, reference[0] / wall))
+
+    wall, outputs, failures = measure(inputs, args.ncores, max(args.batch), args.startup, args.latency, args.crash)
+    print("With {:.0%} of invocations crashing, batch size {}: {}/{} outputs, {} failed for good, {:.2f} s".format(
+        args.crash, max(args.batch), len(outputs), args.n, len(set(failures) - set(outputs)), wall))
+    if not same_outputs(outputs, dict((id, reference[1][id]) for id in outputs)):
+        raise RuntimeError("Outputs recovered from failed batches differ")
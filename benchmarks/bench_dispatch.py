@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Measures the CPU overhead of SCAPSrunner's dispatch loop with the fake SCAPS executable, comparing the blocking,
+event-driven dispatcher against the original busy-wait polling implementation.
+
+$:pv_bayes# python benchmarks/bench_dispatch.py -n 200 -ncores 8 -latency 0.05
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Rachel Kurchin, Riley Brandt, Daniil Kitchaev"
+__date__ = "May 17, 2017"
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import resource
+import argparse
+from copy import deepcopy
+from multiprocessing import Process, Queue
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from run_scaps_parallel import SCAPSrunner
+from run_forward_simulations import scaps_script_generator, scaps_output_processor
+from parameter_grid import SWEEP_GRID
+from fake_scaps import make_exec_dirs, fake_scaps_cmd
+
+class PollingSCAPSrunner(SCAPSrunner):
+    """
+    The original busy-wait dispatcher, kept here only as the baseline of the benchmark
+    """
+
+    def run_inputs(self, inputs, print_progress=True):
+        inq = Queue()
+        outq = Queue()
+        output_dict = {}
+        num_total = len(inputs.keys())
+        num_done = 0
+
+        proc_list = []
+        config_all = {'SCAPS_ROOT':self.SCAPS_ROOT, 'SCAPS_CMD':self.SCAPS_CMD,
+                      'SCAPS_EXEC_DIR':self.scaps_exec_dir, 'INPUT_PROC':self.input_processor,
+                      'OUTPUT_PROC':self.output_processor}
+        for proc_i in range(self.ncores):
+            config_proc = deepcopy(config_all)
+            config_proc['CORE'] = proc_i
+            proc = Process(target=PollingSCAPSrunner.run_process, args=(config_proc, inq, outq))
+            proc.start()
+            proc_list.append(proc)
+
+        inputiter = iter(inputs.items())
+        while True:
+            running = any(proc.is_alive() for proc in proc_list)
+            if not running:
+                break
+            while inq.empty():
+                try:
+                    (id, input) = next(inputiter)
+                    inq.put({'id':id,'calc_param':input})
+                except:
+                    inq.put({'id':'done'})
+
+            while not outq.empty():
+                pt = outq.get()
+                output_dict[pt['id']] = pt['output']
+                num_done += 1
+                if print_progress:
+                    print("Finished input ID{} [{}/{} total]".format(pt['id'], num_done, num_total))
+
+        for proc_i, proc in enumerate(proc_list):
+            proc.join()
+
+        while not inq.empty():
+            inq.get()
+        time.sleep(5)
+
+        return output_dict
+
+    @staticmethod
+    def run_process(config, inputs, outq):
+        while True:
+            if not inputs.empty():
+                param = inputs.get()
+                if param['id'] == 'done':
+                    break
+                else:
+                    outq.put(SCAPSrunner.run_scaps_thread(config, param))
+        return
+
+def cpu_time(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+def measure(runner_class, inputs, ncores, latency, points=None, **options):
+    """
+    Run the inputs through a runner with the fake SCAPS command and return wall time, coordinator CPU time and the CPU
+    time of the worker processes (including the fake SCAPS runs they launched). points sets the number of IV points
+    the fake SCAPS writes per run; options are passed on to run_inputs.
+    """
+    exec_dir = tempfile.mkdtemp(prefix='bench_dispatch_')
+    try:
+        make_exec_dirs(exec_dir, ncores)
+        runner = runner_class(scaps_script_generator, scaps_output_processor, ncores=ncores, scaps_exec_dir=exec_dir)
+        runner.SCAPS_CMD = fake_scaps_cmd(latency, points)
+
+        start_wall, start_self, start_children = time.time(), cpu_time(resource.RUSAGE_SELF), \
+                                                 cpu_time(resource.RUSAGE_CHILDREN)
+        outputs = runner.run_inputs(inputs, print_progress=False, **options)
+        result = {'wall': time.time() - start_wall,
+                  'coordinator_cpu': cpu_time(resource.RUSAGE_SELF) - start_self,
+                  'worker_cpu': cpu_time(resource.RUSAGE_CHILDREN) - start_children}
+        if len(outputs) != len(inputs):
+            raise RuntimeError("{} returned {} of {} outputs".format(runner_class.__name__, len(outputs), len(inputs)))
+        return result
+    finally:
+        shutil.rmtree(exec_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Coordinator CPU overhead of SCAPSrunner dispatch")
+    parser.add_argument('-n', help="Number of runs", type=int, default=200)
+    parser.add_argument('-ncores', help="Number of worker processes", type=int, default=8)
+    parser.add_argument('-latency', help="Seconds per fake SCAPS run", type=float, default=0.05)
+    args = parser.parse_args()
+
+    inputs = SWEEP_GRID.inputs({'def': "SnS_base.scaps", "V_max": 0.5}, ids=range(args.n))
+
+    print("{:>14} {:>10} {:>20} {:>15}".format('dispatcher', 'wall (s)', 'coordinator CPU (s)', 'worker CPU (s)'))
+    for name, runner_class in (('polling', PollingSCAPSrunner), ('event-driven', SCAPSrunner)):
+        result = measure(runner_class, inputs, args.ncores, args.latency)
+        print("{:>14} {:>10.2f} {:>20.2f} {:>15.2f}".format(name, result['wall'], result['coordinator_cpu'],
+                                                           result['worker_cpu']))
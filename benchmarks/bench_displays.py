@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Measures the per-run cost of wrapping every SCAPS run in xvfb-run, against reusing long-lived virtual displays from a
+DisplayPool (one per worker, or one shared by all workers), with the fake SCAPS executable in place of WINE and SCAPS.
+Needs Xvfb and xvfb-run; the benchmark is skipped when they are not installed.
+
+$:pv_bayes# python benchmarks/bench_displays.py -n 128 -ncores 8
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Rachel Kurchin, Riley Brandt, Daniil Kitchaev"
+__date__ = "May 17, 2017"
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from run_scaps_parallel import SCAPSrunner
+from run_forward_simulations import scaps_script_generator, scaps_output_processor
+from parameter_grid import SWEEP_GRID
+from fake_scaps import make_exec_dirs, fake_scaps_cmd
+
+def measure(inputs, ncores, displays, latency):
+    """
+    Wall time of running the inputs with the fake SCAPS command, under xvfb-run if displays is None
+    """
+    exec_dir = tempfile.mkdtemp(prefix='bench_displays_')
+    try:
+        make_exec_dirs(exec_dir, ncores)
+        runner = SCAPSrunner(scaps_script_generator, scaps_output_processor, ncores=ncores, scaps_exec_dir=exec_dir,
+                             displays=displays)
+        runner.SCAPS_CMD = SCAPSrunner.XVFB_RUN + fake_scaps_cmd(latency)
+        start = time.time()
+        outputs = runner.run_inputs(inputs, print_progress=False)
+        if len(outputs) != len(inputs):
+            raise RuntimeError("{} of {} runs failed: {}".format(len(inputs) - len(outputs), len(inputs),
+                                                                 runner.failures))
+        return time.time() - start
+    finally:
+        shutil.rmtree(exec_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="xvfb-run per run vs. a pool of persistent virtual displays")
+    parser.add_argument('-n', help="Number of runs", type=int, default=128)
+    parser.add_argument('-ncores', help="Number of worker processes", type=int, default=8)
+    parser.add_argument('-latency', help="Seconds per fake SCAPS run", type=float, default=0.0)
+    args = parser.parse_args()
+
+    missing = [cmd for cmd in ('Xvfb', 'xvfb-run') if which(cmd) is None]
+    if missing:
+        print("Skipping: {} not installed".format(", ".join(missing)))
+        sys.exit(0)
+
+    inputs = SWEEP_GRID.inputs({'def': "SnS_base.scaps", "V_max": 0.5}, ids=range(args.n))
+
+    print("{:>10} {:>10} {:>14} {:>20}".format('displays', 'wall (s)', 'per run (ms)', 'saving per run (ms)'))
+    baseline = None
+    for name, displays in (('xvfb-run', None), ('worker', 'worker'), ('shared', 'shared')):
+        wall = measure(inputs, args.ncores, displays, args.latency)
+        per_run = 1000 * wall * args.ncores / args.n # time each run occupies a worker
+        if baseline is None:
+            baseline = per_run
+        print("{:>10} {:>10.2f} {:>14.1f} {:>20.1f}".format(name, wall, per_run, baseline - per_run))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Benchmarks the single-pass SCAPS IV parser (scaps_output_processor) against the original two-pass implementation on
+synthetic result files of increasing size. tests/test_parser.py checks that both give identical output.
+
+$:pv_bayes# python benchmarks/bench_parser.py -sizes 26 251 2501 -repeat 200
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Rachel Kurchin, Riley Brandt, Daniil Kitchaev"
+__date__ = "May 17, 2017"
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from run_forward_simulations import scaps_output_processor
+from synthetic import iv_curve, write_iv_file, two_pass_output_processor
+
+def time_parser(parser, path, repeat, **kwargs):
+    start = time.time()
+    for _ in range(repeat):
+        parser(path, **kwargs)
+    return (time.time() - start) / repeat
+
+def run(sizes, repeat):
+    """
+    Returns a list of {'points', 'two_pass', 'single_pass', 'single_pass_buffer'} timings in seconds per file
+    """
+    results = []
+    tmp_dir = tempfile.mkdtemp(prefix='bench_parser_')
+    try:
+        for size in sizes:
+            path = os.path.join(tmp_dir, 'pythonresult_{}.txt'.format(size))
+            voltages = np.linspace(0, 0.5, size)
+            write_iv_file(path, voltages, iv_curve(voltages))
+
+            # Keep the quadratic reference from dominating the run time on large files
+            ref_repeat = max(1, repeat // max(1, size // 250))
+            buffer = np.empty((2, size))
+            results.append({'points': size,
+                            'two_pass': time_parser(two_pass_output_processor, path, ref_repeat),
+                            'single_pass': time_parser(scaps_output_processor, path, repeat),
+                            'single_pass_buffer': time_parser(scaps_output_processor, path, repeat, out=buffer)})
+    finally:
+        shutil.rmtree(tmp_dir)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SCAPS IV parser benchmark")
+    parser.add_argument('-sizes', help="Number of IV points per file", type=int, nargs='+', default=[26, 251, 2501])
+    parser.add_argument('-repeat', help="Parses per file and parser", type=int, default=200)
+    args = parser.parse_args()
+
+    print("{:>8} {:>14} {:>14} {:>14} {:>9}".format('points', 'two-pass (us)', 'one-pass (us)', 'buffered (us)',
+                                                    'speedup'))
+    for r in run(args.sizes, args.repeat):
+        print("{:>8} {:>14.1f} {:>14.1f} {:>14.1f} {:>8.1f}x".format(r['points'], 1e6 * r['two_pass'],
+                                                                     1e6 * r['single_pass'],
+                                                                     1e6 * r['single_pass_buffer'],
+                                                                     r['two_pass'] / r['single_pass']))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Sequential posterior updates with and without active-set pruning (PosteriorUpdater(..., prune=...)) on the synthetic
+forward model over the full material grid. For each threshold, reports the time of the update loop, the size of the
+final active set, the bound on the discarded posterior mass, and the total variation distance to the exact posterior,
+which must not exceed the bound.
+
+$:pv_bayes# python benchmarks/bench_pruning.py -prune 10 20 40
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Riley Brandt, Rachel Kurchin"
+__date__ = "May 17, 2017"
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'analysis'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from bayes import LikelihoodEngine, PosteriorUpdater
+from parameter_grid import MATERIAL_GRID
+from synthetic import synthetic_currents, synthetic_observations, OBS_VOLTAGES, OBS_TEMPERATURES, OBS_ILLUMINATIONS
+
+def run(engine, observations, prune):
+    """
+    Sequential update loop of bayes.py. Returns (posterior, updater, seconds).
+    """
+    start = time.time()
+    posterior = PosteriorUpdater(len(engine), prune=prune)
+    for J, V, T, ill, J_err in observations:
+        points = posterior.active
+        log_lkls = engine.log_likelihood(J, V, T, ill, J_err, points=points)
+        bounds = engine.log_likelihood_bound(J_err)
+        for j in range(len(J)):
+            prob = posterior.update(log_lkls[j], bounds[j], points)
+    return prob, posterior, time.time() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Posterior updates with and without active-set pruning")
+    parser.add_argument('-prune', help="Pruning thresholds in nats", type=float, nargs='+', default=[10, 20, 40])
+    parser.add_argument('-num_V', help="Observed biases per condition", type=int, default=26)
+    parser.add_argument('-noise', help="Standard deviation of the observation noise (mA)", type=float, default=0.3)
+    parser.add_argument('-truth', help="Grid point the observations are generated from", type=int, default=41234)
+    args = parser.parse_args()
+
+    engine = LikelihoodEngine(synthetic_currents(MATERIAL_GRID.coordinate_arrays(), OBS_TEMPERATURES, OBS_ILLUMINATIONS,
+                                                 OBS_VOLTAGES), OBS_VOLTAGES, OBS_TEMPERATURES, OBS_ILLUMINATIONS)
+    observations = synthetic_observations(engine, args.truth, args.num_V, args.noise)
+    exact, _, exact_time = run(engine, observations, None)
+    print("{} grid points, {} observations; exact updates {:.2f} s, MAP {}".format(
+        len(engine), sum(len(obs[0]) for obs in observations), exact_time, exact.argmax()))
+
+    print("{:>8} {:>10} {:>9} {:>8} {:>12} {:>12} {:>6}".format('prune', 'time (s)', 'speedup', 'active',
+                                                               'mass bound', 'TV distance', 'MAP'))
+    for prune in args.prune:
+        prob, posterior, seconds = run(engine, observations, prune)
+        distance = 0.5 * np.abs(prob - exact).sum()
+        if distance > posterior.discarded_bound + 1e-12:
+            raise AssertionError("TV distance {} exceeds the bound {}".format(distance, posterior.discarded_bound))
+        print("{:>8g} {:>10.2f} {:>9.1f} {:>8} {:>12.3g} {:>12.3g} {:>6}".format(
+            prune, seconds, exact_time / seconds, len(posterior.active), posterior.discarded_bound, distance,
+            prob.argmax()))
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""
+Compares returning SCAPS outputs to the coordinator through the worker queues (pickled {'id', 'output'} dictionaries)
+with writing them into shared-memory result slots (SharedResults), using the fake SCAPS executable with a range of
+output sizes. Reports wall time and the CPU time of the coordinator, which unpickles every output in the first case.
+
+$:pv_bayes# python benchmarks/bench_shared_results.py -n 400 -ncores 8 -points 26 2501 25001
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Rachel Kurchin, Riley Brandt, Daniil Kitchaev"
+__date__ = "May 17, 2017"
+
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from run_scaps_parallel import SCAPSrunner
+from run_forward_simulations import BASELINE_RUN
+from parameter_grid import SWEEP_GRID
+from shared_results import SharedResults
+from bench_dispatch import measure
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queue vs. shared-memory transfer of SCAPS outputs")
+    parser.add_argument('-n', help="Number of runs", type=int, default=400)
+    parser.add_argument('-ncores', help="Number of worker processes", type=int, default=8)
+    parser.add_argument('-points', help="IV points per output", type=int, nargs='+', default=[26, 2501, 25001])
+    args = parser.parse_args()
+
+    inputs = SWEEP_GRID.inputs(BASELINE_RUN, ids=range(args.n))
+
+    print("{:>8} {:>10} {:>10} {:>20}".format('points', 'transfer', 'wall (s)', 'coordinator CPU (s)'))
+    for points in args.points:
+        for name, options in (('queue', {}), ('shared', {'shared': SharedResults(args.n, points)})):
+            result = measure(SCAPSrunner, inputs, args.ncores, 0.0, points, **options)
+            print("{:>8} {:>10} {:>10.2f} {:>20.2f}".format(points, name, result['wall'], result['coordinator_cpu']))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Stand-in for the SCAPS executable, honoring the same conventions as a SCAPS run launched by SCAPSrunner: it reads
+<prefix>/drive_c/Program Files/Scaps3302/script/<script>, waits for a configurable latency in place of the solve and
+writes a synthetic IV file for every 'save results.iv' line to the results directory. A fixed --startup delay stands in
+for starting WINE and SCAPS. Use it by pointing SCAPS_CMD at it, e.g.
+
+    runner.SCAPS_CMD = 'python benchmarks/fake_scaps.py --latency 0.05 #'
+
+To exercise failure handling it can also hang (--hang) or crash without writing results (--crash) at random. With
+--fail_match, only scripts containing the given text can fail, and with --fail_times N and a --state directory, only the
+first N invocations of each such script do; the state directory counts the invocations of every matching script, so a
+test can tell how often a run was attempted (see invocations()).
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Rachel Kurchin, Riley Brandt, Daniil Kitchaev"
+__date__ = "May 17, 2017"
+
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+import numpy as np
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from synthetic import iv_curve, write_iv_file
+
+SCAPS_ROOT = os.path.join('drive_c', 'Program Files', 'Scaps3302')
+
+def make_exec_dirs(exec_dir, ncores):
+    """
+    Create the procN folders of a SCAPS execution directory with just the script and results directories SCAPS uses
+    """
+    for core in range(ncores):
+        for sub in ('script', 'results'):
+            path = os.path.join(exec_dir, 'proc{}'.format(core), SCAPS_ROOT, sub)
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+def fake_scaps_cmd(latency=0.0, points=None, hang=0.0, crash=0.0, startup=0.0, fail_match=None, fail_times=None,
+                   state=None):
+    """
+    SCAPS_CMD template that launches this script instead of SCAPS
+    """
+    cmd = '{} {} --latency {}'.format(sys.executable, os.path.abspath(__file__), latency)
+    if points is not None:
+        cmd += ' --points {}'.format(points)
+    if hang:
+        cmd += ' --hang {}'.format(hang)
+    if crash:
+        cmd += ' --crash {}'.format(crash)
+    if startup:
+        cmd += ' --startup {}'.format(startup)
+    if fail_match is not None:
+        cmd += ' --fail_match {}'.format(quote(fail_match))
+    if fail_times is not None:
+        cmd += ' --fail_times {}'.format(fail_times)
+    if state is not None:
+        cmd += ' --state {}'.format(quote(state))
+    return cmd + ' #'
+
+def script_key(script):
+    return hashlib.sha1(script.encode('utf-8')).hexdigest()
+
+def invocations(state, script):
+    """
+    Number of times a script matching --fail_match was run with the state directory state
+    """
+    path = os.path.join(state, script_key(script))
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r') as f:
+        return int(f.read())
+
+def may_fail(prefix, script_name, fail_match=None, fail_times=None, state=None):
+    """
+    Whether this invocation is allowed to hang or crash: the script must contain fail_match, if given, and have been
+    run fewer than fail_times times before, counted in the state directory. Counts every matching invocation.
+    """
+    with open(os.path.join(prefix, SCAPS_ROOT, 'script', script_name), 'r') as f:
+        script = f.read()
+    if fail_match is not None and fail_match not in script:
+        return False
+    count = 0
+    if state is not None:
+        count = invocations(state, script)
+        with open(os.path.join(state, script_key(script)), 'w') as f:
+            f.write(str(count + 1))
+    return fail_times is None or count < fail_times
+
+def run_script(prefix, script_name, latency=0.0, points=None):
+    """
+    Emulate SCAPS running a script in the WINE prefix. Every 'calculate' gets an IV sweep from the most recent
+    'action iv.*' settings (or a fixed number of points, if given) and 'save results.iv' writes it out.
+    """
+    root = os.path.join(prefix, SCAPS_ROOT)
+    settings = {'iv.startv': 0.0, 'iv.stopv': 0.5, 'iv.increment': 0.02, 'workingpoint.temperature': 300.0}
+    curve = None
+    with open(os.path.join(root, 'script', script_name), 'r') as f:
+        for line in f:
+            words = line.split()
+            if len(words) == 3 and words[0] == 'action' and words[1] in settings:
+                settings[words[1]] = float(words[2])
+            elif words[:1] == ['calculate']:
+                time.sleep(latency)
+                if points is None:
+                    voltages = np.arange(settings['iv.startv'], settings['iv.stopv'] + settings['iv.increment'] / 2,
+                                         settings['iv.increment'])
+                else:
+                    voltages = np.linspace(settings['iv.startv'], settings['iv.stopv'], points)
+                curve = (voltages, iv_curve(voltages, T=settings['workingpoint.temperature']))
+            elif words[:2] == ['save', 'results.iv'] and curve is not None:
+                write_iv_file(os.path.join(root, 'results', words[2]), curve[0], curve[1], script_name)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake SCAPS executable for benchmarks")
+    parser.add_argument('--latency', help="Seconds each 'calculate' takes", type=float, default=0.0)
+    parser.add_argument('--points', help="Number of IV points per sweep, instead of the scripted sweep", type=int,
+                        default=None)
+    parser.add_argument('--startup', help="Seconds taken to start up, once per invocation", type=float, default=0.0)
+    parser.add_argument('--hang', help="Probability of hanging forever instead of running", type=float, default=0.0)
+    parser.add_argument('--crash', help="Probability of exiting with an error without writing results", type=float,
+                        default=0.0)
+    parser.add_argument('--fail_match', help="Only scripts containing this text hang or crash", default=None)
+    parser.add_argument('--fail_times', help="Only the first invocations of each script hang or crash", type=int,
+                        default=None)
+    parser.add_argument('--state', help="Directory counting the invocations of the scripts that may fail",
+                        default=None)
+    parser.add_argument('prefix', help="WINE prefix (proc folder) SCAPS runs in")
+    parser.add_argument('script', help="Script name within the SCAPS script directory")
+    args = parser.parse_args()
+
+    time.sleep(args.startup)
+    if (args.hang or args.crash) and may_fail(args.prefix, args.script, args.fail_match, args.fail_times, args.state):
+        if random.random() < args.hang:
+            while True:
+                time.sleep(60)
+        if random.random() < args.crash:
+            sys.exit("fake SCAPS crashed on purpose")
+
+    run_script(args.prefix, args.script, latency=args.latency, points=args.points)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Stand-in for Xvfb, honoring the conventions DisplayPool relies on: it takes the lock file <tmp>/.X<n>-lock of its
+display atomically, holding its PID, creates the socket <tmp>/.X11-unix/X<n>, writes the display number to -displayfd
+once it is ready and removes both on SIGTERM. Given a display (:n) it exits with code 1 if the display is held by a live
+server; without one it takes the first free display from 0 up. A lock whose process is gone is taken over, as Xvfb does.
+Point DisplayPool at it with
+
+    DisplayPool(2, xvfb_cmd=[sys.executable, 'benchmarks/fake_xvfb.py', '--tmp', tmp_dir])
+
+with displays.X_TMP_DIR set to the same tmp_dir.
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Daniil Kitchaev"
+__date__ = "July 20, 2016"
+
+import os
+import sys
+import time
+import errno
+import signal
+import argparse
+
+def held_by_live_process(lock_path):
+    try:
+        with open(lock_path, 'r') as f:
+            os.kill(int(f.read().strip()), 0)
+    except ValueError:
+        return True # still being written
+    except (IOError, OSError) as e:
+        return e.errno not in (errno.ESRCH, errno.ENOENT)
+    return True
+
+def take_lock(tmp_dir, number):
+    """
+    Take the lock of display number, as the X server does: link a file holding our PID into place. Returns whether the
+    display is ours.
+    """
+    lock_path = os.path.join(tmp_dir, '.X{}-lock'.format(number))
+    tmp_path = os.path.join(tmp_dir, '.tX{}-lock.{}'.format(number, os.getpid()))
+    with open(tmp_path, 'w') as f:
+        f.write("{:>10}\n".format(os.getpid()))
+    try:
+        for _ in range(2):
+            try:
+                os.link(tmp_path, lock_path)
+                return True
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            if held_by_live_process(lock_path):
+                return False
+            try:
+                os.remove(lock_path) # left by a server that is gone
+            except OSError:
+                pass
+        return False
+    finally:
+        os.remove(tmp_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in for Xvfb")
+    parser.add_argument('--tmp', help="Directory of the lock files and sockets", default='/tmp')
+    parser.add_argument('-displayfd', help="File descriptor the display number is written to", type=int, default=None)
+    args, rest = parser.parse_known_args()
+    displays = [arg for arg in rest if arg.startswith(':')]
+
+    if displays:
+        number = int(displays[0][1:])
+        if not take_lock(args.tmp, number):
+            sys.exit(1)
+    else:
+        number = 0
+        while not take_lock(args.tmp, number):
+            number += 1
+
+    socket_dir = os.path.join(args.tmp, '.X11-unix')
+    if not os.path.isdir(socket_dir):
+        try:
+            os.makedirs(socket_dir)
+        except OSError:
+            pass
+    socket_path = os.path.join(socket_dir, 'X{}'.format(number))
+    open(socket_path, 'w').close()
+
+    def shutdown(signum, frame):
+        for path in (socket_path, os.path.join(args.tmp, '.X{}-lock'.format(number))):
+            if os.path.exists(path):
+                os.remove(path)
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    if args.displayfd is not None:
+        os.write(args.displayfd, "{}\n".format(number).encode('ascii'))
+        os.close(args.displayfd)
+    while True:
+        time.sleep(1)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""
+Offline benchmark suite for the whole pipeline, with the fake SCAPS executable and synthetic outputs in place of
+WINE/SCAPS. Every stage is timed on its own:
+
+    dispatch   SCAPSrunner.run_inputs with the fake SCAPS, per core count: wall time and overhead per run beyond the
+               fake solve
+    parse      scaps_output_processor on synthetic IV files of every size
+    merge      process_pickles.merge of synthetic batch pickles of a scaled sweep into a fresh store of its size, per
+               grid size
+    inference  the sequential update loop of bayes.py on a synthetic store, per grid size
+    sharded    the out-of-core frames of sharded_posterior.py for the same observations, per grid size and core count
+    batch      batch_inference.batch_log_posterior for several devices, per grid size and core count
+    entropy    entropy.calc_entropies over the frames of the inference stage, per grid size
+
+Results are written as JSON together with the commit and machine they were measured on, and two result files can be
+compared stage by stage, e.g. before and after a change:
+
+$:pv_bayes# python benchmarks/run_benchmarks.py -out bench_before.json
+$:pv_bayes# python benchmarks/run_benchmarks.py -out bench_after.json
+$:pv_bayes# python benchmarks/run_benchmarks.py -compare bench_before.json bench_after.json
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Rachel Kurchin, Riley Brandt, Daniil Kitchaev"
+__date__ = "May 17, 2017"
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+import numpy as np
+from multiprocessing import cpu_count
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, os.pardir, 'analysis'))
+sys.path.append(os.path.join(BENCH_DIR, os.pardir, 'running_sims'))
+from run_scaps_parallel import SCAPSrunner
+from run_forward_simulations import scaps_output_processor, BASELINE_RUN
+from parameter_grid import SWEEP_GRID
+import process_pickles
+from bayes import LikelihoodEngine, PosteriorUpdater, FrameStore, ProportionalErrorModel
+from batch_inference import ObservationBatch, batch_log_posterior
+from sharded_posterior import sharded_posterior
+from entropy import calc_entropies
+from results_store import ResultStore
+from synthetic import iv_curve, write_iv_file, scaled_grid, scaled_sweep_grid, write_synthetic_store, \
+    write_synthetic_shards
+from bench_dispatch import measure
+from bench_parser import time_parser
+
+STAGES = ('dispatch', 'parse', 'merge', 'inference', 'sharded', 'batch', 'entropy')
+
+voltages = np.linspace(0, 0.5, 26)
+temperatures = SWEEP_GRID.axis('T_l')
+illuminations = SWEEP_GRID.axis('ill_l')
+
+class Quiet(object):
+    """
+    Context manager that discards what the pipeline prints to stdout
+    """
+
+    def __enter__(self):
+        self.stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+def synthetic_observations(engine, point, noise=0.3, seed=0):
+    """
+    Noisy J(V) of one grid point of engine at every simulated temperature, illumination and voltage, as (T, ill, V, J)
+    arrays ordered by condition as in bayes.py
+    """
+    T, ill, V = [a.ravel() for a in np.meshgrid(engine.temperatures, engine.illuminations, engine.voltages,
+                                                indexing='ij')]
+    J = engine.currents[point].ravel() + np.random.RandomState(seed).normal(0.0, noise, T.size)
+    return T, ill, V, J
+
+def bench_dispatch(args, tmp_dir):
+    results = []
+    inputs = SWEEP_GRID.inputs(BASELINE_RUN, ids=range(args.runs))
+    for ncores in args.ncores:
+        timing = measure(SCAPSrunner, inputs, ncores, args.latency, args.points)
+        results.append({'stage': 'dispatch', 'params': {'ncores': ncores, 'runs': args.runs, 'latency': args.latency},
+                        'seconds': timing['wall'], 'coordinator_cpu': timing['coordinator_cpu'],
+                        'runs_per_second': args.runs / timing['wall'],
+                        'overhead_per_run': timing['wall'] * ncores / args.runs - args.latency})
+    return results
+
+def bench_parse(args, tmp_dir):
+    results = []
+    for points in args.iv_points:
+        path = os.path.join(tmp_dir, 'pythonresult_{}.txt'.format(points))
+        V = np.linspace(0, 0.5, points)
+        write_iv_file(path, V, iv_curve(V))
+        seconds = time_parser(scaps_output_processor, path, args.repeat)
+        results.append({'stage': 'parse', 'params': {'iv_points': points}, 'seconds': seconds,
+                        'files_per_second': 1.0 / seconds})
+    return results
+
+def bench_merge(args, tmp_dir):
+    results = []
+    for size in args.grid_sizes:
+        # Every run of a sweep over the scaled grid, merged into a store of that grid's size
+        grid = scaled_grid(size)
+        sweep_grid = scaled_sweep_grid(grid)
+        num_runs = len(sweep_grid)
+        root = os.path.join(tmp_dir, 'merge_{}'.format(size))
+        write_synthetic_shards(os.path.join(root, 'shards'), np.arange(num_runs), args.shards, voltages,
+                               sweep_grid=sweep_grid)
+
+        start = time.time()
+        with Quiet():
+            store = process_pickles.merge(os.path.join(root, 'shards'), store_path=os.path.join(root, 'store'),
+                                          manifest_path=os.path.join(root, 'manifest.json'),
+                                          missing_path=os.path.join(root, 'missing.pickle'), sweep_grid=sweep_grid)
+        seconds = time.time() - start
+        assert len(store) == len(grid) and not np.any(store.missing)
+        results.append({'stage': 'merge', 'params': {'grid_points': len(grid), 'shards': args.shards},
+                        'seconds': seconds, 'runs_per_second': num_runs / seconds})
+        shutil.rmtree(root)
+    return results
+
+def bench_inference(args, tmp_dir, stages):
+    results = []
+    for size in args.grid_sizes:
+        grid = scaled_grid(size)
+        store_path = os.path.join(tmp_dir, 'store_{}'.format(size))
+        write_synthetic_store(store_path, grid, temperatures, illuminations, voltages)
+        engine = LikelihoodEngine.from_store(ResultStore(store_path))
+        T, ill, V, J = synthetic_observations(engine, len(grid) // 2)
+        J_err = ProportionalErrorModel()(J)
+        params = {'grid_points': len(grid), 'observations': len(J)}
+
+        # The loop of bayes.py: one batch of likelihoods per condition, one frame per observation
+        start = time.time()
+        posterior = PosteriorUpdater(len(engine))
+        frames = FrameStore.create(os.path.join(tmp_dir, 'probs_{}'.format(size)), len(J), len(engine))
+        for cond in np.unique(np.column_stack([T, ill]), axis=0):
+            rows = np.flatnonzero((T == cond[0]) & (ill == cond[1]))
+            log_lkls = engine.log_likelihood(J[rows], V[rows], T[rows], ill[rows], J_err[rows])
+            for j, row in enumerate(rows):
+                frames.append(posterior.update(log_lkls[j]), '{:g}_{:g}'.format(*cond), int(j))
+        frames.flush()
+        seconds = time.time() - start
+        if 'inference' in stages:
+            results.append({'stage': 'inference', 'params': params, 'seconds': seconds,
+                            'observations_per_second': len(J) / seconds})
+
+        if 'sharded' in stages:
+            for ncores in args.ncores:
+                sharded = FrameStore.create(os.path.join(tmp_dir, 'sharded_{}'.format(size)), len(J), len(engine))
+                start = time.time()
+                sharded_posterior(engine, (J, V, T, ill, J_err), sharded, ncores=ncores)
+                seconds = time.time() - start
+                results.append({'stage': 'sharded', 'params': dict(params, ncores=ncores), 'seconds': seconds,
+                                'observations_per_second': len(J) / seconds})
+                shutil.rmtree(sharded.path)
+
+        if 'entropy' in stages:
+            start = time.time()
+            calc_entropies(frames.frames[:len(frames)], grid.shape)
+            results.append({'stage': 'entropy', 'params': params, 'seconds': time.time() - start})
+
+        if 'batch' in stages:
+            devices = [synthetic_observations(engine, point, seed=seed) for seed, point in
+                       enumerate(np.linspace(0, len(grid) - 1, args.devices).astype(int))]
+            batch = ObservationBatch(['device{}'.format(d) for d in range(len(devices))],
+                                     *[np.concatenate(columns) for columns in zip(*devices)],
+                                     offsets=np.arange(len(devices) + 1) * len(J))
+            for ncores in args.ncores:
+                start = time.time()
+                batch_log_posterior(engine, batch, ncores=ncores)
+                seconds = time.time() - start
+                results.append({'stage': 'batch', 'params': dict(params, devices=args.devices, ncores=ncores),
+                                'seconds': seconds, 'devices_per_second': args.devices / seconds})
+        shutil.rmtree(store_path)
+    return results
+
+def machine_info():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BENCH_DIR, stderr=devnull).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': platform.node(),
+            'platform': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'cpu_count': cpu_count()}
+
+def run(args):
+    """
+    Run the selected stages in a scratch directory and return the benchmark record
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='pv_bayes_bench_')
+    results = []
+    try:
+        if 'dispatch' in args.stages:
+            results += bench_dispatch(args, tmp_dir)
+        if 'parse' in args.stages:
+            results += bench_parse(args, tmp_dir)
+        if 'merge' in args.stages:
+            results += bench_merge(args, tmp_dir)
+        if set(args.stages) & set(['inference', 'sharded', 'batch', 'entropy']):
+            results += bench_inference(args, tmp_dir, args.stages)
+    finally:
+        shutil.rmtree(tmp_dir)
+    settings = dict((k, v) for k, v in vars(args).items() if k not in ('out', 'compare'))
+    return {'machine': machine_info(), 'settings': settings, 'results': results}
+
+def result_key(result):
+    return result['stage'], json.dumps(result['params'], sort_keys=True)
+
+def compare(base, new, threshold):
+    """
+    Print the change in time of every benchmark present in both records. Returns the number of regressions, benchmarks
+    that became slower by more than the fraction threshold.
+    """
+    base_results = dict((result_key(r), r) for r in base['results'])
+    print("base: {} ({})".format(base['machine']['commit'], base['machine']['date']))
+    print("new:  {} ({})".format(new['machine']['commit'], new['machine']['date']))
+    print("{:>10} {:<60} {:>12} {:>12} {:>8}".format('stage', 'parameters', 'base (s)', 'new (s)', 'change'))
+    regressions = 0
+    for r in new['results']:
+        key = result_key(r)
+        if key not in base_results:
+            continue
+        before = base_results[key]['seconds']
+        change = r['seconds'] / before - 1.0 if before > 0 else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  slower'
+            regressions += 1
+        elif change < -threshold:
+            flag = '  faster'
+        params = ", ".join("{}={}".format(k, v) for k, v in sorted(r['params'].items()))
+        print("{:>10} {:<60} {:>12.4g} {:>12.4g} {:>+7.1%}{}".format(r['stage'], params, before, r['seconds'],
+                                                                  change, flag))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmarks with a fake SCAPS and synthetic data")
+    parser.add_argument('-stages', help="Stages to run", nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('-grid_sizes', help="Approximate grid sizes for the merge and inference stages", type=int,
+                        nargs='+', default=[1000, 10000, 96000])
+    parser.add_argument('-ncores', help="Core counts for the dispatch, sharded and batch stages", type=int, nargs='+',
+                        default=[1, 4])
+    parser.add_argument('-runs', help="Fake SCAPS runs per dispatch benchmark", type=int, default=64)
+    parser.add_argument('-latency', help="Seconds per fake SCAPS run", type=float, default=0.05)
+    parser.add_argument('-points', help="IV points the fake SCAPS writes per run (default: the scripted sweep)",
+                        type=int, default=None)
+    parser.add_argument('-iv_points', help="IV points per file for the parse stage", type=int, nargs='+',
+                        default=[26, 251, 2501])
+    parser.add_argument('-repeat', help="Parses per file size", type=int, default=200)
+    parser.add_argument('-shards', help="Batch pickles per merge benchmark", type=int, default=16)
+    parser.add_argument('-devices', help="Devices per batch inference benchmark", type=int, default=8)
+    parser.add_argument('-out', help="JSON file the results are written to", default=None)
+    parser.add_argument('-compare', help="Compare two result files (base, new) instead of running", nargs=2,
+                        default=None)
+    parser.add_argument('-threshold', help="Relative slowdown reported as a regression by -compare", type=float,
+                        default=0.1)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], 'r') as f:
+            base = json.load(f)
+        with open(args.compare[1], 'r') as f:
+            new = json.load(f)
+        sys.exit(1 if compare(base, new, args.threshold) else 0)
+
+    record = run(args)
+    for r in record['results']:
+        params = ", ".join("{}={}".format(k, v) for k, v in sorted(r['params'].items()))
+        print("{:>10} {:<60} {:>10.4g} s".format(r['stage'], params, r['seconds']))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(record, f, indent=1, sort_keys=True)
+        print("Results written to {}".format(args.out))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+Synthetic stand-ins for SCAPS outputs and measurements, used by the benchmarks and the tests to exercise the pipeline
+without a WINE/SCAPS install, and the original IV parser that the current one is checked against
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Rachel Kurchin, Riley Brandt, Daniil Kitchaev"
+__date__ = "May 17, 2017"
+
+import os
+import sys
+import pickle
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'analysis'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'running_sims'))
+from bayes import ProportionalErrorModel
+from parameter_grid import ParameterGrid, SWEEP_GRID, MATERIAL_GRID
+from results_store import ResultStore
+
+IV_COLUMNS = ['v(V)', 'jtot(mA/cm2)', 'jbulk(mA/cm2)', 'jifr(mA/cm2)', 'jminor_left(mA/cm2)', 'jminor_right(mA/cm2)']
+
+# Conditions of the synthetic measurements: every temperature and illumination of the sweep, biases up to 0.5 V
+OBS_VOLTAGES = np.linspace(0, 0.5, 26)
+OBS_TEMPERATURES = SWEEP_GRID.axis('T_l')
+OBS_ILLUMINATIONS = SWEEP_GRID.axis('ill_l')
+
+def iv_curve(voltages, J_sc=20.0, J_0=1e-6, n=1.5, T=300.0):
+    """
+    Ideal-diode J(V) curve in mA/cm2, with the sign convention of SCAPS (negative current under illumination)
+    """
+    V_th = 8.617e-5 * T
+    return J_0 * (np.exp(np.asarray(voltages) / (n * V_th)) - 1.0) - J_sc
+
+def iv_text(voltages, currents, script_name='pythonscript.script'):
+    """
+    Text of a SCAPS IV result file: a header, a 'jtot' table of the IV points and the 'deduced' cell parameters
+    """
+    lines = ["SCAPS 3.3.03 ELIS-UGent: Version scaps3303.exe, dd 21-12-2015",
+             "Script file: {}".format(script_name),
+             "",
+             "I-V characteristics",
+             "",
+             "\t".join(IV_COLUMNS),
+             ""]
+    for V, J in zip(voltages, currents):
+        lines.append("\t".join("{:.6E}".format(x) for x in (V, J, J, 0.0, 0.0, 0.0)))
+    lines += ["",
+              "solar cell parameters deduced from calculated IV-curve:",
+              "Voc = {:.6f} Volt".format(voltages[-1]),
+              "jsc = {:.6f} mA/cm2".format(-currents[0]),
+              ""]
+    return "\n".join(lines)
+
+def write_iv_file(path, voltages, currents, script_name='pythonscript.script'):
+    with open(path, 'w') as f:
+        f.write(iv_text(voltages, currents, script_name))
+
+def two_pass_output_processor(return_path):
+    """
+    The original parser of SCAPS IV files, kept as the baseline of benchmarks/bench_parser.py and the reference of
+    tests/test_parser.py
+    """
+    ii, simList, summaryList, dataLines = 0, [], [], []
+    with open(return_path,'r') as f:
+        for line in f:
+            if 'jtot' in line: simList.append(ii)
+            elif 'deduced' in line: summaryList.append(ii)
+            ii += 1
+
+    for xi, x in enumerate(simList):
+        dataLines.extend(list(range(x + 2, summaryList[xi] - 1)))
+
+    JArray, VArray = np.zeros(len(dataLines)), np.zeros(len(dataLines))
+
+    ii = 0
+    with open(return_path,'r') as f:
+        for jj, line in enumerate(f):
+            if jj in dataLines:
+                floats = [float(x) for x in line.split("\t")]
+                JArray[ii] = floats[1]
+                VArray[ii] = floats[0]
+                ii += 1
+
+    return (JArray, VArray)
+
+def synthetic_currents(params, temperatures, illuminations, voltages):
+    """
+    Smooth analytic stand-in for SCAPS over the material parameters: two-diode curves whose photocurrent, bulk (n=1) and
+    interface (n=2) recombination currents depend on mobility, bulk and interface defect densities and the ZnOS electron
+    affinity. params maps the MATERIAL_GRID parameter names to arrays of equal length; returns currents of shape
+    (point, T, ill, V).
+    """
+    mu, Nt, EA, Nt_i = (np.asarray(params[name], dtype=np.float64)[:, None, None, None]
+                        for name in ('mu_n_l', 'Nt_SnS_l', 'EA_ZnOS_l', 'Nt_i_l'))
+    T = np.asarray(temperatures, dtype=np.float64)[None, :, None, None]
+    ill = np.asarray(illuminations, dtype=np.float64)[None, None, :, None]
+    V = np.asarray(voltages, dtype=np.float64)
+    V_th = 8.617e-5 * T
+
+    # Collection by diffusion length, and a conduction band spike (large EA) that blocks the photocurrent
+    L = np.sqrt(mu / 50.0 * 1e17 / Nt)
+    J_sc = 0.2 * ill * (1.0 - np.exp(-2.0 * L)) / (1.0 + np.exp((EA - 4.15) / 0.05))
+    # Bulk recombination grows with the defect density, interface recombination with a cliff (small EA)
+    J_01 = 2e-8 * (Nt / 1e17) / L * (T / 300.0)**3 * np.exp(-1.1 / 8.617e-5 * (1.0 / T - 1.0 / 300.0))
+    J_02 = 1e-5 * (Nt_i / 1e12) * np.exp(4.0 * (3.85 - EA)) * (T / 300.0)**1.5 * \
+           np.exp(-0.55 / 8.617e-5 * (1.0 / T - 1.0 / 300.0))
+    return J_01 * (np.exp(V / V_th) - 1.0) + J_02 * (np.exp(V / (2.0 * V_th)) - 1.0) - J_sc
+
+def synthetic_observations(engine, truth, num_V, noise, seed=0):
+    """
+    Noisy measurements of the grid point truth of engine at num_V biases up to OBS_VOLTAGES[-1], for every
+    OBS_TEMPERATURES and OBS_ILLUMINATIONS condition: one list of (J, V, T, ill, J_err) arrays per condition as in
+    bayes.py
+    """
+    rs = np.random.RandomState(seed)
+    observations = []
+    for T in OBS_TEMPERATURES:
+        for ill in OBS_ILLUMINATIONS:
+            V = np.linspace(0.0, OBS_VOLTAGES[-1], num_V)
+            J = engine.model_currents(V, T, ill, points=np.array([truth]))[:, 0] + rs.normal(0.0, noise, num_V)
+            observations.append((J, V, np.full(num_V, T), np.full(num_V, ill), ProportionalErrorModel()(J)))
+    return observations
+
+def scaled_grid(num_points, grid=MATERIAL_GRID):
+    """
+    Grid with about num_points points spanning the same ranges as grid, keeping evenly spread values of every axis
+    """
+    factor = (min(num_points, len(grid)) / len(grid))**(1.0 / grid.ndim)
+    axes = []
+    for name, axis in zip(grid.names, grid.axes):
+        count = max(2, int(round(len(axis) * factor)))
+        axes.append((name, axis[np.unique(np.round(np.linspace(0, len(axis) - 1, count)).astype(int))]))
+    return ParameterGrid(axes)
+
+def scaled_sweep_grid(grid):
+    """
+    SWEEP_GRID over the material parameter values of grid, e.g. a scaled_grid(), with the full temperature and
+    illumination axes
+    """
+    return ParameterGrid([(name, grid.axis(name) if name in grid.names else SWEEP_GRID.axis(name))
+                          for name in SWEEP_GRID.names])
+
+def write_synthetic_store(path, grid, temperatures, illuminations, voltages, chunk=8192):
+    """
+    Result store at path with the synthetic currents of every point of grid, a grid over the MATERIAL_GRID parameters
+    """
+    store = ResultStore.create(path, grid.coordinate_arrays(), temperatures, illuminations, voltages,
+                               grid_shape=grid.shape)
+    for start in range(0, len(grid), chunk):
+        ids = np.arange(start, min(start + chunk, len(grid)))
+        store.currents[ids] = synthetic_currents(grid.coords(ids), temperatures, illuminations, voltages)
+    store.missing[:] = False
+    store.flush()
+    return store
+
+def write_synthetic_shards(root, sim_ids, num_shards, voltages, node=0, sweep_grid=SWEEP_GRID):
+    """
+    Batch pickles of run_forward_simulations.py, {simulation ID: (JArray, VArray)} over sweep_grid, holding synthetic
+    runs of sim_ids split into num_shards files in the directory root. Returns the shard paths.
+    """
+    if not os.path.exists(root):
+        os.makedirs(root)
+    temperatures, illuminations = sweep_grid.axis('T_l'), sweep_grid.axis('ill_l')
+    grid = sweep_grid.subgrid(MATERIAL_GRID.names)
+    paths = []
+    for shard_i, ids in enumerate(np.array_split(np.asarray(sim_ids), num_shards)):
+        if not len(ids):
+            continue
+        multi_index = sweep_grid.multi_index(ids)
+        currents = synthetic_currents(grid.coords(sweep_grid.convert(ids, grid)), temperatures, illuminations,
+                                      voltages)
+        runs = dict((int(sim_id), (currents[k, multi_index[0][k], multi_index[1][k]], np.array(voltages)))
+                    for k, sim_id in enumerate(ids))
+        path = os.path.join(root, "simulation_{}_{}_n{}_b{}.pickle".format(ids[0], ids[-1] + 1, node, shard_i))
+        with open(path, 'wb') as f:
+            pickle.dump(runs, f)
+        paths.append(path)
+    return paths
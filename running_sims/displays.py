@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+Long-lived virtual X displays for headless SCAPS runs. Wrapping every run in xvfb-run starts and tears down an X server
+each time and races other runs for a free display number; a DisplayPool instead starts its Xvfb servers once, hands
+their DISPLAY names to the workers and restarts any server that dies. Xvfb picks the display numbers itself
+(-displayfd), so that pools of concurrent runners do not race each other for them, and the lock file of a display is
+only removed once the process holding it is gone.
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Daniil Kitchaev"
+__date__ = "July 20, 2016"
+
+import os
+import sys
+import time
+import errno
+import select
+import signal
+import subprocess
+
+X_TMP_DIR = '/tmp' # Where X servers keep their lock files and, under .X11-unix, their sockets
+
+class DisplayError(RuntimeError):
+    """
+    A virtual display could not be started
+    """
+    pass
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+def remove_stale_lock(number):
+    """
+    Remove the lock file and socket of display number if the server that holds the lock is no longer running. Returns
+    False, leaving them alone, if the lock belongs to a live process.
+    """
+    lock_path = os.path.join(X_TMP_DIR, '.X{}-lock'.format(number))
+    try:
+        with open(lock_path, 'r') as f:
+            pid = int(f.read().strip())
+    except (IOError, OSError):
+        pid = None # no lock
+    except ValueError:
+        return False # still being written by the server taking it
+    if pid is not None and pid_alive(pid):
+        return False
+    for path in (lock_path, os.path.join(X_TMP_DIR, '.X11-unix', 'X{}'.format(number))):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return True
+
+class VirtualDisplay(object):
+    """
+    One Xvfb server. Without a display number, Xvfb picks the first free one itself and reports it through -displayfd,
+    so that servers started at the same time by other runners never race for a number.
+    """
+    XVFB_CMD = ['Xvfb', '-screen', '0', '800x600x16', '-nolisten', 'tcp']
+    START_TIMEOUT = 10 # Seconds to wait for the server to report that it is ready
+
+    def __init__(self, number=None, xvfb_cmd=None):
+        self.number = number
+        self.xvfb_cmd = list(xvfb_cmd or self.XVFB_CMD)
+        self.proc = None
+
+    @property
+    def name(self):
+        return ':{}'.format(self.number)
+
+    @property
+    def socket_path(self):
+        return os.path.join(X_TMP_DIR, '.X11-unix', 'X{}'.format(self.number))
+
+    @property
+    def lock_path(self):
+        return os.path.join(X_TMP_DIR, '.X{}-lock'.format(self.number))
+
+    def start(self):
+        """
+        Start the server, on self.number if it is set and otherwise on a number chosen by Xvfb, and wait until it
+        accepts connections. Raises DisplayError if it exits, for instance because the number is taken, or does not
+        come up.
+        """
+        if self.number is not None:
+            # Left behind by a server of ours that was killed; a live server's lock is left alone
+            remove_stale_lock(self.number)
+        # Xvfb writes its display number to the pipe once it accepts connections
+        read_fd, write_fd = os.pipe()
+        # Under Python 3 only the server gets the write end, so the pipe closes as soon as it exits
+        fds = {'pass_fds': (write_fd,)} if sys.version_info[0] >= 3 else {'close_fds': False}
+        try:
+            cmd = self.xvfb_cmd + ([self.name] if self.number is not None else []) + ['-displayfd', str(write_fd)]
+            with open(os.devnull, 'w') as devnull:
+                self.proc = subprocess.Popen(cmd, stdout=devnull, stderr=devnull, preexec_fn=os.setsid, **fds)
+        except OSError as e:
+            os.close(read_fd)
+            raise DisplayError("Xvfb could not be started: {}".format(e))
+        finally:
+            os.close(write_fd)
+        try:
+            number = self._read_number(read_fd)
+        finally:
+            os.close(read_fd)
+        if number is None:
+            self.proc.wait()
+            raise DisplayError("Xvfb on display {} exited with code {}".format(
+                self.name if self.number is not None else '(any)', self.proc.returncode))
+        self.number = number
+
+    def _read_number(self, fd):
+        # The display number written by the server, or None if it exits first; times out after START_TIMEOUT
+        data = b''
+        deadline = time.time() + self.START_TIMEOUT
+        while not data.endswith(b'\n'):
+            ready, _, _ = select.select([fd], [], [], max(0.0, deadline - time.time()))
+            if not ready:
+                self.stop()
+                raise DisplayError("Xvfb did not start within {} s".format(self.START_TIMEOUT))
+            chunk = os.read(fd, 64)
+            if not chunk:
+                return None
+            data += chunk
+        return int(data)
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None and os.path.exists(self.socket_path)
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            os.killpg(self.proc.pid, signal.SIGTERM)
+            self.proc.wait()
+        self.proc = None
+
+class DisplayPool(object):
+    """
+    A fixed number of virtual displays, on display numbers chosen by Xvfb
+    """
+
+    def __init__(self, count, xvfb_cmd=None):
+        self.count = count
+        self.xvfb_cmd = xvfb_cmd
+        self.displays = []
+
+    def __len__(self):
+        return self.count
+
+    def name(self, i):
+        return self.displays[i].name
+
+    def start(self):
+        try:
+            while len(self.displays) < self.count:
+                display = VirtualDisplay(xvfb_cmd=self.xvfb_cmd)
+                display.start()
+                self.displays.append(display)
+        except DisplayError:
+            self.stop()
+            raise
+
+    def ensure(self):
+        """
+        Health check: restart every display whose server has died, on the same number if it is still free and
+        otherwise on a new one. Returns the indices of the displays restarted; name() gives their current names.
+        """
+        restarted = []
+        for i, display in enumerate(self.displays):
+            if not display.alive():
+                display.stop()
+                try:
+                    display.start()
+                except DisplayError:
+                    # Taken by another server since ours died
+                    display = self.displays[i] = VirtualDisplay(xvfb_cmd=self.xvfb_cmd)
+                    display.start()
+                restarted.append(i)
+        return restarted
+
+    def stop(self):
+        for display in self.displays:
+            display.stop()
+        self.displays = []
@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+"""
+Executors decide where the SCAPS runs of SCAPSrunner.run_inputs are carried out. Every executor has an
+iter_outputs(inputs) generator yielding (id, output) pairs as runs finish, and a failures dictionary mapping the IDs of
+runs that could not be completed to their errors.
+
+LocalExecutor runs everything in the worker processes of a single SCAPSrunner. SharedQueueExecutor spreads a sweep over
+any number of nodes through a queue directory on a shared filesystem, without a scheduler or network service:
+
+    queue_dir/pending/<chunk>               chunks of runs waiting for a worker, a pickled {id: run_params} dictionary
+    queue_dir/claimed/<chunk>.<worker>      chunks being run; the worker touches the file as its heartbeat
+    queue_dir/done/<chunk>                  finished chunks
+    queue_dir/failures/<chunk>.json         runs of a finished chunk that failed, with their errors
+    queue_dir/results/<worker>.journal      ResultJournal of every output produced by the worker
+    queue_dir/workers/<worker>.json         status of each worker, rewritten at every heartbeat
+    queue_dir/closed                        created once the sweep is over, telling idle workers to exit
+
+Every state change is an atomic rename, so a chunk is claimed by exactly one worker even when several race for it. A
+chunk whose heartbeat stops is renamed back to pending/ by the coordinator and run again by another worker; outputs are
+deduplicated by ID, so runs of an abandoned chunk that did finish are not counted twice. The coordinator reads every
+journal only once, indexing where each output is, and reports the runs of a chunk as failed as soon as its failures
+file appears.
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Daniil Kitchaev"
+__date__ = "July 20, 2016"
+
+import os
+import json
+import time
+import socket
+import pickle
+import threading
+from journal import ResultJournal, read_journal
+
+class LocalExecutor(object):
+    """
+    Runs inputs in the worker processes of a SCAPSrunner on this machine
+    """
+
+    def __init__(self, runner, **options):
+        """
+        options: keyword arguments of SCAPSrunner.iter_outputs (prefetch, use_cache, journal, batch_size, monitor,
+                 shared)
+        """
+        self.runner = runner
+        self.options = options
+
+    @property
+    def failures(self):
+        return self.runner.failures
+
+    def iter_outputs(self, inputs):
+        return self.runner.iter_outputs(inputs, **self.options)
+
+def _makedirs(*paths):
+    for path in paths:
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+
+def _write_atomic(path, data):
+    # Written under a unique temporary name, then renamed, so readers on other nodes never see a partial file
+    tmp_path = "{}.{}.{}.tmp".format(path, socket.gethostname(), os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
+
+class _QueueDir(object):
+    """
+    Layout of a queue directory, shared by the coordinator and the workers
+    """
+
+    def __init__(self, queue_dir):
+        self.root = queue_dir
+        self.pending = os.path.join(queue_dir, 'pending')
+        self.claimed = os.path.join(queue_dir, 'claimed')
+        self.done = os.path.join(queue_dir, 'done')
+        self.failed = os.path.join(queue_dir, 'failures')
+        self.results = os.path.join(queue_dir, 'results')
+        self.workers = os.path.join(queue_dir, 'workers')
+        self.closed = os.path.join(queue_dir, 'closed')
+        _makedirs(self.pending, self.claimed, self.done, self.failed, self.results, self.workers)
+
+    @staticmethod
+    def listdir(path):
+        return sorted(name for name in os.listdir(path) if not name.endswith('.tmp'))
+
+    @staticmethod
+    def load_chunk(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+class SharedQueueExecutor(object):
+    """
+    Coordinator of a sweep run by QueueWorkers on other nodes through a shared queue directory. Can be restarted: runs
+    already in the result journals are not resubmitted, and neither are runs in chunks that are still queued.
+    """
+    POLL_INTERVAL = 2 # Seconds between scans of the queue directory
+
+    def __init__(self, queue_dir, chunk_size=16, heartbeat_timeout=120):
+        """
+        chunk_size: number of runs handed to a worker at a time
+
+        heartbeat_timeout: seconds without a heartbeat after which a claimed chunk is considered abandoned and
+                           requeued. Measured on the coordinator's own clock, from the last time it saw the claimed
+                           file change, so clock skew between nodes does not matter.
+        """
+        self.queue = _QueueDir(queue_dir)
+        self.chunk_size = chunk_size
+        self.heartbeat_timeout = heartbeat_timeout
+        self.failures = {}
+        self.offsets = {} # result journal -> bytes read so far
+        self.located = {} # id -> (result journal, offset of its record)
+        self.chunks = set() # chunks queued since this coordinator started, by this or an earlier coordinator
+        self.failed_chunks = set() # chunks whose failures file has been read
+        self.given_up = {} # str(id) -> errors of the runs in those failures files
+        self.heartbeats = {} # claimed file -> (mtime, time the mtime was last seen to change)
+
+    def _new_results(self):
+        # Outputs appended to the result journals since the last call, indexed as they are read
+        for name in self.queue.listdir(self.queue.results):
+            path = os.path.join(self.queue.results, name)
+            start = self.offsets.get(name, 0)
+            for id, output, offset in read_journal(path, start):
+                self.located.setdefault(id, (name, start))
+                self.offsets[name] = start = offset
+                yield id, output
+
+    def _read_output(self, id):
+        name, offset = self.located[id]
+        for _, output, _ in read_journal(os.path.join(self.queue.results, name), offset):
+            return output
+
+    def _read_failures(self):
+        # Index the runs given up on in the failures files that appeared since the last call, for chunks queued in
+        # this sweep, and return their names. Failures files of older chunks belong to runs that have been queued again
+        # since.
+        names = []
+        for name in self.queue.listdir(self.queue.failed):
+            chunk = name[:-len('.json')]
+            if chunk in self.failed_chunks or chunk not in self.chunks:
+                continue
+            self.failed_chunks.add(chunk)
+            with open(os.path.join(self.queue.failed, name), 'r') as f:
+                for id, errors in json.load(f).items():
+                    self.given_up[id] = errors
+                    names.append(id)
+        return names
+
+    def submit(self, inputs):
+        """
+        Queue the inputs in chunks, skipping the IDs that are already in pending or claimed chunks or in the result
+        journals, and those a worker has given up on in this sweep. Returns the number of runs queued.
+        """
+        for _ in self._new_results():
+            pass
+        self._read_failures()
+        queued = set(self.located) | set(id for id in inputs if str(id) in self.given_up)
+        for directory in (self.queue.pending, self.queue.claimed):
+            for name in self.queue.listdir(directory):
+                try:
+                    queued.update(self.queue.load_chunk(os.path.join(directory, name)).keys())
+                except (IOError, OSError):
+                    continue # moved on while we were looking; any runs it held are in the results or a later chunk
+                self.chunks.add(name.split('.')[0])
+
+        existing = [int(name.split('.')[0]) for directory in (self.queue.pending, self.queue.claimed, self.queue.done)
+                    for name in self.queue.listdir(directory)]
+        chunk_i = max(existing) + 1 if existing else 0
+
+        num_queued, chunk = 0, {}
+        ids = [id for id in inputs if id not in queued]
+        for i, id in enumerate(ids):
+            chunk[id] = inputs[id]
+            if len(chunk) == self.chunk_size or i == len(ids) - 1:
+                _write_atomic(os.path.join(self.queue.pending, "{:08d}".format(chunk_i)),
+                              pickle.dumps(chunk, protocol=pickle.HIGHEST_PROTOCOL))
+                self.chunks.add("{:08d}".format(chunk_i))
+                num_queued += len(chunk)
+                chunk_i, chunk = chunk_i + 1, {}
+        return num_queued
+
+    def requeue_abandoned(self):
+        """
+        Move claimed chunks whose heartbeat has stopped back to pending. Returns the names of the chunks requeued.
+        """
+        now, requeued, seen = time.time(), [], set()
+        for name in self.queue.listdir(self.queue.claimed):
+            path = os.path.join(self.queue.claimed, name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            seen.add(name)
+            last_mtime, last_change = self.heartbeats.get(name, (None, now))
+            if mtime != last_mtime:
+                self.heartbeats[name] = (mtime, now)
+            elif now - last_change > self.heartbeat_timeout:
+                chunk, worker = name.split('.', 1)
+                try:
+                    os.rename(path, os.path.join(self.queue.pending, chunk))
+                except OSError:
+                    continue
+                print("Chunk {} abandoned by worker {}, requeued".format(chunk, worker))
+                requeued.append(chunk)
+        for name in set(self.heartbeats) - seen:
+            del self.heartbeats[name]
+        return requeued
+
+    def iter_outputs(self, inputs):
+        """
+        Queue the inputs, then yield (id, output) pairs as workers journal them, until every run has either finished or
+        been given up on by a worker. Runs that are already in the result journals are yielded first, read back from
+        where earlier calls found them, so inputs may be submitted ahead of time to keep the workers busy. Runs a worker
+        gave up on are put in self.failures as soon as their chunk is done, including chunks that were done during an
+        earlier call.
+        """
+        remaining = set(inputs)
+        by_name = dict((str(id), id) for id in remaining)
+        self.failures = {}
+
+        self.submit(inputs)
+        for id in [id for id in inputs if id in self.located]:
+            remaining.discard(id)
+            yield id, self._read_output(id)
+        for id in [id for id in remaining if str(id) in self.given_up]:
+            remaining.discard(id)
+            self.failures[id] = self.given_up[str(id)]
+
+        while remaining:
+            idle = not self.queue.listdir(self.queue.pending) and not self.queue.listdir(self.queue.claimed)
+            for id, output in self._new_results():
+                if id in remaining:
+                    remaining.discard(id)
+                    yield id, output
+            for name in self._read_failures():
+                id = by_name.get(name)
+                if id in remaining:
+                    remaining.discard(id)
+                    self.failures[id] = self.given_up[name]
+            if idle or not remaining:
+                break # every chunk was done before the last read of the results, so nothing more is coming
+            self.requeue_abandoned()
+            time.sleep(self.POLL_INTERVAL)
+
+        # Whatever is left was lost without a failures file
+        for id in remaining:
+            self.failures[id] = ["no output"]
+
+    def close(self):
+        """
+        Tell the workers the sweep is over; they exit once the queue is empty
+        """
+        _write_atomic(self.queue.closed, b'')
+
+    def status(self):
+        """
+        Last status reported by every worker that has connected to the queue
+        """
+        workers = {}
+        for name in self.queue.listdir(self.queue.workers):
+            try:
+                with open(os.path.join(self.queue.workers, name), 'r') as f:
+                    workers[name[:-len('.json')]] = json.load(f)
+            except (IOError, OSError, ValueError):
+                pass
+        return workers
+
+class ClaimedInputs(object):
+    """
+    Inputs of a QueueWorker's runner: the runs of the chunks it claims from the queue, claimed one at a time as the
+    runner asks for more, so that SCAPSrunner.iter_outputs claims a new chunk only once it has dispatched the last one.
+    The number of runs is not known in advance, so len() counts the runs claimed so far.
+    """
+
+    def __init__(self, worker, first=None):
+        """
+        first: runs of a chunk the worker has already claimed, given out before any other
+        """
+        self.worker = worker
+        self.inputs = {}
+        self.first = first
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def __contains__(self, id):
+        return id in self.inputs
+
+    def __getitem__(self, id):
+        return self.inputs[id]
+
+    def iteritems(self):
+        """
+        Runs of successively claimed chunks. Ends when the queue is empty.
+        """
+        while True:
+            inputs, self.first = self.first, None
+            if inputs is None:
+                inputs = self.worker.claim()
+            if inputs is None:
+                return
+            self.inputs.update(inputs)
+            for item in inputs.items():
+                yield item
+
+    def items(self):
+        return self.iteritems()
+
+class QueueWorker(object):
+    """
+    Worker node of a SharedQueueExecutor: claims chunks from the queue directory and runs them with a local SCAPSrunner
+    until the coordinator closes the queue
+    """
+    POLL_INTERVAL = 2 # Seconds between looks at an empty queue
+
+    def __init__(self, queue_dir, runner, worker_id=None, heartbeat_interval=20, use_cache=True, monitor=None):
+        """
+        worker_id: name of this worker in the queue directory, by default <hostname>-<pid>
+
+        heartbeat_interval: seconds between heartbeats, well below the coordinator's heartbeat_timeout
+
+        monitor: optional SweepMonitor recording the timing of this worker's runs, see instrumentation.py
+        """
+        self.queue = _QueueDir(queue_dir)
+        self.runner = runner
+        self.worker_id = worker_id or "{}-{}".format(socket.gethostname(), os.getpid())
+        self.heartbeat_interval = heartbeat_interval
+        self.use_cache = use_cache
+        self.monitor = monitor
+        self.journal = ResultJournal(os.path.join(self.queue.results, self.worker_id + '.journal'))
+
+        self.chunks = {} # claimed chunk -> IDs of its runs that have not finished yet
+        self.chunk_of = {} # id -> claimed chunk
+        self.num_done = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _claimed_path(self, chunk):
+        return os.path.join(self.queue.claimed, "{}.{}".format(chunk, self.worker_id))
+
+    def claim(self):
+        """
+        Claim the first pending chunk that no other worker gets to first. Returns its runs, or None if none are left.
+        """
+        for chunk in self.queue.listdir(self.queue.pending):
+            try:
+                os.rename(os.path.join(self.queue.pending, chunk), self._claimed_path(chunk))
+            except OSError:
+                continue
+            inputs = self.queue.load_chunk(self._claimed_path(chunk))
+            with self._lock:
+                self.chunks[chunk] = set(inputs)
+                for id in inputs:
+                    self.chunk_of[id] = chunk
+            return inputs
+        return None
+
+    def _finish_chunk(self, chunk, errors=None):
+        with self._lock:
+            ids = self.chunks.pop(chunk)
+            for id in ids:
+                del self.chunk_of[id]
+        if errors:
+            _write_atomic(os.path.join(self.queue.failed, chunk + '.json'), json.dumps(errors, indent=1).encode('utf-8'))
+        try:
+            os.rename(self._claimed_path(chunk), os.path.join(self.queue.done, chunk))
+        except OSError:
+            pass # requeued behind our back; the coordinator takes whichever results arrive first
+
+    def _finish_chunks(self, given_up=None):
+        # Finish the chunks whose unfinished runs have all been given up on, reporting them as failures, or every chunk
+        # still open if given_up is None
+        with self._lock:
+            chunks = [(chunk, list(ids)) for chunk, ids in self.chunks.items() if given_up is None or ids <= given_up]
+        for chunk, ids in chunks:
+            self._finish_chunk(chunk, dict((str(id), self.runner.failures.get(id, ["no output"])) for id in ids))
+
+    def heartbeat(self):
+        """
+        Touch every claimed chunk and rewrite the status file of this worker
+        """
+        with self._lock:
+            chunks = list(self.chunks)
+        for chunk in chunks:
+            try:
+                os.utime(self._claimed_path(chunk), None)
+            except OSError:
+                pass
+        status = {'host': socket.gethostname(), 'pid': os.getpid(), 'time': time.time(), 'chunks': chunks,
+                  'runs_done': self.num_done}
+        _write_atomic(os.path.join(self.queue.workers, self.worker_id + '.json'), json.dumps(status).encode('utf-8'))
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            self.heartbeat()
+
+    def serve(self):
+        """
+        Run chunks until the queue is closed and empty
+        """
+        thread = threading.Thread(target=self._heartbeat_loop)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                self.heartbeat()
+                # Claim before starting the runner, so that losing every pending chunk to other workers does not cost
+                # a pool startup
+                inputs = self.claim()
+                if inputs is not None:
+                    for id, output in self.runner.iter_outputs(ClaimedInputs(self, inputs), use_cache=self.use_cache,
+                                                               monitor=self.monitor):
+                        self.journal.append(id, output)
+                        self.num_done += 1
+                        with self._lock:
+                            chunk = self.chunk_of.get(id)
+                            if chunk is not None:
+                                self.chunks[chunk].discard(id)
+                        self._finish_chunks(self.runner.given_up)
+                    # The stream is exhausted, so any chunk still open holds runs the runner gave up on
+                    self._finish_chunks()
+                elif os.path.exists(self.queue.closed):
+                    break
+                else:
+                    time.sleep(self.POLL_INTERVAL)
+        finally:
+            self._stop.set()
+            self.journal.close()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""
+Instrumentation of SCAPSrunner sweeps. With a SweepMonitor passed to run_inputs or iter_outputs, the workers time
+every run in three spans (writing the script, SCAPS from launch to exit, parsing the output), and the monitor records
+them together with dispatches, failures, cache hits and the queue depth as a stream of events, one per line, in
+JSONL or CSV. It keeps per-worker busy time, prints a periodic status line with a rolling throughput and ETA for the
+whole sweep, and summarizes the spans and worker utilization at the end. The summary is also the last event of a JSONL
+stream; it is nested, so it does not fit the flat columns of a CSV stream and is left out of it.
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Daniil Kitchaev"
+__date__ = "July 20, 2016"
+
+import csv
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+SPANS = ('script', 'scaps', 'parse')
+CSV_FIELDS = ['time', 'event', 'id', 'core', 'script', 'scaps', 'parse', 'batch', 'queued', 'retries', 'ncores',
+              'error']
+
+def format_duration(seconds):
+    """
+    Duration as [Dd ]H:MM:SS, or '?' when unknown
+    """
+    if seconds is None or not np.isfinite(seconds):
+        return '?'
+    seconds = int(round(seconds))
+    days, seconds = divmod(seconds, 86400)
+    text = "{}:{:02d}:{:02d}".format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+    return "{}d {}".format(days, text) if days else text
+
+class Throughput(object):
+    """
+    Rolling throughput over the last window completions, and the ETA of the remaining work at that rate
+    """
+
+    def __init__(self, window=100):
+        self.times = deque(maxlen=window)
+        self.start = time.time()
+
+    def add(self, count=1, now=None):
+        now = now if now is not None else time.time()
+        for _ in range(count):
+            self.times.append(now)
+
+    def rate(self, now=None):
+        """
+        Completions per second over the window, measured from the start until the window has filled up
+        """
+        now = now if now is not None else time.time()
+        if not self.times:
+            return 0.0
+        since = self.times[0] if len(self.times) == self.times.maxlen else self.start
+        count = len(self.times) - 1 if len(self.times) == self.times.maxlen else len(self.times)
+        return count / (now - since) if now > since else 0.0
+
+    def eta(self, remaining, now=None):
+        rate = self.rate(now)
+        return remaining / rate if rate > 0 else None
+
+class SweepMonitor(object):
+    """
+    Event stream and running statistics of one or more run_inputs calls
+    """
+
+    def __init__(self, path=None, total=None, window=100, report_interval=60):
+        """
+        path: file the events are written to, CSV if it ends in .csv and JSONL otherwise; None keeps only the
+              statistics
+
+        total: number of runs in the whole sweep, for the ETA; by default the runs of every call that has started
+
+        report_interval: seconds between status lines; None for no status lines
+        """
+        self.path = path
+        self.total = total
+        self.report_interval = report_interval
+        self.throughput = Throughput(window)
+        self.start = time.time()
+        self.last_report = self.start
+        self.submitted = 0
+        self.done = 0
+        self.counts = {'failed': 0, 'cached': 0, 'journaled': 0, 'dispatched': 0}
+        self.spans = dict((span, []) for span in SPANS)
+        self.busy, self.runs_per_core = {}, {}
+        self.ncores = 0
+        self.queued, self.retries = 0, 0
+
+        self._file, self._csv = None, None
+        if path is not None:
+            self._file = open(path, 'a')
+            if path.endswith('.csv'):
+                self._csv = csv.DictWriter(self._file, CSV_FIELDS, extrasaction='ignore')
+                if self._file.tell() == 0:
+                    self._csv.writeheader()
+
+    def event(self, kind, **fields):
+        if self._file is None:
+            return
+        fields['time'] = round(time.time(), 6)
+        fields['event'] = kind
+        if self._csv is not None:
+            self._csv.writerow(fields)
+        else:
+            self._file.write(json.dumps(fields, sort_keys=True) + "\n")
+        self._file.flush()
+
+    def started(self, num_inputs, ncores):
+        self.submitted += num_inputs
+        self.ncores = max(self.ncores, ncores)
+        self.event('start', queued=num_inputs, ncores=ncores)
+
+    def dispatched(self, core, ids, queued, retries):
+        self.counts['dispatched'] += len(ids)
+        self.queued, self.retries = queued, retries
+        self.event('dispatch', core=core, id=list(ids) if len(ids) > 1 else ids[0], batch=len(ids), queued=queued,
+                   retries=retries)
+
+    def finished(self, pt, queued, retries):
+        """
+        A run returned by a worker, with the 'timing' spans it measured
+        """
+        self.queued, self.retries = queued, retries
+        timing = pt.get('timing', {})
+        core = pt.get('core')
+        if timing:
+            for span in SPANS:
+                self.spans[span].append(timing[span])
+            self.busy[core] = self.busy.get(core, 0.0) + sum(timing[span] for span in SPANS)
+        self.runs_per_core[core] = self.runs_per_core.get(core, 0) + 1
+        fields = dict((span, round(timing[span], 6)) for span in SPANS if span in timing)
+        if 'error' in pt:
+            self.counts['failed'] += 1
+            self.event('failure', id=pt['id'], core=core, error=pt['error'], queued=queued, retries=retries,
+                       **fields)
+        else:
+            self.event('run', id=pt['id'], core=core, batch=timing.get('batch', 1), queued=queued, retries=retries,
+                       **fields)
+            self.completed()
+
+    def cached(self, id):
+        self.counts['cached'] += 1
+        self.event('cache_hit', id=id)
+        self.completed()
+
+    def journaled(self, count):
+        self.counts['journaled'] += count
+        self.event('journal', batch=count)
+        self.done += count
+
+    def worker_died(self, core, exitcode, lost):
+        self.event('worker_died', core=core, error="exit code {}".format(exitcode), batch=lost)
+
+    def completed(self):
+        self.done += 1
+        self.throughput.add()
+        now = time.time()
+        if self.report_interval is not None and now - self.last_report >= self.report_interval:
+            self.last_report = now
+            print(self.status_line(now))
+
+    def expected(self):
+        """
+        Number of runs in the sweep, or None when it is unknown, as for the monitor of a QueueWorker, which streams its
+        runs from the queue without being told how many there are
+        """
+        total = self.total if self.total is not None else self.submitted
+        return total or None
+
+    def remaining(self):
+        """
+        Runs left in the sweep, or None when the total is unknown or has already been exceeded
+        """
+        total = self.expected()
+        if total is None or self.done > total:
+            return None
+        return total - self.done
+
+    def eta(self, now=None):
+        remaining = self.remaining()
+        return self.throughput.eta(remaining, now) if remaining is not None else None
+
+    def utilization(self, now=None):
+        """
+        Fraction of the time since the monitor started that each worker spent running SCAPS runs, by core. Workers
+        that have not finished a run yet count as idle.
+        """
+        elapsed = (now if now is not None else time.time()) - self.start
+        if elapsed <= 0:
+            return {}
+        return dict((core, self.busy.get(core, 0.0) / elapsed) for core in set(range(self.ncores)) | set(self.busy))
+
+    def status_line(self, now=None):
+        now = now if now is not None else time.time()
+        utilization = self.utilization(now)
+        mean_utilization = np.mean(list(utilization.values())) if utilization else 0.0
+        return "[{}] {}/{} runs, {:.2f} runs/s, ETA {}, {} queued on workers, {} retries pending, worker " \
+               "utilization {:.0%}".format(format_duration(now - self.start), self.done, self.expected() or '?',
+                                           self.throughput.rate(now), format_duration(self.eta(now)), self.queued,
+                                           self.retries, mean_utilization)
+
+    def summary(self):
+        """
+        Statistics of the spans (mean, median, 95th percentile and total, in seconds) and of the workers
+        """
+        now = time.time()
+        spans = {}
+        for span, values in self.spans.items():
+            if values:
+                values = np.asarray(values)
+                spans[span] = {'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)),
+                               'p95': float(np.percentile(values, 95)), 'total': float(values.sum())}
+        return {'elapsed': now - self.start, 'runs': self.done, 'runs_per_second': self.done / (now - self.start),
+                'counts': dict(self.counts), 'spans': spans, 'utilization': self.utilization(now),
+                'runs_per_core': dict(self.runs_per_core)}
+
+    def print_summary(self):
+        """
+        Print the summary, once at the end of the sweep, and record it as a 'summary' event in a JSONL stream
+        """
+        summary = self.summary()
+        print("Sweep summary: {runs} runs in {elapsed}, {rate:.2f} runs/s ({failed} failed attempts, {cached} cache "
+              "hits, {journaled} from the journal)".format(runs=summary['runs'],
+                                                           elapsed=format_duration(summary['elapsed']),
+                                                           rate=summary['runs_per_second'], **summary['counts']))
+        for span in SPANS:
+            if span in summary['spans']:
+                print("  {:<7} mean {mean:.3f} s, median {p50:.3f} s, p95 {p95:.3f} s, total {total:.1f} s".format(
+                    span, **summary['spans'][span]))
+        utilization = summary['utilization']
+        if utilization:
+            cores = sorted(utilization, key=utilization.get)
+            print("  worker utilization: mean {:.0%}, lowest {:.0%} (worker {}), highest {:.0%} (worker {})".format(
+                np.mean(list(utilization.values())), utilization[cores[0]], cores[0], utilization[cores[-1]],
+                cores[-1]))
+        if self._csv is None:
+            self.event('summary', summary=summary)
+        return summary
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
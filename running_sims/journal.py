@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Durable, append-only journal of finished SCAPS runs. Every output is written and fsynced as soon as it arrives, so a
+sweep that is killed loses at most the runs that were in flight, and a restarted sweep skips every ID already in the
+journal. process_pickles.py merges journals directly, alongside batch pickles.
+
+Each record is an 8-byte little-endian length followed by a pickled (id, output) pair. A record cut short by a crash is
+ignored when reading and truncated away when the journal is reopened for appending.
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Daniil Kitchaev"
+__date__ = "July 20, 2016"
+
+import os
+import struct
+import pickle
+
+HEADER = struct.Struct('<Q')
+
+def read_journal(path, offset=0):
+    """
+    Generator over the complete records of a journal starting at byte offset, yielding (id, output, end_offset) where
+    end_offset is the position just after the record, to resume reading from later
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length = HEADER.unpack(header)[0]
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            offset += HEADER.size + len(payload)
+            id, output = pickle.loads(payload)
+            yield id, output, offset
+
+class ResultJournal(object):
+    """
+    Append-only journal of (id, output) records for one sweep process
+    """
+
+    def __init__(self, path, fsync=True):
+        """
+        Open the journal at path for appending, creating it if needed, and index the IDs it already holds
+
+        fsync: force every record to disk before append() returns
+        """
+        self.path = path
+        self.fsync = fsync
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.ids = set()
+        end = 0
+        for id, _, end in read_journal(path):
+            self.ids.add(id)
+
+        self._file = open(path, 'ab')
+        if self._file.tell() != end:
+            # Drop a torn record left by a crash mid-write
+            self._file.truncate(end)
+            self._file.seek(end)
+
+    def __contains__(self, id):
+        return id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, id, output):
+        payload = pickle.dumps((id, output), protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.write(HEADER.pack(len(payload)) + payload)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.ids.add(id)
+
+    def outputs(self, ids=None):
+        """
+        Generator over the (id, output) pairs in the journal, optionally restricted to a set of IDs
+        """
+        for id, output, _ in read_journal(self.path):
+            if ids is None or id in ids:
+                yield id, output
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Full-factorial parameter grids shared by the forward simulation sweep, the merge step and the analysis. A grid point is
+identified by a flat index in C order (last axis fastest); run parameters, multi-indices and coordinates are computed
+arithmetically on demand, so no per-point dictionaries or float-keyed lookup tables need to be built.
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Rachel Kurchin, Riley Brandt, Daniil Kitchaev"
+__date__ = "May 17, 2017"
+
+import numpy as np
+from collections import OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+class ParameterGrid(object):
+    """
+    Grid over named parameter axes. Flat indices run over the axes in the order given, with the last axis fastest.
+    """
+
+    def __init__(self, axes):
+        """
+        axes: list of (name, values) pairs, or an ordered mapping of parameter name to axis values
+        """
+        axes = OrderedDict(axes)
+        self.names = list(axes.keys())
+        self.axes = [np.asarray(values) for values in axes.values()]
+        self.shape = tuple(len(values) for values in self.axes)
+
+    def __len__(self):
+        return int(np.prod(self.shape))
+
+    def __repr__(self):
+        axes = ", ".join("{}[{}]".format(name, n) for name, n in zip(self.names, self.shape))
+        return "ParameterGrid({})".format(axes)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def axis(self, name):
+        return self.axes[self.names.index(name)]
+
+    def multi_index(self, index):
+        """
+        Per-axis indices of flat grid indices, as a tuple with one entry per axis
+        """
+        return np.unravel_index(index, self.shape)
+
+    def flat_index(self, multi_index):
+        """
+        Flat grid indices of per-axis indices, given as a sequence with one entry per axis
+        """
+        return np.ravel_multi_index(tuple(multi_index), self.shape)
+
+    def axis_index(self, name, values, rtol=1e-6):
+        """
+        Indices of values on the axis name, matched to within a relative tolerance instead of by float equality.
+        Raises ValueError for values that are not on the axis.
+        """
+        axis = self.axis(name)
+        values = np.asarray(values, dtype=np.float64)
+        index = np.abs(values[..., None] - axis).argmin(axis=-1)
+        if not np.all(np.isclose(axis[index], values, rtol=rtol, atol=0)):
+            raise ValueError("Values {} not on the {} axis {}".format(values, name, axis))
+        return index
+
+    def locate(self, params, rtol=1e-6):
+        """
+        Flat indices of the grid points with the given parameter values, a mapping of name to scalar or array
+        """
+        return self.flat_index([self.axis_index(name, params[name], rtol=rtol) for name in self.names])
+
+    def coords(self, index):
+        """
+        Parameter values of flat grid indices, as an ordered mapping of name to value(s)
+        """
+        return OrderedDict((name, axis[i]) for name, axis, i in zip(self.names, self.axes, self.multi_index(index)))
+
+    def coordinate_arrays(self):
+        """
+        Coordinates of every grid point along every axis, as an ordered mapping of name to an array of len(self)
+        """
+        return self.coords(np.arange(len(self)))
+
+    def subgrid(self, names):
+        """
+        Grid over a subset of the axes, in the order given
+        """
+        return ParameterGrid([(name, self.axis(name)) for name in names])
+
+    def convert(self, index, other):
+        """
+        Map flat indices of this grid onto the flat indices of other, whose axes must be a subset of these axes
+        """
+        multi_index = dict(zip(self.names, self.multi_index(index)))
+        return other.flat_index([multi_index[name] for name in other.names])
+
+    def params(self, index, baseline=None):
+        """
+        Run parameter dictionary of one grid point: a copy of baseline with the grid parameters filled in
+        """
+        run = dict(baseline) if baseline is not None else {}
+        for name, value in self.coords(int(index)).items():
+            run[name] = value.item()
+        return run
+
+    def inputs(self, baseline=None, ids=None):
+        """
+        Lazy {id: run_params} mapping of the grid points, for SCAPSrunner.run_inputs. ids selects a subset of the flat
+        indices; by default the whole grid is used.
+        """
+        return GridInputs(self, baseline, ids)
+
+    def to_dict(self):
+        return OrderedDict((name, axis.tolist()) for name, axis in zip(self.names, self.axes))
+
+class GridInputs(Mapping):
+    """
+    Read-only mapping of flat grid index to run parameters that generates each dictionary only when it is accessed
+    """
+
+    def __init__(self, grid, baseline=None, ids=None):
+        self.grid = grid
+        self.baseline = baseline
+        self.ids = ids
+        self._id_set = None
+
+    def __len__(self):
+        return len(self.grid) if self.ids is None else len(self.ids)
+
+    def __iter__(self):
+        return iter(range(len(self.grid))) if self.ids is None else iter(self.ids)
+
+    def __contains__(self, key):
+        if self.ids is None:
+            return isinstance(key, (int, np.integer)) and 0 <= key < len(self.grid)
+        if self._id_set is None:
+            self._id_set = set(self.ids)
+        return key in self._id_set
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self.grid.params(key, self.baseline)
+
+    def subset(self, ids):
+        return GridInputs(self.grid, self.baseline, ids)
+
+# Parameter ranges of the SnS forward simulations
+temperatures = np.array([280, 300, 320])
+illuminations = np.array([31, 108])
+mu_n_range = np.linspace(20, 80, 20)
+Nt_SnS_range = np.logspace(16, 18, 20)
+EA_ZnOS_range = np.linspace(3.4, 4.3, 15)
+Nt_i_range = np.logspace(10, 14, 16)
+
+# Simulation IDs run over (T, ill, Nt_i, mu_n, Nt, EA), with EA fastest
+SWEEP_GRID = ParameterGrid([('T_l', temperatures), ('ill_l', illuminations), ('Nt_i_l', Nt_i_range),
+                            ('mu_n_l', mu_n_range), ('Nt_SnS_l', Nt_SnS_range), ('EA_ZnOS_l', EA_ZnOS_range)])
+
+# Grid points of the result store and the analysis run over (mu_n, Nt, EA, Nt_i), with Nt_i fastest
+MATERIAL_GRID = SWEEP_GRID.subgrid(['mu_n_l', 'Nt_SnS_l', 'EA_ZnOS_l', 'Nt_i_l'])
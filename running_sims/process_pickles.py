@@ -1,6 +1,13 @@
 #!/usr/bin/env python
 """
 This code joins all the pickled outputs from the forward simulations into a more processable format
+
+Merging is incremental: a manifest records every shard (batch pickle) that has already been ingested, so each call only
+streams the new shards, one at a time, into the result store. Run journals are merged as well; the manifest records how
+far into each journal has been ingested, so only runs appended since the last merge are read. The missing-simulation
+report is written once at the end of a merge, read off the store's mask of missing runs: only the entries of the grid
+points that received runs are updated, and the report is built from the whole mask only for a new store or when the
+report file is absent.
 """
 
 from __future__ import unicode_literals, division
@@ -9,117 +16,211 @@ __author__ = "Rachel Kurchin, Riley Brandt, Daniil Kitchaev"
 __date__ = "May 17, 2017"
 
 import numpy as np
-from copy import deepcopy
 import pickle
-import multiprocessing
 import os
+import re
 import json
-
-NPROCS = 24 # Number of processes to use to load data in parallel
+import shutil
+import argparse
+from results_store import ResultStore
+from journal import read_journal
+from parameter_grid import SWEEP_GRID, MATERIAL_GRID
+
+STORE_PATH = os.path.join('pickles', 'simulation_store') # Where the merged result store is written
+MANIFEST_PATH = os.path.join('pickles', 'merge_manifest.json') # Shards already merged into the store
+MISSING_PATH = 'missing_sims.pickle' # Report of the grid points with missing simulations
+SHARD_PATTERN = re.compile(r'^simulation_\d+_\d+_n\d+_b\d+\.pickle$') # Batch pickles of run_forward_simulations.py
+JOURNAL_PATTERN = re.compile(r'^.*\.journal$') # Run journals of run_forward_simulations.py
+
+temperatures = SWEEP_GRID.axis('T_l')
+illuminations = SWEEP_GRID.axis('ill_l')
+voltages = np.linspace(0, 0.5, 26) # IV sweep of scaps_script_generator: 0 to V_max in 0.02 V steps
+
+def material_grid(sweep_grid):
+    """
+    Grid of the result store of a sweep: the MATERIAL_GRID parameters over the values of sweep_grid
+    """
+    return sweep_grid.subgrid(MATERIAL_GRID.names)
+
+def store_index(sim_ids, sweep_grid=SWEEP_GRID):
+    """
+    Map simulation IDs of sweep_grid onto (grid point, temperature index, illumination index) in the result store
+    """
+    multi_index = sweep_grid.multi_index(sim_ids)
+    return sweep_grid.convert(sim_ids, material_grid(sweep_grid)), multi_index[0], multi_index[1]
+
+def create_store(path, sweep_grid=SWEEP_GRID):
+    """
+    Create an empty result store over every grid point of sweep_grid, by default the full simulation grid
+    """
+    grid = material_grid(sweep_grid)
+    return ResultStore.create(path, grid.coordinate_arrays(), sweep_grid.axis('T_l'), sweep_grid.axis('ill_l'),
+                              voltages, grid_shape=grid.shape)
+
+def find_shards(root):
+    """
+    Find all batch pickles below root, keyed by path relative to root, with the (size, mtime) used to detect changes
+    """
+    shards = {}
+    for dirpath, dirs, files in os.walk(root):
+        for shard in files:
+            if SHARD_PATTERN.match(shard):
+                path = os.path.join(dirpath, shard)
+                stat = os.stat(path)
+                shards[os.path.relpath(path, root)] = [stat.st_size, int(stat.st_mtime)]
+    return shards
+
+def find_journals(root):
+    """
+    Find all run journals below root, keyed by path relative to root, with their current size
+    """
+    journals = {}
+    for dirpath, dirs, files in os.walk(root):
+        for journal in files:
+            if JOURNAL_PATTERN.match(journal):
+                path = os.path.join(dirpath, journal)
+                journals[os.path.relpath(path, root)] = os.path.getsize(path)
+    return journals
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest, path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+def missing_report(store, points=None):
+    """
+    Missing-simulation report of a store, {grid point: [[T, ill], ...]} for every grid point with a missing run, among
+    the given grid points (all by default)
+    """
+    conds = [[T, ill] for T in store.temperatures.tolist() for ill in store.illuminations.tolist()]
+    if points is None:
+        points = np.arange(len(store))
+    points = np.asarray(points, dtype=np.int64)
+    rows, runs = np.nonzero(np.asarray(store.missing[points]).reshape(len(points), -1))
+    missing_sims = {}
+    for row, run in zip(rows.tolist(), runs.tolist()):
+        missing_sims.setdefault(int(points[row]), []).append(list(conds[run]))
+    return missing_sims
+
+def update_report(missing_sims, store, points):
+    """
+    Bring the entries of the given grid points in the report missing_sims up to date with the store
+    """
+    points = sorted(points)
+    updates = missing_report(store, points)
+    for i in points:
+        if i in updates:
+            missing_sims[i] = updates[i]
+        else:
+            missing_sims.pop(i, None)
+    return missing_sims
+
+def load_report(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def ingest_runs(store, sims, sweep_grid=SWEEP_GRID, touched=None):
+    """
+    Write (simulation ID, (JArray, VArray)) pairs into the store, adding their grid points to the set touched if given.
+    Returns the number of runs ingested.
+    """
+    num_runs = 0
+    for sim_id, output in sims:
+        i, t, l = store_index(sim_id, sweep_grid)
+        store.set_run(int(i), t, l, *output)
+        if touched is not None:
+            touched.add(int(i))
+        num_runs += 1
+    return num_runs
+
+def ingest_shard(store, shard_path, sweep_grid=SWEEP_GRID, touched=None):
+    """
+    Ingest every run of one batch pickle. Returns the number of runs ingested.
+    """
+    with open(shard_path, 'rb') as f:
+        sims = pickle.load(f)
+    return ingest_runs(store, sorted(sims.items()), sweep_grid, touched)
+
+def ingest_journal(store, journal_path, offset, sweep_grid=SWEEP_GRID, touched=None):
+    """
+    Ingest the runs of a journal from byte offset on. Returns (number of runs ingested, new offset).
+    """
+    progress = {'offset': offset}
+    def records():
+        for sim_id, output, end in read_journal(journal_path, offset):
+            progress['offset'] = end
+            yield sim_id, output
+    num_runs = ingest_runs(store, records(), sweep_grid, touched)
+    return num_runs, progress['offset']
+
+def merge(root, store_path=STORE_PATH, manifest_path=MANIFEST_PATH, missing_path=MISSING_PATH, rebuild=False,
+          sweep_grid=SWEEP_GRID):
+    """
+    Stream all batch pickles below root that are not yet in the manifest into the result store, one at a time,
+    followed by whatever has been appended to each run journal since the last merge. The simulation IDs are those of
+    sweep_grid, by default the full sweep, and a new store covers its grid points.
+    """
+    if rebuild:
+        for path in (manifest_path, missing_path):
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(store_path):
+            shutil.rmtree(store_path)
+
+    if os.path.exists(store_path):
+        store = ResultStore(store_path, mode='r+')
+        manifest = load_manifest(manifest_path)
+        missing_sims = load_report(missing_path) if os.path.exists(missing_path) else None
+    else:
+        print("Creating result store at {}".format(store_path))
+        store = create_store(store_path, sweep_grid)
+        manifest, missing_sims = {}, None
+    touched = set() # Grid points that received runs in this merge
+
+    shards = find_shards(root)
+    new_shards = sorted(shard for shard, stat in shards.items() if manifest.get(shard) != stat)
+    print("Found {} shards, {} not yet merged".format(len(shards), len(new_shards)))
+
+    for shard in new_shards:
+        num_runs = ingest_shard(store, os.path.join(root, shard), sweep_grid, touched)
+        # The store is flushed before the shard is recorded, so an interrupted merge just redoes that shard
+        store.flush()
+        manifest[shard] = shards[shard]
+        save_manifest(manifest, manifest_path)
+        print("Merged {} ({} runs)".format(shard, num_runs))
+
+    for journal, size in sorted(find_journals(root).items()):
+        offset = manifest.get(journal, 0)
+        if size <= offset:
+            continue
+        num_runs, manifest[journal] = ingest_journal(store, os.path.join(root, journal), offset, sweep_grid, touched)
+        store.flush()
+        save_manifest(manifest, manifest_path)
+        print("Merged {} ({} new runs)".format(journal, num_runs))
+
+    # The report follows from the store alone, so it is written once here and is never out of date with it. Only the
+    # grid points that received runs can have changed since the last merge, unless there is no report to update.
+    if missing_sims is None:
+        missing_sims = missing_report(store)
+    elif touched:
+        update_report(missing_sims, store, touched)
+    if touched or not os.path.exists(missing_path):
+        with open(missing_path, 'wb') as f:
+            pickle.dump(missing_sims, f)
+    print("Number missing {}".format(len(missing_sims.keys())))
+    return store
 
 if __name__ == "__main__":
-    temperatures = np.array([280, 300, 320])
-    illuminations = np.array([31, 108])
-    mu_n_range = np.linspace(20, 80, 20)
-    Nt_SnS_range = np.logspace(16, 18, 20)
-    EA_ZnOS_range = np.linspace(3.4, 4.3, 15)
-    Nt_i_range = np.logspace(10, 14, 16)
-
-    baseline_run = {'def': "SnS_base.scaps",
-                        'mu_n_l': 60,
-                        'Nt_SnS_l': 1e17,
-                        'EA_ZnOS_l': 4.0,
-                        'Nt_i_l': 1e10,
-                        "V_max": 1.0}
-
-    inputs = {}
-    i = 0
-
-    lookup_dict = {}
-    print("Regenerating inputs")
-    for temp in temperatures:
-        for ill in illuminations:
-            for Nt_i in Nt_i_range:
-                for mu_n in mu_n_range:
-                    for Nt in Nt_SnS_range:
-                        for EA in EA_ZnOS_range:
-                            run=deepcopy(baseline_run)
-                            baseline_run['Nt_i_l'] = Nt_i
-                            run['mu_n_l'] = mu_n
-                            run['Nt_SnS_l'] = Nt
-                            run['EA_ZnOS_l'] = EA
-                            run['T_l'] = temp
-                            run['ill_l'] = ill
-                            inputs[i] = run
-                            lookup_dict[(Nt_i,mu_n,Nt,EA,temp,ill)] = i
-                            i += 1
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-root', help="Directory searched for batch pickles", default=os.getcwd())
+    parser.add_argument('-rebuild', help="Discard the store and manifest and merge everything again",
+                        action='store_true')
+    args = parser.parse_args()
 
-    missing_sims = {}
-    missing_inputs = {}
-
-    def load_simulation(inputfile):
-        sim = pickle.load(open(os.path.join(inputfile[0], inputfile[1]),'rb'))
-        return sim
-
-    simulations = []
-    save_files = []
-    print("Searching for pickles")
-    for root, dirs, files in os.walk(os.getcwd()):
-        for inputfile in files:
-            if '.pickle' in inputfile:
-                save_files.append([root,inputfile])
-
-    print("Loading pickles")
-    simulations = multiprocessing.Pool(NPROCS).map(load_simulation, save_files)
-
-    print("Merging pickles")
-    all_results = {}
-    for sim in simulations:
-        all_results.update(sim)
-
-    print("Reorganizing pickles")
-    i = 0
-    results = {}
-    resultslookup = {}
-    for mu_n in mu_n_range:
-        for Nt in Nt_SnS_range:
-            for EA in EA_ZnOS_range:
-                for Nt_i in Nt_i_range:
-                    run = deepcopy(baseline_run)
-                    run['mu_n_l']=mu_n
-                    run['Nt_SnS_l']=Nt
-                    run['EA_ZnOS_l']=EA
-                    run['Nt_i_l']=Nt_i
-
-                    for T in temperatures:
-                        run[T] = {}
-                        for ill in illuminations:
-                            run[T][ill] = {}
-                    results[i] = run
-                    resultslookup[(mu_n, Nt, EA, Nt_i)] = i
-                    i=i+1
-
-    for sim_i, sim_data in all_results.items():
-        sim_T = inputs[sim_i]['T_l']
-        sim_ill = inputs[sim_i]['ill_l']
-        results_index = resultslookup[(inputs[sim_i]['mu_n_l'],
-                                      inputs[sim_i]['Nt_SnS_l'],
-                                      inputs[sim_i]['EA_ZnOS_l'],
-                                      inputs[sim_i]['Nt_i_l'])]
-        results[results_index][sim_T][sim_ill] = sim_data
-        if sim_i % 10000 == 0:
-            print('{}'.format(str(sim_i)))
-
-    pickle.dump(results,open('results_redux.pickle',"wb"))
-
-    for cond_i, cond_data in results.items():
-        for T in temperatures:
-            for ill in illuminations:
-                if cond_data[T][ill] == {}:
-                    if i in missing_sims.keys():
-                        missing_sims[cond_i].append([T,ill])
-                    else:
-                        missing_sims[cond_i]=[[T,ill]]
-
-    print("Number missing {}".format(len(missing_sims.keys())))
-    pickle.dump(missing_sims,open('missing_sims.pickle','wb'))
+    merge(args.root, rebuild=args.rebuild)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+Columnar on-disk store for the forward simulation results. The store is a directory of plain .npy files:
+
+    currents.npy       simulated current, shape (grid point, temperature, illumination, voltage), NaN where absent
+    voltages.npy       the voltage axis shared by all runs
+    temperatures.npy   temperature axis
+    illuminations.npy  illumination axis
+    missing.npy        boolean mask of shape (grid point, temperature, illumination), True where a run is missing
+    param_<name>.npy   coordinate of every grid point along each material parameter
+
+and a small meta.json with the parameter names and the shape of the parameter grid. All arrays are opened memory-mapped,
+so inference and analysis tools only touch the slices they need.
+
+Run as a script to convert an existing results pickle (the nested dictionary written by earlier versions of
+process_pickles.py) into a store:
+
+$:running_sims# python results_store.py pickles/simulation_all_results.pickle pickles/simulation_store
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Rachel Kurchin, Riley Brandt, Daniil Kitchaev"
+__date__ = "May 17, 2017"
+
+import numpy as np
+import pickle
+import json
+import os
+import argparse
+from collections import OrderedDict
+from parameter_grid import ParameterGrid
+
+PARAMETER_NAMES = ('mu_n_l', 'Nt_SnS_l', 'EA_ZnOS_l', 'Nt_i_l')
+
+class ResultStore(object):
+    """
+    Memory-mapped view of a simulation result store directory
+    """
+    META_FILE = 'meta.json'
+
+    def __init__(self, path, mode='r'):
+        """
+        Open the store at path. mode is passed on to np.load as mmap_mode, use 'r+' to write into an existing store.
+        """
+        self.path = path
+        with open(os.path.join(path, self.META_FILE), 'r') as f:
+            meta = json.load(f)
+        self.grid_shape = tuple(meta['grid_shape']) if meta['grid_shape'] is not None else None
+
+        load = lambda name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)
+        self.currents = load('currents')
+        self.missing = load('missing')
+        self.voltages = np.load(os.path.join(path, 'voltages.npy'))
+        self.temperatures = np.load(os.path.join(path, 'temperatures.npy'))
+        self.illuminations = np.load(os.path.join(path, 'illuminations.npy'))
+        self.parameters = OrderedDict((name, load('param_' + name)) for name in meta['parameters'])
+
+    @classmethod
+    def create(cls, path, parameters, temperatures, illuminations, voltages, grid_shape=None, dtype=np.float64):
+        """
+        Preallocate an empty store (all runs missing) in the directory path.
+
+        parameters: ordered mapping of parameter name to the coordinate of each grid point along that parameter
+
+        grid_shape: shape of the full-factorial parameter grid the points are laid out on in C order, if any
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        num_points = len(next(iter(parameters.values())))
+        shape = (num_points, len(temperatures), len(illuminations))
+
+        currents = np.lib.format.open_memmap(os.path.join(path, 'currents.npy'), mode='w+', dtype=dtype,
+                                             shape=shape + (len(voltages),))
+        currents[:] = np.nan
+        currents.flush()
+        missing = np.lib.format.open_memmap(os.path.join(path, 'missing.npy'), mode='w+', dtype=np.bool_, shape=shape)
+        missing[:] = True
+        missing.flush()
+        del currents, missing
+
+        np.save(os.path.join(path, 'voltages.npy'), np.asarray(voltages, dtype=np.float64))
+        np.save(os.path.join(path, 'temperatures.npy'), np.asarray(temperatures))
+        np.save(os.path.join(path, 'illuminations.npy'), np.asarray(illuminations))
+        for name, coords in parameters.items():
+            np.save(os.path.join(path, 'param_' + name + '.npy'), np.asarray(coords))
+        with open(os.path.join(path, cls.META_FILE), 'w') as f:
+            json.dump({'parameters': list(parameters.keys()),
+                       'grid_shape': list(grid_shape) if grid_shape is not None else None}, f)
+
+        return cls(path, mode='r+')
+
+    def __len__(self):
+        return self.currents.shape[0]
+
+    def grid(self):
+        """
+        ParameterGrid of the grid points, read off the parameter coordinates. Raises ValueError if the points are not
+        laid out on a full-factorial grid.
+        """
+        if self.grid_shape is None:
+            raise ValueError("Result store at {} is not laid out on a parameter grid".format(self.path))
+        axes = []
+        for axis, (name, coords) in enumerate(self.parameters.items()):
+            index = [0] * len(self.grid_shape)
+            index[axis] = slice(None)
+            axes.append((name, np.asarray(coords).reshape(self.grid_shape)[tuple(index)]))
+        return ParameterGrid(axes)
+
+    def set_run(self, i, T_i, ill_i, JArray, VArray):
+        """
+        Write the J(V) curve of one run, given by grid point and temperature/illumination indices, into the store
+        """
+        V_index = voltage_index(self.voltages, VArray)
+        self.currents[i, T_i, ill_i, :] = np.nan
+        self.currents[i, T_i, ill_i, V_index] = JArray
+        self.missing[i, T_i, ill_i] = False
+
+    def flush(self):
+        self.currents.flush()
+        self.missing.flush()
+
+def voltage_index(voltages, VArray):
+    """
+    Positions of the voltages of one run on the shared voltage axis, raising ValueError if the run is not on it. Each
+    voltage is matched to the nearest axis voltage, so values rounded either way when SCAPS wrote them are still found.
+    """
+    VArray = np.asarray(VArray, dtype=np.float64)
+    upper = np.clip(np.searchsorted(voltages, VArray), 0, len(voltages) - 1)
+    lower = np.maximum(upper - 1, 0)
+    index = np.where(np.abs(voltages[lower] - VArray) < np.abs(voltages[upper] - VArray), lower, upper)
+    if not np.allclose(voltages[index], VArray, rtol=0, atol=1e-9):
+        raise ValueError("Run voltages {} are not on the shared voltage axis".format(VArray))
+    return index
+
+def result_axes(results):
+    """
+    Temperature, illumination and voltage axes of the nested results dictionary {i: {T: {ill: (JArray, VArray)}}}. The
+    voltage axis is shared by all runs, so it is taken from the longest sweep.
+    """
+    first = results[next(iter(results))]
+    temperatures = np.array(sorted(k for k in first.keys() if isinstance(k, (int, float, np.number))))
+    illuminations = np.array(sorted(first[temperatures[0]].keys()))
+
+    voltages = np.zeros(0)
+    for run in results.values():
+        for T in temperatures:
+            for ill in illuminations:
+                if len(run[T][ill]) and len(run[T][ill][1]) > len(voltages):
+                    voltages = np.asarray(run[T][ill][1], dtype=np.float64)
+
+    return temperatures, illuminations, voltages
+
+def pack_results(results, dtype=np.float64):
+    """
+    Pack the nested results dictionary produced by earlier versions of process_pickles.py into a dense current array of
+    shape (grid point, temperature, illumination, voltage) on one shared voltage axis. Runs that are missing or shorter
+    than the longest sweep are padded with NaN.
+
+    Returns (currents, voltages, temperatures, illuminations)
+    """
+    temperatures, illuminations, voltages = result_axes(results)
+
+    currents = np.full((len(results), len(temperatures), len(illuminations), len(voltages)), np.nan, dtype=dtype)
+    for i, run in results.items():
+        for T_i, T in enumerate(temperatures):
+            for ill_i, ill in enumerate(illuminations):
+                if len(run[T][ill]):
+                    JArray, VArray = run[T][ill]
+                    currents[i, T_i, ill_i, voltage_index(voltages, VArray)] = JArray
+
+    return currents, voltages, temperatures, illuminations
+
+def write_results(results, path, parameter_names=PARAMETER_NAMES, dtype=np.float64):
+    """
+    Write the nested results dictionary into a new store at path, one run at a time, and return the opened store
+    """
+    temperatures, illuminations, voltages = result_axes(results)
+
+    parameters = OrderedDict((name, np.array([results[i][name] for i in range(len(results))]))
+                             for name in parameter_names)
+    grid_shape = tuple(len(np.unique(coords)) for coords in parameters.values())
+    if np.prod(grid_shape) != len(results):
+        grid_shape = None
+
+    store = ResultStore.create(path, parameters, temperatures, illuminations, voltages, grid_shape=grid_shape,
+                               dtype=dtype)
+    for i, run in results.items():
+        for T_i, T in enumerate(temperatures):
+            for ill_i, ill in enumerate(illuminations):
+                if len(run[T][ill]):
+                    store.set_run(i, T_i, ill_i, *run[T][ill])
+    store.flush()
+    return store
+
+def convert_pickle(pickle_path, store_path, parameter_names=PARAMETER_NAMES, dtype=np.float64):
+    """
+    Convert a results pickle written by earlier versions of process_pickles.py into a result store
+    """
+    with open(pickle_path, 'rb') as f:
+        results = pickle.load(f)
+    return write_results(results, store_path, parameter_names=parameter_names, dtype=dtype)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a simulation results pickle into a result store")
+    parser.add_argument('pickle', help="Results pickle written by process_pickles.py")
+    parser.add_argument('store', help="Directory to write the result store to")
+    parser.add_argument('-float32', help="Store currents in single precision", action='store_true')
+    args = parser.parse_args()
+
+    store = convert_pickle(args.pickle, args.store, dtype=np.float32 if args.float32 else np.float64)
+    print("Wrote {} grid points, {} missing runs".format(len(store), int(store.missing.sum())))
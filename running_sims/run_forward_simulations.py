@@ -6,39 +6,64 @@ __author__ = "Rachel Kurchin, Riley Brandt, Daniil Kitchaev"
 __date__ = "May 17, 2017"
 
 from run_scaps_parallel import SCAPSrunner
+from parameter_grid import SWEEP_GRID
+from scaps_cache import SCAPSCache
+from journal import ResultJournal
+from executors import SharedQueueExecutor, QueueWorker
+from instrumentation import SweepMonitor
+from shared_results import SharedResults
 import numpy as np
-from copy import deepcopy
 import pickle
 import os
 import argparse
 import json
 
-def scaps_output_processor(return_path):
+# Run parameters shared by every run of the sweep; the grid parameters are filled in per run
+BASELINE_RUN = {'def': "SnS_base.scaps",
+                'mu_n_l': 60,
+                'Nt_SnS_l': 1e17,
+                'EA_ZnOS_l': 4.0,
+                'Nt_i_l': 1e10,
+                "V_max": 0.5}
+
+def scaps_output_processor(return_path, out=None):
     """
     Convert output of a SCAPS simulation to a numpy format for further processing
+
+    The file is read in a single pass: the rows of every IV table, which starts two lines below a 'jtot' header and
+    ends one line above the 'deduced' summary, are collected and converted in bulk. If out is given, either an array of
+    shape (2, N) or a (JArray, VArray) pair of arrays with room for at least as many points as the file holds, the
+    results are written into it and views of the filled part are returned.
     """
-    ii, simList, summaryList, dataLines = 0, [], [], []
+    rows, block, skip = [], None, False
     with open(return_path,'r') as f:
         for line in f:
-            if 'jtot' in line: simList.append(ii)
-            elif 'deduced' in line: summaryList.append(ii)
-            ii += 1
-
-    for xi, x in enumerate(simList):
-        dataLines.extend(list(range(x + 2, summaryList[xi] - 1)))
-
-    JArray, VArray = np.zeros(len(dataLines)), np.zeros(len(dataLines))
-
-    ii = 0
-    with open(return_path,'r') as f:
-        for jj, line in enumerate(f):
-            if jj in dataLines:
-                floats = [float(x) for x in line.split("\t")]
-                JArray[ii] = floats[1]
-                VArray[ii] = floats[0]
-                ii += 1
-
-    return (JArray, VArray)
+            if 'jtot' in line:
+                block, skip = [], True # the line below the header is not data
+            elif 'deduced' in line:
+                if block is not None:
+                    rows.extend(block[:-1]) # neither is the line above the summary
+                block = None
+            elif skip:
+                skip = False
+            elif block is not None:
+                block.append(line)
+
+    if not rows:
+        JArray, VArray = np.zeros(0), np.zeros(0)
+    else:
+        num_cols = rows[0].count("\t") + 1
+        data = np.array("\t".join(rows).split(), dtype=np.float64).reshape(len(rows), num_cols)
+        JArray, VArray = data[:, 1], data[:, 0]
+
+    if out is None:
+        return (np.ascontiguousarray(JArray), np.ascontiguousarray(VArray))
+    J_out, V_out = out
+    if len(J_out) < len(JArray) or len(V_out) < len(VArray):
+        raise ValueError("Output buffer holds {} points, {} has {}".format(len(J_out), return_path, len(JArray)))
+    J_out[:len(JArray)] = JArray
+    V_out[:len(VArray)] = VArray
+    return (J_out[:len(JArray)], V_out[:len(VArray)])
 
 def scaps_script_generator(calc_param):
     """
@@ -62,66 +87,107 @@ def scaps_script_generator(calc_param):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-si', help="Start index for this run", type=int, default=0)
-    parser.add_argument('-ni', help="Number of inputs to run here", type=int, default=0)
-    parser.add_argument('-node', help="Node index (proc index offset)", type=int, default=0)
+    parser.add_argument('-ni', help="Number of inputs to run here (default: the rest of the grid)", type=int, default=0)
+    parser.add_argument('-node', help="Node index, used to name the output files", type=int, default=0)
+    parser.add_argument('-ncores', help="Number of SCAPS processes on this node", type=int, default=32)
+    parser.add_argument('-proc_offset', help="Index of the first proc folder used on this node", type=int, default=0)
+    parser.add_argument('-cache', help="Directory of the SCAPS run cache", default='scaps_cache')
+    parser.add_argument('-cache_gb', help="Size limit of the run cache in GB", type=float, default=10)
+    parser.add_argument('-no_cache', help="Always run SCAPS, bypassing the run cache", action='store_true')
+    parser.add_argument('-journal', help="Journal of finished runs (default simulation_n<node>.journal). Rerunning "
+                                         "with the same journal resumes an interrupted sweep", default=None)
+    parser.add_argument('-timeout', help="Seconds after which a single SCAPS run is killed", type=float, default=600)
+    parser.add_argument('-retries', help="Times a failed SCAPS run is retried", type=int, default=2)
+    parser.add_argument('-batch', help="Runs packed into one SCAPS invocation", type=int, default=1)
+    parser.add_argument('-displays', help="Persistent Xvfb displays, one per 'worker' or one 'shared', instead of "
+                                          "xvfb-run for every run", choices=['worker', 'shared'], default=None)
+    parser.add_argument('-queue', help="Queue directory on a shared filesystem. Without -worker this process is the "
+                                       "coordinator and queues the runs instead of running them", default=None)
+    parser.add_argument('-worker', help="Run chunks from the -queue directory until the coordinator closes it",
+                        action='store_true')
+    parser.add_argument('-chunk', help="Runs handed to a queue worker at a time", type=int, default=16)
+    parser.add_argument('-heartbeat_timeout', help="Seconds of silence after which a queue worker's chunks are "
+                                                   "reassigned", type=float, default=120)
+    parser.add_argument('-shared', help="Return outputs through shared-memory result arrays instead of the worker "
+                                        "queues", action='store_true')
+    parser.add_argument('-events', help="Record per-run timing, worker utilization and queue depth as an event stream "
+                                        "in this file (.jsonl or .csv)", default=None)
+    parser.add_argument('-status_interval', help="Seconds between sweep status lines with -events", type=float,
+                        default=60)
     args = parser.parse_args()
 
     node = args.node
 
     # Initialize SCAPS runner object
-    scaps_runner = SCAPSrunner(ncores=32,
+    scaps_runner = SCAPSrunner(ncores=args.ncores,
                                input_processor=scaps_script_generator,
-                               output_processor=scaps_output_processor)
-
-    baseline_run = {'def': "SnS_base.scaps",
-                    'mu_n_l': 60,
-                    'Nt_SnS_l': 1e17,
-                    'EA_ZnOS_l': 4.0,
-                    'Nt_i_l': 1e10,
-                    "V_max": 0.5}
-
-    temperatures = np.array([280, 300, 320])
-    illuminations = np.array([31, 108])
-    mu_n_range = np.linspace(20, 80, 20)
-    Nt_SnS_range = np.logspace(16, 18, 20)
-    EA_ZnOS_range = np.linspace(3.4, 4.3, 15)
-    Nt_i_range = np.logspace(10, 14, 16)
-
-    inputs = {}
-    i = 0
-
-    for temp in temperatures:
-        for ill in illuminations:
-            for Nt_i in Nt_i_range:
-                for mu_n in mu_n_range:
-                    for Nt in Nt_SnS_range:
-                        for EA in EA_ZnOS_range:
-                            run=deepcopy(baseline_run)
-                            baseline_run['Nt_i_l'] = Nt_i
-                            run['mu_n_l'] = mu_n
-                            run['Nt_SnS_l'] = Nt
-                            run['EA_ZnOS_l'] = EA
-                            run['T_l'] = temp
-                            run['ill_l'] = ill
-                            inputs[i] = run
-                            i += 1
-
-    with open("input_parameters.json", 'w') as fout:fout.write(json.dumps(inputs))
-
+                               output_processor=scaps_output_processor,
+                               cache=None if args.no_cache else SCAPSCache(args.cache, int(args.cache_gb * 1024**3)),
+                               timeout=args.timeout,
+                               max_retries=args.retries,
+                               proc_offset=args.proc_offset,
+                               batch_size=args.batch,
+                               displays=args.displays)
+
+    if args.worker:
+        monitor = SweepMonitor(args.events, report_interval=args.status_interval) if args.events else None
+        QueueWorker(args.queue, scaps_runner, monitor=monitor).serve()
+        if monitor is not None:
+            monitor.print_summary()
+            monitor.close()
+        raise SystemExit
+
+    baseline_run = BASELINE_RUN
+
+    # Run parameters are generated lazily from the grid, one dictionary per run as it is dispatched
+    inputs = SWEEP_GRID.inputs(baseline_run)
+
+    with open("input_parameters.json", 'w') as fout:
+        fout.write(json.dumps({'baseline': baseline_run, 'grid': SWEEP_GRID.to_dict()}))
+
+    if args.queue:
+        # Runs are carried out by -worker processes on any number of nodes; their journals live in the queue directory
+        executor, journal = SharedQueueExecutor(args.queue, args.chunk, args.heartbeat_timeout), None
+    else:
+        # Every finished run is journaled immediately; IDs already in the journal are skipped
+        executor, journal = None, ResultJournal(args.journal or "simulation_n{}.journal".format(node))
+        print("Journal {} holds {} finished runs".format(journal.path, len(journal)))
+
+    # Split [si, si + ni) into batches, spreading the remainder so that no run is dropped
+    ni = args.ni or len(inputs) - args.si
+    # The monitor spans all batches, so its status lines give the ETA of the whole sweep on this node
+    monitor = None
+    if args.events and executor is None:
+        monitor = SweepMonitor(args.events, total=ni, report_interval=args.status_interval)
+    if executor is not None:
+        executor.submit(inputs.subset(range(args.si, args.si + ni)))
     n_batches = 16
-    for batch_i in range(n_batches):
-        batch_size = int((args.si + args.ni)/n_batches)
-        batch_inputs = {}
-        for pt_i in range(args.si + batch_i * batch_size, args.si + batch_i * batch_size + batch_size):
-            batch_inputs[pt_i] = inputs[pt_i]
+    for batch_i, batch_ids in enumerate(np.array_split(np.arange(args.si, args.si + ni), n_batches)):
+        if len(batch_ids) == 0:
+            continue
+        start, end = int(batch_ids[0]), int(batch_ids[-1]) + 1
+        batch_inputs = inputs.subset(batch_ids.tolist())
+
+        # Outputs of the local workers can be parsed straight into shared memory, one slot per run of the batch, with
+        # room for the points of the IV sweep of scaps_script_generator
+        shared = None
+        if args.shared and executor is None:
+            shared = SharedResults(len(batch_ids), int(round(baseline_run['V_max'] / 0.02)) + 1)
 
         # Run the inputs
-        print("[Batch {}] Starting SCAPS runs ({}-{})".format(batch_i, args.si + batch_i * batch_size, args.si + batch_i * batch_size + batch_size))
-        outputs = scaps_runner.run_inputs(batch_inputs, print_progress=True)
+        print("[Batch {}] Starting SCAPS runs ({}-{})".format(batch_i, start, end))
+        outputs = scaps_runner.run_inputs(batch_inputs, print_progress=True, journal=journal, executor=executor,
+                                          monitor=monitor, shared=shared)
 
         # Save outputs
         print("[Batch {}] Saving outputs as pickles...".format(batch_i))
-        pickle.dump(outputs, open("simulation_{}_{}_n{}_b{}.pickle".format(args.si + batch_i * batch_size,
-                                                                           args.si + batch_i * batch_size + batch_size,
-                                                                           node,
-                                                                           batch_i),"wb"))
+        pickle.dump(outputs, open("simulation_{}_{}_n{}_b{}.pickle".format(start, end, node, batch_i),"wb"))
+        if scaps_runner.failures:
+            with open("failures_n{}_b{}.json".format(node, batch_i), 'w') as fout:
+                fout.write(json.dumps(scaps_runner.failures, indent=1))
+
+    if executor is not None:
+        executor.close()
+    if monitor is not None:
+        monitor.print_summary()
+        monitor.close()
@@ -15,10 +15,33 @@ __date__ = "July 20, 2016"
 import os
 import shutil
 import subprocess
+import signal
 from multiprocessing import Process, Queue
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
 import time
 from copy import deepcopy
+from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
+import hashlib
 import random
+from collections import deque
+from scaps_cache import SCAPSCache
+from executors import LocalExecutor
+from displays import DisplayPool
+from instrumentation import Throughput, format_duration
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class SCAPSRunError(RuntimeError):
+    """
+    A single SCAPS run timed out or did not produce a result file
+    """
+    pass
 
 class SCAPSrunner:
     ##################################################################################################################
@@ -34,8 +57,20 @@ class SCAPSrunner:
     SCAPS_EXEC_DIR = '{}/scaps_exec'.format(ROOTDIR)
     ##################################################################################################################
 
+    LIVENESS_INTERVAL = 5 # Seconds between worker liveness checks while no output is arriving
+    SYNC_THREADS = 8 # VMs provisioned or synced concurrently
+
+    # Files of a WINE prefix, relative to its root, that WINE or SCAPS write to and that provision() therefore copies
+    # into every VM instead of sharing with the reference VM
+    VM_WRITABLE = ['*.reg', '.update-timestamp', 'drive_c/windows/*.ini', 'drive_c/windows/temp/*', 'drive_c/users/*',
+                   'drive_c/Program Files/Scaps3302/*.ini', 'drive_c/Program Files/Scaps3302/*.log',
+                   'drive_c/Program Files/Scaps3302/script/*', 'drive_c/Program Files/Scaps3302/results/*',
+                   'drive_c/Program Files/Scaps3302/def/*', 'drive_c/Program Files/Scaps3302/absorption/*',
+                   'drive_c/Program Files/Scaps3302/filter/*']
+
     SCAPS_ROOT = '#/drive_c/Program Files/Scaps3302'
     SCAPS_CMD = 'WINEDEBUG=-all WINEPREFIX=# WINEARCH=win32 xvfb-run -a wine #/drive_c/Program\ Files/Scaps3302/scaps3303.exe'
+    XVFB_RUN = 'xvfb-run -a ' # Dropped from SCAPS_CMD when the runner provides its own displays
 
     def __init__(self,
                  input_processor,
@@ -45,7 +80,13 @@ class SCAPSrunner:
                  scaps_param_abs_dir=SCAPS_PARAM_ABS_DIR,
                  scaps_param_ftr_dir=SCAPS_PARAM_FTR_DIR,
                  scaps_install_dir=SCAPS_INSTALL_DIR,
-                 scaps_exec_dir=SCAPS_EXEC_DIR):
+                 scaps_exec_dir=SCAPS_EXEC_DIR,
+                 cache=None,
+                 timeout=None,
+                 max_retries=2,
+                 proc_offset=0,
+                 batch_size=1,
+                 displays=None):
         """
         Initialize the SCAPS parallel processor.
 
@@ -56,6 +97,25 @@ class SCAPSrunner:
                           representation of the output
 
         ncores: number of processes used to run
+
+        cache: optional SCAPSCache. Runs whose generated script and def, absorption and filter files match an earlier
+               run are then served from the cache instead of launching SCAPS.
+
+        timeout: wall-clock limit in seconds for a single SCAPS run, after which its whole process group is killed
+
+        max_retries: number of times a failed run (timeout, crash, no result, output processor error or dead worker)
+                     is retried before it is given up on and recorded in self.failures
+
+        proc_offset: index of the first proc folder used, so that several runners on one machine can use disjoint VMs
+
+        batch_size: number of runs packed into a single SCAPS invocation, to pay for starting WINE and SCAPS only once
+                    per batch. Runs that fail inside a batch are retried on their own.
+
+        displays: None to give every run its own X server through xvfb-run, as in SCAPS_CMD; 'worker' to start one
+                  long-lived Xvfb display per worker process, or 'shared' for a single display used by all workers.
+                  The displays are started with the workers, passed to SCAPS through DISPLAY, checked at every liveness
+                  check and restarted if they have died; the workers of a display restarted on a new number are
+                  respawned with it.
         """
         self.ncores = ncores
         if ncores > self.MAX_CORENUM:
@@ -68,31 +128,132 @@ class SCAPSrunner:
         self.scaps_param_ftr_dir = scaps_param_ftr_dir
         self.scaps_install_dir = scaps_install_dir
         self.scaps_exec_dir = scaps_exec_dir
+        self.cache = cache
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.proc_offset = proc_offset
+        self.batch_size = batch_size
+        if displays not in (None, 'worker', 'shared'):
+            raise ValueError("displays must be None, 'worker' or 'shared'")
+        self.displays = displays
+        self.failures = {}
+        self.given_up = set()
+
+    def proc_dir(self, core):
+        return '{}/proc{}'.format(self.scaps_exec_dir, core)
+
+    def provision(self, method='hardlink', cores=None):
+        """
+        Create the execution VMs proc<core> from the reference VM, in parallel. Only the files that WINE or SCAPS write
+        to (those matching VM_WRITABLE) are copied; every other file is shared with the reference VM, which makes a new
+        VM nearly free in time and disk space. Files that already exist in a VM are left alone, so provisioning can be
+        rerun to add VMs or repair missing files.
+
+        method: 'hardlink' shares files by hardlinking them, falling back to a copy across filesystems; 'reflink'
+                clones the whole prefix with cp --reflink=always, for copy-on-write filesystems such as btrfs or XFS,
+                where every file is private to the VM anyway, and falls back to a full copy on other filesystems;
+                'copy' makes a full copy, like cp -r. Missing files of an existing VM are always copied unless method
+                is 'hardlink'.
+
+        cores: VMs to create, by default this runner's proc folders
+        """
+        if method not in ('hardlink', 'reflink', 'copy'):
+            raise ValueError("Unknown provisioning method {}".format(method))
+        if cores is None:
+            cores = range(self.proc_offset, self.proc_offset + self.ncores)
+        if not os.path.exists(self.scaps_exec_dir):
+            os.makedirs(self.scaps_exec_dir)
+
+        def provision_vm(core):
+            dst_root = self.proc_dir(core)
+            if method == 'reflink' and not os.path.exists(dst_root):
+                with open(os.devnull, 'w') as devnull:
+                    if subprocess.call(['cp', '-a', '--reflink=always', self.scaps_install_dir, dst_root],
+                                       stderr=devnull) == 0:
+                        return
+                # Not a copy-on-write filesystem: drop whatever cp got to and copy the files instead
+                if os.path.exists(dst_root):
+                    shutil.rmtree(dst_root)
+            for src_dir, dirs, files in os.walk(self.scaps_install_dir):
+                dst_dir = os.path.join(dst_root, os.path.relpath(src_dir, self.scaps_install_dir))
+                if not os.path.isdir(dst_dir):
+                    os.makedirs(dst_dir)
+                for name in dirs + files:
+                    src, dst = os.path.join(src_dir, name), os.path.join(dst_dir, name)
+                    if os.path.islink(src):
+                        # e.g. the dosdevices drive links, which are recreated rather than followed
+                        if not os.path.lexists(dst):
+                            os.symlink(os.readlink(src), dst)
+                    elif name in files and not os.path.lexists(dst):
+                        rel = os.path.relpath(src, self.scaps_install_dir)
+                        if method != 'hardlink' or any(fnmatch(rel, pattern) for pattern in self.VM_WRITABLE):
+                            shutil.copy2(src, dst)
+                        else:
+                            try:
+                                os.link(src, dst)
+                            except OSError:
+                                shutil.copy2(src, dst)
+                dirs[:] = [name for name in dirs if not os.path.islink(os.path.join(src_dir, name))]
+
+        pool = ThreadPool(min(len(cores), self.SYNC_THREADS))
+        try:
+            pool.map(provision_vm, cores)
+        finally:
+            pool.close()
 
     def sync_parameters(self):
         """
-        Syncs the contents of the reference def and absorption directories with all SCAPS execution proc folders. Does
-        not modify the refence VM however.
-        """
-        def copytree(src, dst, symlinks=False, ignore=None):
-            for item in os.listdir(src):
-                s = os.path.join(src, item)
-                d = os.path.join(dst, item)
-                if os.path.isdir(s):
-                    shutil.copytree(s, d, symlinks, ignore)
-                else:
-                    shutil.copy2(s, d)
+        Syncs the contents of the reference def, absorption and filter directories with all SCAPS execution proc
+        folders, in parallel. Does not modify the refence VM however.
 
-        for core in range(self.ncores):
-            copytree(self.scaps_param_def_dir,
-                     "{}/def".format(self.SCAPS_ROOT.replace('#','{}/proc{}'.format(self.scaps_exec_dir, core))))
-            copytree(self.scaps_param_abs_dir,
-                     "{}/absorption".format(self.SCAPS_ROOT.replace('#','{}/proc{}'.format(self.scaps_exec_dir, core))))
-            copytree(self.scaps_param_ftr_dir,
-                     "{}/filter".format(
-                         self.SCAPS_ROOT.replace('#', '{}/proc{}'.format(self.scaps_exec_dir, core))))
+        Only files whose contents differ from the reference are copied. Each is written to a temporary file and renamed
+        over the old one, so a file that is hardlinked to the reference VM or to other VMs is replaced in this VM only,
+        never written through. Returns the number of files copied.
+        """
+        sources = [(src, os.path.join(self.SCAPS_ROOT, sub)) for src, sub in ((self.scaps_param_def_dir, 'def'),
+                                                                               (self.scaps_param_abs_dir, 'absorption'),
+                                                                               (self.scaps_param_ftr_dir, 'filter'))]
+        # (source, destination with the VM as #, size, digest) of every reference file, computed once for all the VMs
+        reference = []
+        for src, sub in sources:
+            for src_dir, dirs, files in os.walk(src):
+                for name in files:
+                    path = os.path.join(src_dir, name)
+                    reference.append((path, os.path.join(sub, os.path.relpath(path, src)),
+                                      os.path.getsize(path), _file_digest(path)))
+
+        def sync_vm(core):
+            copied = 0
+            for src, rel, size, digest in reference:
+                dst = rel.replace('#', self.proc_dir(core), 1)
+                if os.path.exists(dst) and os.path.getsize(dst) == size and _file_digest(dst) == digest:
+                    continue
+                if not os.path.isdir(os.path.dirname(dst)):
+                    os.makedirs(os.path.dirname(dst))
+                shutil.copy2(src, dst + '.sync')
+                os.rename(dst + '.sync', dst)
+                copied += 1
+            return copied
+
+        cores = range(self.proc_offset, self.proc_offset + self.ncores)
+        pool = ThreadPool(min(len(cores), self.SYNC_THREADS))
+        try:
+            return sum(pool.map(sync_vm, cores))
+        finally:
+            pool.close()
+
+    def param_digest(self):
+        """
+        Digest of the def, absorption and filter files synced to the VMs, and of the output processor that turns SCAPS
+        results into the cached outputs. Part of every run cache key.
+        """
+        return SCAPSCache.key(self.SCAPS_CMD, SCAPSCache.digest_files([self.scaps_param_def_dir,
+                                                                        self.scaps_param_abs_dir,
+                                                                        self.scaps_param_ftr_dir]),
+                              "{}.{}".format(self.output_processor.__module__, self.output_processor.__name__))
 
-    def run_inputs(self, inputs, print_progress=True):
+    def run_inputs(self, inputs, print_progress=True, prefetch=2, use_cache=True, journal=None, executor=None,
+                   batch_size=None, monitor=None, shared=None):
         """
         Process SCAPS run parameters in parallel. Takes in a dictionary of inputs, structured as
         {'id1':run_params_1, 'id2':run_params_2, ...}
@@ -101,59 +262,272 @@ class SCAPSrunner:
         Returns a dictionary structured as
         {'id1':output_1, 'id2':output_2, ...}
         where output_1, output_2, ... are the objectrs returned by the pre-specified output processor method
+
+        use_cache: set to False to bypass the run cache, if there is one
+
+        batch_size: runs per SCAPS invocation for this call, instead of the runner's batch_size
+
+        journal: optional ResultJournal that every output is appended to as soon as it arrives. Inputs whose IDs are
+                 already in the journal are not rerun, and their outputs are read back from it, so rerunning an
+                 interrupted sweep with the same journal resumes it.
+
+        executor: where the runs are executed, see executors.py. By default a LocalExecutor runs them in this
+                  runner's worker processes; a SharedQueueExecutor hands them out to worker nodes instead, in which case
+                  prefetch, use_cache and journal are up to the workers and self.failures is taken from the executor.
+
+        monitor: optional SweepMonitor that records per-run timing spans, worker utilization and queue depth of the
+                 local workers as an event stream, see instrumentation.py. A monitor can span several calls, so
+                 printing its summary (SweepMonitor.print_summary) is left to its owner.
+
+        shared: optional SharedResults with a slot for every input, which the workers parse the outputs into instead of
+                sending them back through a queue (see shared_results.py). The returned outputs are then views of
+                the shared arrays. Requires an output processor with an out argument, like scaps_output_processor.
+
+        The progress lines carry an ETA from the rolling throughput of the last runs, which makes a separate
+        time_inputs estimate unnecessary.
+        """
+        output_dict = {}
+        num_total = len(inputs)
+        if executor is None:
+            executor = LocalExecutor(self, prefetch=prefetch, use_cache=use_cache, journal=journal,
+                                     batch_size=batch_size, monitor=monitor, shared=shared)
+        throughput = Throughput()
+        for num_done, (id, output) in enumerate(executor.iter_outputs(inputs), 1):
+            output_dict[id] = output
+            throughput.add()
+            if print_progress:
+                print("Finished input ID{} [{}/{} total, {:.2f} runs/s, ETA {}]".format(
+                    id, num_done, num_total, throughput.rate(), format_duration(throughput.eta(num_total - num_done))))
+
+        if len(output_dict) != num_total:
+            print("Warning: Not all inputs seem to have gotten outputs")
+        self.failures = executor.failures
+        if self.failures:
+            print("Warning: {} inputs failed after {} retries, see the failures attribute".format(
+                len(self.failures), self.max_retries))
+        if self.cache is not None and use_cache and print_progress:
+            print("Run cache: {hits} hits, {misses} misses, {evictions} evictions, {entries} entries".format(
+                **self.cache.stats()))
+
+        return output_dict
+
+    def iter_outputs(self, inputs, prefetch=2, use_cache=True, journal=None, batch_size=None, monitor=None,
+                     shared=None):
         """
+        Generator version of run_inputs, yielding (id, output) pairs in the order the runs finish.
+
+        Every worker process has its own input queue holding at most prefetch batches of up to batch_size runs, each
+        batch run by a single SCAPS invocation. Each time a worker has returned the outputs of a batch, exactly one
+        new batch is queued for it, and once the inputs are exhausted and it is idle it receives a None sentinel.
+        Workers and the coordinator only ever block on their queues, so no CPU is spent while waiting on SCAPS.
 
-        inq = Queue()
+        Failed runs are requeued up to max_retries times. A run that fails inside a batch is requeued on its own
+        without counting as an attempt, as the failure may have been caused by another run of the batch. Workers that
+        die are respawned and their queued runs are requeued. Runs that keep failing are not yielded; they are added
+        to self.given_up as soon as they are given up on, and self.failures maps their IDs to the error of every
+        attempt.
+
+        With a run cache, inputs are looked up as they are dispatched: hits are yielded straight away and misses are
+        stored once their output arrives. With a journal, runs it already holds are yielded first, straight from the
+        journal, and every new output is appended to it before it is yielded.
+
+        monitor: optional SweepMonitor (see instrumentation.py) that the workers' timing spans, dispatches, failures
+                 and queue depths are reported to
+
+        shared: optional SharedResults. Every run dispatched is given a slot of its own, the worker parses its output
+                into that slot and only reports the slot index and status back, and the output yielded is a view of
+                the slot. ValueError is raised when more runs are dispatched than there are slots.
+        """
         outq = Queue()
-        output_dict = {}
-        num_total = len(inputs.keys())
-        num_done = 0
+        inqs = [None] * self.ncores
+        assigned = [{} for _ in range(self.ncores)] # id -> input of the runs queued on each worker
+        batches = [{} for _ in range(self.ncores)] # id -> IDs of its batch that have not returned yet
+        batch_size = batch_size or self.batch_size
+        finished = [False] * self.ncores
+        retries, attempts, self.failures, self.given_up = deque(), {}, {}, set()
+        slot_of, slot_ids = {}, [] # Shared result slot of every run dispatched, and the run of every slot
+        inputiter = inputs.iteritems() if hasattr(inputs, 'iteritems') else iter(inputs.items())
+        if monitor is not None:
+            # A QueueWorker streams its inputs without knowing how many there will be
+            monitor.started(len(inputs) if hasattr(inputs, '__len__') else 0, self.ncores)
+        queue_depth = lambda: sum(len(runs) for runs in assigned)
+
+        if journal is not None:
+            journaled = set(id for id in journal.ids if id in inputs)
+            if monitor is not None and journaled:
+                monitor.journaled(len(journaled))
+            for id, output in journal.outputs(journaled):
+                yield id, output
+            inputiter = ((id, input) for (id, input) in inputiter if id not in journaled)
+
+        cache = self.cache if use_cache else None
+        cached, cache_keys = deque(), {}
+        if cache is not None:
+            param_digest = self.param_digest()
+
+        def next_input():
+            # Retries go first, then new inputs that are not in the cache
+            if retries:
+                return retries.popleft()
+            for (id, input) in inputiter:
+                if cache is not None:
+                    key = cache.key(self.input_processor(input), param_digest)
+                    hit, output = cache.get(key)
+                    if hit:
+                        cached.append((id, output))
+                        continue
+                    cache_keys[id] = key
+                return id, input
+            return None
+
+        def dispatch(proc_i):
+            # Queue the next batch for a worker, or its sentinel once there are no inputs left and it is idle. Retries
+            # are always run on their own.
+            if finished[proc_i]:
+                return
+            batch = [retries.popleft()] if retries else []
+            while len(batch) < batch_size and not retries:
+                pending = next_input()
+                if pending is None:
+                    break
+                batch.append(pending)
+            if batch:
+                runs = [{'id':id, 'calc_param':input} for id, input in batch]
+                if shared is not None:
+                    for run in runs:
+                        if run['id'] not in slot_of:
+                            if len(slot_ids) >= len(shared):
+                                raise ValueError("All {} shared result slots are in use".format(len(shared)))
+                            slot_of[run['id']] = len(slot_ids)
+                            slot_ids.append(run['id'])
+                        run['slot'] = slot_of[run['id']]
+                inqs[proc_i].put(runs)
+                ids = set(id for id, _ in batch)
+                for id, input in batch:
+                    assigned[proc_i][id] = input
+                    batches[proc_i][id] = ids
+                if monitor is not None:
+                    monitor.dispatched(proc_i, [id for id, _ in batch], queue_depth(), len(retries))
+            elif not assigned[proc_i]:
+                inqs[proc_i].put(None)
+                finished[proc_i] = True
+
+        def fail(id, input, error, count=True):
+            attempts[id] = attempts.get(id, 0) + count
+            self.failures.setdefault(id, []).append(error)
+            if attempts[id] <= self.max_retries:
+                retries.append((id, input))
+            else:
+                self.given_up.add(id)
+                print("Giving up on input ID{} after {} attempts: {}".format(id, attempts[id], error))
 
-        proc_list = []
         config_all = {'SCAPS_ROOT':self.SCAPS_ROOT, 'SCAPS_CMD':self.SCAPS_CMD,
                       'SCAPS_EXEC_DIR':self.scaps_exec_dir, 'INPUT_PROC':self.input_processor,
-                      'OUTPUT_PROC':self.output_processor}
-        for proc_i in range(self.ncores):
+                      'OUTPUT_PROC':self.output_processor, 'TIMEOUT':self.timeout, 'PROC_OFFSET':self.proc_offset,
+                      'TIMING':monitor is not None, 'PARENT_PID':os.getpid(),
+                      'LIVENESS_INTERVAL':self.LIVENESS_INTERVAL}
+
+        pool = None
+        if self.displays is not None:
+            pool = DisplayPool(self.ncores if self.displays == 'worker' else 1)
+            pool.start()
+
+        def spawn(proc_i):
             config_proc = deepcopy(config_all)
             config_proc['CORE'] = proc_i
-            proc = Process(target=SCAPSrunner.run_process, args=(config_proc, inq, outq))
+            if pool is not None:
+                config_proc['DISPLAY'] = pool.name(proc_i % len(pool))
+            inqs[proc_i] = Queue()
+            proc = Process(target=SCAPSrunner.run_process, args=(config_proc, inqs[proc_i], outq, shared))
+            proc.daemon = True # Terminated with the coordinator when it exits; run_process handles it being killed
             proc.start()
-            proc_list.append(proc)
+            return proc
+
+        proc_list = [spawn(proc_i) for proc_i in range(self.ncores)]
+
+        try:
+            for _ in range(prefetch):
+                for proc_i in range(self.ncores):
+                    dispatch(proc_i)
+
+            last_check = time.time()
+            while any(assigned) or cached:
+                while cached:
+                    id, output = cached.popleft()
+                    if monitor is not None:
+                        monitor.cached(id)
+                    if journal is not None:
+                        journal.append(id, output)
+                    yield id, output
+                if not any(assigned):
+                    break
 
-        inputiter = inputs.iteritems()
-        while True:
-            running = any(proc.is_alive() for proc in proc_list)
-            if not running:
-                break
-            while inq.empty():
                 try:
-                    (id, input) = inputiter.next()
-                    inq.put({'id':id,'calc_param':input})
-                except:
-                    inq.put({'id':'done'})
-
-            while not outq.empty():
-                pt = outq.get()
-                output_dict[pt['id']] = pt['output']
-                num_done += 1
-                if print_progress:
-                    print("Finished input ID{} [{}/{} total]".format(pt['id'], num_done, num_total))
-
-        for proc_i, proc in enumerate(proc_list):
-            proc.join()
-
-        # Garbage collect
-        while not inq.empty():
-            inq.get()
-        while not outq.empty():
-            outq.join()
-        # Give queues time to close
-        time.sleep(5)
-
-        if not (set(inputs.keys())==set(output_dict.keys())):
-            print("Warning: Not all inputs seem to have gotten outputs")
-
-        return output_dict
+                    pt = outq.get(timeout=self.LIVENESS_INTERVAL)
+                except Empty:
+                    pt = None
+
+                if time.time() - last_check >= self.LIVENESS_INTERVAL:
+                    # Respawn dead workers and requeue whatever they were holding
+                    last_check = time.time()
+                    if pool is not None:
+                        names = [pool.name(i) for i in range(len(pool))]
+                        for i in pool.ensure():
+                            print("Virtual display {} died, restarted as {}".format(names[i], pool.name(i)))
+                            if pool.name(i) != names[i]:
+                                # Workers read their DISPLAY when spawned, so those on a moved display are respawned
+                                for proc_i, proc in enumerate(proc_list):
+                                    if proc_i % len(pool) == i and proc.is_alive():
+                                        proc.terminate()
+                                        proc.join()
+                    for proc_i, proc in enumerate(proc_list):
+                        if assigned[proc_i] and not proc.is_alive():
+                            print("SCAPS worker {} died (exit code {}), respawning".format(proc_i, proc.exitcode))
+                            if monitor is not None:
+                                monitor.worker_died(proc_i, proc.exitcode, len(assigned[proc_i]))
+                            lost, assigned[proc_i], batches[proc_i] = assigned[proc_i], {}, {}
+                            for id, input in lost.items():
+                                fail(id, input, "worker {} died".format(proc_i))
+                            proc_list[proc_i] = spawn(proc_i)
+                            for _ in range(prefetch):
+                                dispatch(proc_i)
+
+                if pt is not None and 'slot' in pt:
+                    pt['id'] = slot_ids[pt['slot']]
+                    if 'error' not in pt:
+                        pt['output'] = shared.get(pt['slot'])
+
+                # Results of runs that were requeued when their worker died are dropped
+                if pt is None or pt['id'] not in assigned[pt['core']]:
+                    continue
+                input = assigned[pt['core']].pop(pt['id'])
+                batch = batches[pt['core']].pop(pt['id'])
+                batch.discard(pt['id'])
+                if 'error' in pt:
+                    fail(pt['id'], input, pt['error'], count=not pt.get('batched', False))
+                else:
+                    self.failures.pop(pt['id'], None)
+                if not batch:
+                    dispatch(pt['core'])
+                if monitor is not None:
+                    monitor.finished(pt, queue_depth(), len(retries))
+                if 'error' in pt:
+                    continue
+
+                if pt['id'] in cache_keys:
+                    cache.put(cache_keys.pop(pt['id']), pt['output'])
+                if journal is not None:
+                    journal.append(pt['id'], pt['output'])
+                yield pt['id'], pt['output']
+
+            for proc in proc_list:
+                proc.join()
+        finally:
+            for proc in proc_list:
+                if proc.is_alive():
+                    proc.terminate()
+            if pool is not None:
+                pool.stop()
 
     def time_inputs(self, inputs, sample_size=216):
         sample_inputs = {}
@@ -167,7 +541,36 @@ class SCAPSrunner:
         return (endTime-startTime)/sample_size
 
     @staticmethod
-    def run_scaps_thread(config, run_params):
+    def vm_dirs(config):
+        """
+        WINE prefix, script directory and result directory of the VM a worker runs in
+        """
+        proc_dir = '{}/proc{}'.format(config['SCAPS_EXEC_DIR'], config['CORE'] + config.get('PROC_OFFSET', 0))
+        scaps_dir = config['SCAPS_ROOT'].replace('#', proc_dir)
+        return proc_dir, os.path.join(scaps_dir, 'script'), os.path.join(scaps_dir, 'results')
+
+    @staticmethod
+    def launch_scaps(config, proc_dir, script_name, timeout=None):
+        """
+        Run SCAPS on a script in a VM and return its exit code. SCAPS runs in its own process group so that a hung run
+        can be killed together with WINE; SCAPSRunError is raised when it does not finish within timeout seconds. If
+        config has a 'DISPLAY', SCAPS runs on that display instead of under xvfb-run.
+        """
+        cmd, env = config['SCAPS_CMD'], None
+        if config.get('DISPLAY'):
+            cmd = cmd.replace(SCAPSrunner.XVFB_RUN, '')
+            env = dict(os.environ, DISPLAY=config['DISPLAY'])
+        proc = subprocess.Popen(cmd.replace('#', proc_dir) + " " + script_name, shell=True, env=env,
+                                preexec_fn=os.setsid)
+        try:
+            return proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+            raise SCAPSRunError("SCAPS timed out after {} s".format(timeout))
+
+    @staticmethod
+    def run_scaps_thread(config, run_params, shared=None):
         """
         Executes SCAPS on a single thread. Needs a configuration dictionary and a run_parameters dictionary.
 
@@ -181,36 +584,137 @@ class SCAPSrunner:
 
         For the purposes of the script generator, the python runscript is always called 'pythonscript.script' and the
         output file is always called 'pythonresult.txt'
+
+        If config has a 'TIMEOUT', SCAPS is killed after that many seconds. SCAPSRunError is raised when a run times
+        out or leaves no result file. If config has 'TIMING' set, the output has a 'timing' field with the seconds
+        spent writing the script, running SCAPS from launch to exit and parsing the output (see instrumentation.py).
+
+        With a SharedResults in shared, the output is parsed into the slot given by run_params['slot'] and the output
+        dictionary only holds the slot index.
         """
+        start = time.time()
+        proc_dir, script_dir, result_dir = SCAPSrunner.vm_dirs(config)
+
         script_name = "pythonscript.script"
-        script_dir = os.path.join(config['SCAPS_ROOT'].replace('#','{}/proc{}'.format(config['SCAPS_EXEC_DIR'], config['CORE'])), 'script')
         script_file = os.path.join(script_dir, script_name)
 
         result_name = "pythonresult.txt"
-        result_dir = os.path.join(config['SCAPS_ROOT'].replace('#','{}/proc{}'.format(config['SCAPS_EXEC_DIR'], config['CORE'])), 'results')
         result_file = os.path.join(result_dir, result_name)
 
         script = config['INPUT_PROC'](run_params['calc_param']) + "\nsave results.iv {}\n".format(result_name)
         with open(script_file,"w") as fout: fout.write(script)
 
-        subprocess.call(config['SCAPS_CMD'].replace('#','{}/proc{}'.format(config['SCAPS_EXEC_DIR'], config['CORE'])) + " " + script_name, shell=True)
-        return {'id':run_params['id'], 'output': config['OUTPUT_PROC'](result_file)}
+        # Never hand the output processor a result left over from the previous run in this VM
+        if os.path.exists(result_file):
+            os.remove(result_file)
+
+        launched = time.time()
+        returncode = SCAPSrunner.launch_scaps(config, proc_dir, script_name, timeout=config.get('TIMEOUT'))
+        exited = time.time()
+
+        if not os.path.exists(result_file):
+            raise SCAPSRunError("SCAPS produced no result file (exit code {})".format(returncode))
+        if shared is not None:
+            shared.write(run_params['slot'], config['OUTPUT_PROC'], result_file)
+            output = {'slot':run_params['slot']}
+        else:
+            output = {'id':run_params['id'], 'output': config['OUTPUT_PROC'](result_file)}
+        if config.get('TIMING'):
+            output['timing'] = {'script': launched - start, 'scaps': exited - launched, 'parse': time.time() - exited}
+        return output
 
     @staticmethod
-    def run_process(config, inputs, outq):
+    def run_scaps_batch(config, batch, shared=None):
         """
-        Runs a thread that pulls inputs from the input queue and calls the SCAPS thread processor to get an output.
-        Terminates when it receives an input with the id 'done'. The config dictionary is defined analogously to that
-        detailed in run_scaps_thread, while the inputs queue gives a pointer to the root-level queue that distributes
-        SCAPS inputs to the various running processes.
+        Executes several runs in a single SCAPS invocation. The scripts of the runs, each ending in its own
+        'save results.iv pythonresult_<k>.txt', are concatenated into one 'pythonscript.script'; every run reloads the
+        settings file, so the runs do not depend on each other.
+
+        batch is a list of run_params dictionaries as for run_scaps_thread. Returns one output dictionary per run, with
+        an 'error' field instead of an 'output' for runs without a result, and a 'batched' flag. The timeout in config
+        applies to every run, so the whole batch is allowed len(batch) times as long. With 'TIMING' in config, every
+        run is timed as in run_scaps_thread, with an equal share of the time spent on the script and in SCAPS. With
+        shared, outputs are parsed into the slots of the runs as in run_scaps_thread.
         """
+        start = time.time()
+        proc_dir, script_dir, result_dir = SCAPSrunner.vm_dirs(config)
 
-        while True:
-            if not inputs.empty():
-                param = inputs.get()
-                if param['id'] == 'done':
-                    break
-                else:
-                    outq.put(SCAPSrunner.run_scaps_thread(config, param))
-        return
+        script_name = "pythonscript.script"
+        result_names = ["pythonresult_{}.txt".format(k) for k in range(len(batch))]
+        result_files = [os.path.join(result_dir, name) for name in result_names]
+
+        script = "\n".join(config['INPUT_PROC'](run_params['calc_param']) + "\nsave results.iv {}\n".format(name)
+                           for run_params, name in zip(batch, result_names))
+        with open(os.path.join(script_dir, script_name), "w") as fout: fout.write(script)
+
+        for result_file in result_files:
+            if os.path.exists(result_file):
+                os.remove(result_file)
+
+        timeout = config['TIMEOUT'] * len(batch) if config.get('TIMEOUT') else None
+        launched = time.time()
+        try:
+            returncode = SCAPSrunner.launch_scaps(config, proc_dir, script_name, timeout=timeout)
+            error = "SCAPS produced no result file in a batch (exit code {})".format(returncode)
+        except SCAPSRunError as e:
+            error = "{} in a batch of {}".format(e, len(batch))
+        exited = time.time()
+
+        outputs = []
+        for run_params, result_file in zip(batch, result_files):
+            output = {'id':run_params['id'], 'batched':True} if shared is None else \
+                     {'slot':run_params['slot'], 'batched':True}
+            parse_start = time.time()
+            if not os.path.exists(result_file):
+                output['error'] = "SCAPSRunError: {}".format(error)
+            else:
+                try:
+                    if shared is not None:
+                        shared.write(run_params['slot'], config['OUTPUT_PROC'], result_file)
+                    else:
+                        output['output'] = config['OUTPUT_PROC'](result_file)
+                except Exception as e:
+                    output['error'] = "{}: {}".format(type(e).__name__, e)
+            if config.get('TIMING'):
+                output['timing'] = {'script': (launched - start) / len(batch),
+                                    'scaps': (exited - launched) / len(batch),
+                                    'parse': time.time() - parse_start, 'batch': len(batch)}
+            outputs.append(output)
+        return outputs
+
+    @staticmethod
+    def run_process(config, inputs, outq, shared=None):
+        """
+        Runs a thread that pulls batches of inputs from the input queue and calls the SCAPS thread processor to get
+        their outputs. Blocks while the queue is empty and terminates when it receives a None sentinel. The config
+        dictionary is defined analogously to that detailed in run_scaps_thread, while the inputs queue gives a pointer
+        to this worker's queue of SCAPS inputs, each a list of run_params. Outputs are tagged with the worker's core
+        number so that the coordinator knows which worker to send the next input to. A run that raises is reported
+        back with an 'error' field instead of an 'output', and the worker carries on with its next input. With a
+        SharedResults in shared, outputs go into the shared slots and runs are reported by their 'slot' alone.
+
+        A worker whose coordinator (config 'PARENT_PID') has died, e.g. a QueueWorker killed with SIGKILL, exits after
+        its current batch instead of blocking on its queue forever; the queue is checked every 'LIVENESS_INTERVAL'
+        seconds.
+        """
 
+        while True:
+            try:
+                batch = inputs.get(timeout=config.get('LIVENESS_INTERVAL'))
+            except Empty:
+                if os.getppid() != config.get('PARENT_PID', os.getppid()):
+                    return
+                continue
+            if batch is None:
+                return
+            if len(batch) == 1:
+                try:
+                    outputs = [SCAPSrunner.run_scaps_thread(config, batch[0], shared)]
+                except Exception as e:
+                    key = 'id' if shared is None else 'slot'
+                    outputs = [{key:batch[0][key], 'error':"{}: {}".format(type(e).__name__, e)}]
+            else:
+                outputs = SCAPSrunner.run_scaps_batch(config, batch, shared)
+            for output in outputs:
+                output['core'] = config['CORE']
+                outq.put(output)
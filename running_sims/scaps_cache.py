@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Content-addressed cache of processed SCAPS outputs. A run is identified by the hash of the script generated for it
+together with the contents of the def, absorption and filter files synced into the VMs, so any run that would produce
+the same SCAPS invocation is served from the cache instead of launching WINE.
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Daniil Kitchaev"
+__date__ = "July 20, 2016"
+
+import os
+import hashlib
+import pickle
+import time
+
+class SCAPSCache(object):
+    """
+    On-disk cache with one pickle per entry, named by its key, and least-recently-used eviction once the total size
+    exceeds max_bytes. Eviction frees down to EVICT_TO * max_bytes so that it does not run on every insertion. Only the
+    coordinating process reads and writes the cache.
+    """
+    EVICT_TO = 0.9
+
+    def __init__(self, cache_dir, max_bytes=10 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        # key -> [size in bytes, last use], rebuilt from the files so a cache can be shared by successive sweeps
+        self.entries = {}
+        for name in os.listdir(cache_dir):
+            if name.endswith('.pickle'):
+                stat = os.stat(os.path.join(cache_dir, name))
+                self.entries[name[:-len('.pickle')]] = [stat.st_size, stat.st_mtime]
+        self.total_bytes = sum(size for size, _ in self.entries.values())
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    @staticmethod
+    def digest_files(dirs):
+        """
+        Hash of the names and contents of all files below the given directories, e.g. the SCAPS def, absorption and
+        filter directories. Directories that do not exist are skipped.
+        """
+        h = hashlib.sha256()
+        for top in dirs:
+            if not os.path.isdir(top):
+                continue
+            for root, subdirs, files in os.walk(top):
+                subdirs.sort()
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    h.update(os.path.relpath(path, top).encode('utf-8'))
+                    with open(path, 'rb') as f:
+                        h.update(hashlib.sha256(f.read()).digest())
+        return h.hexdigest()
+
+    @staticmethod
+    def key(script, *digests):
+        """
+        Cache key of a SCAPS script, combined with digests of everything else the run depends on
+        """
+        h = hashlib.sha256(script.encode('utf-8'))
+        for digest in digests:
+            h.update(digest.encode('utf-8'))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def get(self, key):
+        """
+        Returns (True, output) on a hit and (False, None) on a miss
+        """
+        if key in self.entries:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    output = pickle.load(f)
+            except (IOError, OSError, EOFError, pickle.UnpicklingError):
+                # Removed or truncated behind our back; treat it as a miss
+                self.total_bytes -= self.entries.pop(key)[0]
+            else:
+                now = time.time()
+                os.utime(self._path(key), (now, now))
+                self.entries[key][1] = now
+                self.hits += 1
+                return True, output
+        self.misses += 1
+        return False, None
+
+    def put(self, key, output):
+        tmp_path = self._path(key) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self._path(key))
+        # The last use is kept as the file's modification time, which a later SCAPSCache on the directory reads back
+        now = time.time()
+        os.utime(self._path(key), (now, now))
+        if key in self.entries:
+            self.total_bytes -= self.entries[key][0]
+        self.entries[key] = [os.path.getsize(self._path(key)), now]
+        self.total_bytes += self.entries[key][0]
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in EVICT_TO * max_bytes
+        """
+        for key, (size, _) in sorted(self.entries.items(), key=lambda entry: entry[1][1]):
+            if self.total_bytes <= self.EVICT_TO * self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            del self.entries[key]
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': len(self.entries),
+                'bytes': self.total_bytes}
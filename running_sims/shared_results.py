@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Shared-memory result arrays for SCAPSrunner. The coordinator allocates one slot of J and V arrays per run before the
+workers start; a worker parses a SCAPS result straight into the slot of its run (through the out argument of the output
+processor) and only reports the slot index and status back over its queue, so no output is pickled on the way.
+"""
+
+from __future__ import unicode_literals, division
+
+__author__ = "Daniil Kitchaev"
+__date__ = "July 20, 2016"
+
+import numpy as np
+from multiprocessing.sharedctypes import RawArray
+
+class SharedResults(object):
+    """
+    J and V arrays of shape (slot, point) in shared memory, with the number of points filled in for every slot. Workers
+    forked after the arrays are allocated write into the same memory that the coordinator reads.
+    """
+
+    def __init__(self, num_slots, max_points):
+        """
+        num_slots: number of runs the arrays have room for, one slot each
+
+        max_points: number of IV points a slot can hold; runs whose output has more points fail
+        """
+        self.num_slots = num_slots
+        self.max_points = max_points
+        self._raw = (RawArray('d', num_slots * max_points), RawArray('d', num_slots * max_points),
+                     RawArray('i', num_slots))
+        self._views()
+
+    def _views(self):
+        J, V, points = self._raw
+        self.J = np.frombuffer(J, dtype=np.float64).reshape(self.num_slots, self.max_points)
+        self.V = np.frombuffer(V, dtype=np.float64).reshape(self.num_slots, self.max_points)
+        self.points = np.frombuffer(points, dtype=np.intc)
+
+    def __getstate__(self):
+        # Only the shared buffers travel to a spawned worker; the views are rebuilt on its side
+        return {'num_slots': self.num_slots, 'max_points': self.max_points, '_raw': self._raw}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views()
+
+    def __len__(self):
+        return self.num_slots
+
+    def write(self, slot, output_processor, result_file):
+        """
+        Parse result_file into a slot with output_processor, which must take an out=(JArray, VArray) argument as
+        scaps_output_processor does. Returns the number of points written.
+        """
+        J, V = output_processor(result_file, out=(self.J[slot], self.V[slot]))
+        self.points[slot] = len(J)
+        return len(J)
+
+    def get(self, slot):
+        """
+        (JArray, VArray) of a slot, as views of the shared arrays
+        """
+        n = self.points[slot]
+        return (self.J[slot, :n], self.V[slot, :n])
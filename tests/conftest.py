@@ -0,0 +1,50 @@
+"""
+The analysis, running_sims and benchmarks directories are script directories rather than packages; the tests import
+their modules the same way the scripts import each other, by putting the directories on sys.path.
+"""
+
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+for directory in ('analysis', 'running_sims', 'benchmarks'):
+    path = os.path.abspath(os.path.join(ROOT, directory))
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import multiprocessing
+
+import pytest
+
+from bayes import LikelihoodEngine
+from results_store import ResultStore
+from run_forward_simulations import scaps_script_generator
+from synthetic import scaled_grid, write_synthetic_store, OBS_VOLTAGES, OBS_TEMPERATURES, OBS_ILLUMINATIONS
+
+@pytest.fixture(scope='session')
+def engine(tmp_path_factory):
+    """
+    LikelihoodEngine of a memory-mapped synthetic result store of about 400 grid points
+    """
+    path = str(tmp_path_factory.mktemp('store') / 'store')
+    write_synthetic_store(path, scaled_grid(400), OBS_TEMPERATURES, OBS_ILLUMINATIONS, OBS_VOLTAGES)
+    return LikelihoodEngine.from_store(ResultStore(path))
+
+@pytest.fixture(params=[method for method in ('fork', 'spawn') if method in multiprocessing.get_all_start_methods()])
+def start_method(request):
+    """
+    Every multiprocessing start method of this platform that the pools must work under
+    """
+    return request.param
+
+@pytest.fixture
+def fail_match(inputs):
+    """
+    fail_match(id): text that only the script of run id of the inputs contains, the fail_match of fake_scaps_cmd(). It
+    is the ZnOS electron affinity line, the fastest axis of the sweep.
+    """
+    def match(id):
+        line = [line for line in scaps_script_generator(inputs[id]).splitlines() if 'layer2.chi' in line][0]
+        assert sum(line in scaps_script_generator(inputs[other]).splitlines() for other in inputs) == 1
+        return line
+    return match
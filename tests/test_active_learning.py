@@ -0,0 +1,100 @@
+from __future__ import unicode_literals, division
+
+import numpy as np
+import pytest
+
+from active_learning import ActiveLearner, expected_entropy_reduction
+from bayes import LikelihoodEngine, ProportionalErrorModel, logsumexp
+from entropy import calc_entropies
+from synthetic import synthetic_currents, scaled_grid, OBS_VOLTAGES, OBS_TEMPERATURES, OBS_ILLUMINATIONS
+
+GRID = scaled_grid(3000)
+
+class ForwardModel(object):
+    """
+    Synthetic forward model over GRID that records the grid points of every call
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, ids):
+        self.calls.append(np.asarray(ids))
+        return synthetic_currents(GRID.coords(np.asarray(ids)), OBS_TEMPERATURES, OBS_ILLUMINATIONS, OBS_VOLTAGES)
+
+@pytest.fixture(scope='module')
+def observations():
+    # Noisy J(V) of a grid point near the middle of the grid, at every condition
+    J = ForwardModel()([len(GRID) // 2 + 7])[0]
+    T, ill, V = [a.ravel() for a in np.meshgrid(OBS_TEMPERATURES, OBS_ILLUMINATIONS, OBS_VOLTAGES, indexing='ij')]
+    J = J.ravel() + np.random.RandomState(0).normal(0.0, 0.2, J.size)
+    return J, V, T, ill, ProportionalErrorModel()(J)
+
+def learner(observations, forward_model=None):
+    return ActiveLearner(forward_model or ForwardModel(), observations, OBS_VOLTAGES, OBS_TEMPERATURES,
+                         OBS_ILLUMINATIONS, grid=GRID)
+
+def test_expected_entropy_reduction_is_the_js_divergence():
+    rs = np.random.RandomState(3)
+    log_w, log_lo = rs.normal(0.0, 2.0, 6), rs.normal(-1.0, 2.0, 6)
+    log_hi = log_lo + rs.exponential(2.0, 6)
+    log_lo[2] = -np.inf # a point that may have no weight at all
+    expected = []
+    for i in range(6):
+        p = []
+        for log_wi in (log_lo[i], log_hi[i]):
+            w = np.exp(log_w)
+            w[i] = np.exp(log_wi)
+            p.append(w / w.sum())
+        m = 0.5 * (p[0] + p[1])
+        expected.append(sum(0.5 * np.sum(np.where(q > 0, q * np.log(np.where(q > 0, q, 1.0) / m), 0.0)) for q in p))
+    np.testing.assert_allclose(expected_entropy_reduction(log_w, log_lo, log_hi), expected, rtol=1e-9, atol=1e-15)
+
+@pytest.mark.parametrize('strategy', ActiveLearner.STRATEGIES)
+def test_simulated_points_are_never_selected_again(observations, strategy):
+    forward_model = ForwardModel()
+    active = learner(observations, forward_model)
+    active.run(len(GRID) // 5, batch_size=100, strategy=strategy)
+    ids = np.concatenate(forward_model.calls)
+    assert len(np.unique(ids)) == len(ids)
+    assert active.simulated.sum() == len(ids)
+
+    # Asking for more points than are left gives exactly the ones not simulated yet
+    assert sorted(active.select(len(GRID), strategy)) == np.flatnonzero(~active.simulated).tolist()
+
+def test_budget_used_up_by_the_initial_design(observations):
+    forward_model = ForwardModel()
+    active = learner(observations, forward_model)
+    initial = active.initial_design()
+    history = active.run(len(initial) // 2, batch_size=100)
+    assert len(forward_model.calls) == 1 and len(history) == 1
+    assert history[0]['simulated'] == len(initial)
+
+    # A budget beyond the initial design is met exactly, the last batch cut short
+    active = learner(observations)
+    history = active.run(len(initial) + 150, batch_size=100)
+    assert [summary['simulated'] for summary in history] == [len(initial), len(initial) + 100, len(initial) + 150]
+
+@pytest.mark.parametrize('strategy', ActiveLearner.STRATEGIES)
+def test_entropy_estimate_beats_random_selection(observations, strategy):
+    engine = LikelihoodEngine(ForwardModel()(np.arange(len(GRID))), OBS_VOLTAGES, OBS_TEMPERATURES, OBS_ILLUMINATIONS)
+    log_lkl = engine.log_likelihood(*observations).sum(axis=0)
+    total, marginal = calc_entropies(np.exp(log_lkl - logsumexp(log_lkl))[None, :], GRID.shape)
+    budget = len(GRID) // 5
+
+    active = learner(observations).run(budget, batch_size=100, strategy=strategy)[-1]
+
+    random = learner(observations)
+    random.simulate(random.initial_design())
+    rs = np.random.RandomState(1)
+    while random.simulated.sum() < budget:
+        left = np.flatnonzero(~random.simulated)
+        random.simulate(rs.choice(left, min(100, budget - int(random.simulated.sum())), replace=False))
+    random = random.summary()
+
+    assert active['simulated'] == random['simulated'] == budget
+    assert active['map'] == np.argmax(log_lkl)
+    for summary in (active, random):
+        summary['error'] = max(abs(summary['entropy'] - total[0]),
+                               np.max(np.abs(np.array(summary['marginal_entropies']) - marginal[0])))
+    assert active['error'] < 0.1 * random['error']
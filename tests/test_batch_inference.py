@@ -0,0 +1,26 @@
+from __future__ import unicode_literals, division
+
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import grid_chunks
+from bayes import ProportionalErrorModel, logsumexp
+from batch_inference import ObservationBatch, batch_log_posterior
+from synthetic import synthetic_observations
+
+def test_batch_matches_engine_under_every_start_method(monkeypatch, engine, start_method):
+    monkeypatch.setattr(grid_chunks, 'Pool', multiprocessing.get_context(start_method).Pool)
+    devices = [tuple(np.concatenate(columns) for columns in
+                     zip(*synthetic_observations(engine, truth=point, num_V=3, noise=0.3, seed=point)))
+               for point in (50, 200, 350)]
+    J, V, T, ill = [np.concatenate([device[k] for device in devices]) for k in range(4)]
+    batch = ObservationBatch(['a', 'b', 'c'], T, ill, V, J, np.arange(4) * len(devices[0][0]))
+
+    log_post = batch_log_posterior(engine, batch, ncores=2, chunk_size=64)
+
+    for row, (J, V, T, ill, J_err) in zip(log_post, devices):
+        expected = engine.log_likelihood(J, V, T, ill, ProportionalErrorModel()(J)).sum(axis=0)
+        np.testing.assert_allclose(row, expected - logsumexp(expected), rtol=1e-9, atol=1e-9)
+    assert not grid_chunks.worker_state
@@ -0,0 +1,121 @@
+from __future__ import unicode_literals, division
+
+import os
+import sys
+import signal
+import threading
+import subprocess
+
+import pytest
+
+import displays
+from displays import DisplayPool, DisplayError, remove_stale_lock
+
+FAKE_XVFB = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'benchmarks', 'fake_xvfb.py')
+
+@pytest.fixture
+def x_tmp(tmp_path, monkeypatch):
+    monkeypatch.setattr(displays, 'X_TMP_DIR', str(tmp_path))
+    return str(tmp_path)
+
+def make_pool(x_tmp, count):
+    return DisplayPool(count, xvfb_cmd=[sys.executable, FAKE_XVFB, '--tmp', x_tmp])
+
+def lock_path(x_tmp, number):
+    return os.path.join(x_tmp, '.X{}-lock'.format(number))
+
+def write_lock(x_tmp, number, pid):
+    with open(lock_path(x_tmp, number), 'w') as f:
+        f.write("{:>10}\n".format(pid))
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+def lock_pid(x_tmp, display):
+    with open(lock_path(x_tmp, display.number), 'r') as f:
+        return int(f.read())
+
+def test_concurrent_pools_get_distinct_displays(x_tmp):
+    pools = [make_pool(x_tmp, 3) for _ in range(3)]
+    errors = []
+    def start(pool):
+        try:
+            pool.start()
+        except DisplayError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=start, args=(pool,)) for pool in pools]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert not errors
+        names = [pool.name(i) for pool in pools for i in range(len(pool))]
+        assert len(set(names)) == 9
+        for pool in pools:
+            for display in pool.displays:
+                assert display.alive()
+                assert lock_pid(x_tmp, display) == display.proc.pid
+    finally:
+        for pool in pools:
+            pool.stop()
+    assert not any(name.startswith('.X') and name.endswith('-lock') for name in os.listdir(x_tmp))
+
+def test_live_lock_is_left_alone_and_stale_lock_removed(x_tmp):
+    write_lock(x_tmp, 0, os.getpid())
+    write_lock(x_tmp, 1, dead_pid())
+    assert not remove_stale_lock(0)
+    assert os.path.exists(lock_path(x_tmp, 0))
+    assert remove_stale_lock(1)
+    assert not os.path.exists(lock_path(x_tmp, 1))
+
+    # A pool skips the display held by a live process
+    pool = make_pool(x_tmp, 1)
+    pool.start()
+    try:
+        assert pool.name(0) == ':1'
+    finally:
+        pool.stop()
+    assert os.path.exists(lock_path(x_tmp, 0))
+
+def test_dead_display_restarts_on_its_number(x_tmp):
+    pool = make_pool(x_tmp, 2)
+    pool.start()
+    try:
+        name = pool.name(1)
+        os.killpg(pool.displays[1].proc.pid, signal.SIGKILL) # leaves its lock and socket behind
+        pool.displays[1].proc.wait()
+        assert not pool.displays[1].alive()
+        assert pool.ensure() == [1]
+        assert pool.name(1) == name
+        assert pool.displays[1].alive()
+        assert lock_pid(x_tmp, pool.displays[1]) == pool.displays[1].proc.pid
+        assert pool.ensure() == []
+    finally:
+        pool.stop()
+
+def test_dead_display_taken_by_another_server_moves(x_tmp):
+    pool = make_pool(x_tmp, 1)
+    pool.start()
+    try:
+        number = pool.displays[0].number
+        os.killpg(pool.displays[0].proc.pid, signal.SIGKILL)
+        pool.displays[0].proc.wait()
+        # Another runner's server took the number in the meantime
+        write_lock(x_tmp, number, os.getpid())
+
+        assert pool.ensure() == [0]
+        assert pool.displays[0].number != number
+        assert pool.displays[0].alive()
+        with open(lock_path(x_tmp, number), 'r') as f:
+            assert int(f.read()) == os.getpid()
+    finally:
+        pool.stop()
+
+def test_failing_server_raises(x_tmp):
+    pool = DisplayPool(1, xvfb_cmd=[sys.executable, '-c', 'import sys; sys.exit(3)'])
+    with pytest.raises(DisplayError, match='exited with code 3'):
+        pool.start()
+    assert pool.displays == []
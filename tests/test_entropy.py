@@ -0,0 +1,55 @@
+from __future__ import unicode_literals, division
+
+import itertools
+
+import numpy as np
+
+from entropy import calc_entropy, calc_entropies, marginalize
+
+GRID_SHAPE = (3, 4, 2, 5)
+
+def loop_entropy(pmf):
+    # calc_entropy of the original entropy.py, one PMF at a time
+    return -1.0 * np.sum([pmf[k] * np.log(pmf[k]) for k in range(len(pmf)) if not pmf[k] == 0]) / np.log(len(pmf))
+
+def loop_marginals(frame, grid_shape):
+    """
+    1-D and pairwise marginals of one frame, tallied grid point by grid point as in the original entropy.py
+    """
+    ndim = len(grid_shape)
+    marginals = [np.zeros(n) for n in grid_shape]
+    pairwise = dict(((a, b), np.zeros((grid_shape[a], grid_shape[b])))
+                    for a in range(ndim) for b in range(a + 1, ndim))
+    for point, index in enumerate(itertools.product(*[range(n) for n in grid_shape])):
+        for a in range(ndim):
+            marginals[a][index[a]] += frame[point]
+        for (a, b), pmf in pairwise.items():
+            pmf[index[a], index[b]] += frame[point]
+    return marginals, pairwise
+
+def random_frames(num_frames, grid_shape, seed=0):
+    rs = np.random.RandomState(seed)
+    frames = rs.exponential(size=(num_frames, int(np.prod(grid_shape))))**4
+    frames[:, rs.rand(frames.shape[1]) < 0.2] = 0.0 # zero probabilities, as left by pruning
+    return frames / frames.sum(axis=1)[:, None]
+
+def test_marginals_match_per_frame_loop():
+    frames = random_frames(5, GRID_SHAPE)
+    marginals, pairwise = marginalize(frames, GRID_SHAPE)
+    for f, frame in enumerate(frames):
+        loop_1d, loop_2d = loop_marginals(frame, GRID_SHAPE)
+        for a in range(len(GRID_SHAPE)):
+            np.testing.assert_allclose(marginals[a][f], loop_1d[a], rtol=1e-12, atol=1e-15)
+        assert sorted(pairwise) == sorted(loop_2d)
+        for key in loop_2d:
+            np.testing.assert_allclose(pairwise[key][f], loop_2d[key], rtol=1e-12, atol=1e-15)
+
+def test_entropies_match_per_frame_loop():
+    frames = random_frames(5, GRID_SHAPE, seed=1)
+    total, marginal = calc_entropies(frames, GRID_SHAPE)
+    assert total.shape == (5,) and marginal.shape == (5, len(GRID_SHAPE))
+    for f, frame in enumerate(frames):
+        loop_1d, _ = loop_marginals(frame, GRID_SHAPE)
+        np.testing.assert_allclose(total[f], loop_entropy(frame), rtol=1e-12)
+        np.testing.assert_allclose(marginal[f], [loop_entropy(pmf) for pmf in loop_1d], rtol=1e-12)
+        np.testing.assert_allclose(calc_entropy(frame), loop_entropy(frame), rtol=1e-12)
@@ -0,0 +1,40 @@
+from __future__ import unicode_literals, division
+
+import numpy as np
+import pytest
+
+from bayes import ProportionalErrorModel, logsumexp
+from error_sweep import sweep_log_posterior
+from synthetic import synthetic_observations
+
+MODELS = [ProportionalErrorModel(floor, 19.5, scale) for floor in (0.25, 1.0) for scale in (0.1, 0.2)]
+
+@pytest.fixture(scope='module')
+def observations(engine):
+    J, V, T, ill, _ = [np.concatenate(columns) for columns in
+                       zip(*synthetic_observations(engine, truth=len(engine) // 3, num_V=5, noise=0.3))]
+    return J, V, T, ill
+
+def engine_log_posterior(engine, observations, model, log_prior):
+    J, V, T, ill = observations
+    log_post = engine.log_likelihood(J, V, T, ill, model(J)).sum(axis=0) + log_prior
+    return log_post - logsumexp(log_post)
+
+@pytest.mark.parametrize('model', MODELS[:2])
+def test_one_model_sweep_matches_engine_and_prior(engine, observations, model):
+    log_prior = np.random.RandomState(0).normal(0.0, 1.0, len(engine))
+    log_prior -= logsumexp(log_prior)
+    log_post = sweep_log_posterior(engine, observations, [model], log_prior=log_prior)
+    assert log_post.shape == (1, len(engine))
+    np.testing.assert_allclose(log_post[0], engine_log_posterior(engine, observations, model, log_prior), rtol=1e-9,
+                               atol=1e-9)
+
+def test_matrix_product_matches_loop_over_models(engine, observations):
+    # Small chunks, so that the grid is covered by several matrix products
+    log_post = sweep_log_posterior(engine, observations, MODELS, chunk_size=100)
+    assert log_post.shape == (len(MODELS), len(engine))
+    for model, row in zip(MODELS, log_post):
+        np.testing.assert_allclose(row, sweep_log_posterior(engine, observations, [model])[0], rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(row, engine_log_posterior(engine, observations, model, 0.0), rtol=1e-9, atol=1e-9)
+    # The models do lead to different posteriors
+    assert not np.allclose(log_post[0], log_post[-1])
@@ -0,0 +1,175 @@
+from __future__ import unicode_literals, division
+
+import os
+import time
+import signal
+import multiprocessing
+
+import pytest
+
+from run_scaps_parallel import SCAPSrunner
+from run_forward_simulations import scaps_script_generator, scaps_output_processor
+from parameter_grid import SWEEP_GRID
+from executors import SharedQueueExecutor, QueueWorker
+from fake_scaps import make_exec_dirs, fake_scaps_cmd
+
+NUM_RUNS = 12
+
+@pytest.fixture
+def inputs():
+    return SWEEP_GRID.inputs({'def': "SnS_base.scaps", "V_max": 0.5}, ids=range(NUM_RUNS))
+
+def serve(queue_dir, exec_dir, worker_id, scaps_cmd, options):
+    """
+    A worker node: a QueueWorker with a single-core runner of its own
+    """
+    make_exec_dirs(exec_dir, 1)
+    runner = SCAPSrunner(scaps_script_generator, scaps_output_processor, ncores=1, scaps_exec_dir=exec_dir, **options)
+    runner.SCAPS_CMD = scaps_cmd
+    runner.LIVENESS_INTERVAL = 0.5
+    worker = QueueWorker(queue_dir, runner, worker_id=worker_id, heartbeat_interval=0.5, use_cache=False)
+    worker.POLL_INTERVAL = 0.2
+    worker.serve()
+
+def start_workers(tmp_path, num_workers, scaps_cmd, first=0, **options):
+    workers = []
+    for i in range(first, first + num_workers):
+        exec_dir = str(tmp_path / 'exec{}'.format(i))
+        worker = multiprocessing.Process(target=serve, args=(str(tmp_path / 'queue'), exec_dir, 'worker{}'.format(i),
+                                                             scaps_cmd, options))
+        worker.start()
+        workers.append(worker)
+    return workers
+
+def make_executor(tmp_path, **options):
+    executor = SharedQueueExecutor(str(tmp_path / 'queue'), **options)
+    executor.POLL_INTERVAL = 0.2
+    return executor
+
+def stop(executor, workers):
+    executor.close()
+    for worker in workers:
+        worker.join(30)
+        if worker.is_alive():
+            worker.terminate()
+
+def children(pid):
+    # Live processes whose parent is pid, from /proc
+    pids = []
+    for name in os.listdir('/proc'):
+        if name.isdigit() and not is_gone(int(name)):
+            try:
+                with open('/proc/{}/stat'.format(name), 'r') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except (IOError, OSError):
+                continue
+            if int(fields[1]) == pid:
+                pids.append(int(name))
+    return pids
+
+def is_gone(pid):
+    # Exited, or a zombie nobody has reaped yet
+    try:
+        with open('/proc/{}/stat'.format(pid), 'r') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] == 'Z'
+    except (IOError, OSError):
+        return True
+
+def wait_for(condition, timeout=30):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.1)
+
+def test_workers_share_the_queue(tmp_path, inputs):
+    executor = make_executor(tmp_path, chunk_size=2)
+    workers = start_workers(tmp_path, 2, fake_scaps_cmd(latency=0.1))
+    try:
+        ids = [id for id, output in executor.iter_outputs(inputs)]
+        assert sorted(ids) == list(range(NUM_RUNS))
+        assert executor.failures == {}
+        assert sorted(executor.status()) == ['worker0', 'worker1']
+
+        # A later call reads outputs back from where the first one found them, without rereading the journals
+        offsets = dict(executor.offsets)
+        subset = dict((id, inputs[id]) for id in range(0, NUM_RUNS, 3))
+        assert sorted(id for id, output in executor.iter_outputs(subset)) == sorted(subset)
+        assert executor.offsets == offsets
+    finally:
+        stop(executor, workers)
+
+def test_failed_run_is_reported_with_its_chunk(tmp_path, inputs, fail_match):
+    executor = make_executor(tmp_path, chunk_size=2)
+    workers = start_workers(tmp_path, 1, fake_scaps_cmd(latency=0.2, crash=1.0, fail_match=fail_match(1)),
+                            max_retries=0)
+    try:
+        ids, reported_early = [], False
+        for id, output in executor.iter_outputs(inputs):
+            ids.append(id)
+            if 1 in executor.failures and executor.queue.listdir(executor.queue.pending):
+                reported_early = True
+        assert sorted(ids) == [id for id in range(NUM_RUNS) if id != 1]
+        assert list(executor.failures) == [1]
+        assert reported_early
+    finally:
+        stop(executor, workers)
+
+@pytest.mark.skipif(not os.path.isdir('/proc'), reason="needs /proc")
+def test_killed_worker_is_replaced_and_leaves_no_children(tmp_path, inputs):
+    executor = make_executor(tmp_path, chunk_size=3, heartbeat_timeout=2)
+    executor.submit(inputs)
+    workers = start_workers(tmp_path, 1, fake_scaps_cmd(latency=0.3))
+    try:
+        wait_for(lambda: executor.queue.listdir(executor.queue.claimed) and children(workers[0].pid))
+        orphans = children(workers[0].pid)
+        os.kill(workers[0].pid, signal.SIGKILL)
+        workers[0].join()
+        wait_for(lambda: all(is_gone(pid) for pid in orphans))
+
+        # The abandoned chunk is requeued and run by a new worker
+        workers += start_workers(tmp_path, 1, fake_scaps_cmd(latency=0.1), first=1)
+        ids = [id for id, output in executor.iter_outputs(inputs)]
+        assert sorted(ids) == list(range(NUM_RUNS))
+        assert executor.failures == {}
+    finally:
+        stop(executor, workers)
+
+def test_failure_of_a_later_batch_is_kept_for_its_call(tmp_path, inputs, fail_match):
+    # As run_forward_simulations.py -queue: every batch is submitted first, then the batches are collected in turn
+    first = dict((id, inputs[id]) for id in range(NUM_RUNS // 2))
+    second = dict((id, inputs[id]) for id in range(NUM_RUNS // 2, NUM_RUNS))
+    failing = NUM_RUNS // 2
+    executor = make_executor(tmp_path, chunk_size=2)
+    executor.submit(second) # queued first, so that its chunks are done while the first batch is collected
+    executor.submit(first)
+    workers = start_workers(tmp_path, 1, fake_scaps_cmd(latency=0.1, crash=1.0,
+                                                        fail_match=fail_match(failing)), max_retries=0)
+    try:
+        assert sorted(id for id, output in executor.iter_outputs(first)) == sorted(first)
+        assert executor.failures == {}
+        assert str(failing) in executor.given_up
+
+        ids = [id for id, output in executor.iter_outputs(second)]
+        assert sorted(ids) == [id for id in second if id != failing]
+        assert list(executor.failures) == [failing]
+        assert executor.failures[failing] != ["no output"]
+        assert "SCAPSRunError" in executor.failures[failing][0]
+    finally:
+        stop(executor, workers)
+
+class NoRunner(object):
+    # A runner that must never be started
+    given_up = set()
+    failures = {}
+
+    def iter_outputs(self, inputs, **options):
+        raise AssertionError("runner started without a claimed chunk")
+
+def test_worker_losing_the_claim_race_starts_no_runner(tmp_path, inputs):
+    executor = make_executor(tmp_path, chunk_size=2)
+    executor.submit(inputs)
+    executor.close()
+    worker = QueueWorker(str(tmp_path / 'queue'), NoRunner(), worker_id='late', use_cache=False)
+    worker.claim = lambda: None # every pending chunk is taken by another worker first
+    worker.serve()
+    assert executor.queue.listdir(executor.queue.pending)
@@ -0,0 +1,33 @@
+from __future__ import unicode_literals, division
+
+import numpy as np
+import pytest
+
+from bayes import FrameStore
+
+NUM_FRAMES = 100
+
+def test_appending_rewrites_the_index_a_logarithmic_number_of_times(tmp_path, monkeypatch):
+    writes = []
+    write_index = FrameStore._write_index
+    monkeypatch.setattr(FrameStore, '_write_index', lambda self: writes.append(len(self.labels)) or write_index(self))
+    path = str(tmp_path / 'probs')
+    frames = FrameStore.create(path, NUM_FRAMES, 16)
+    rows = np.random.RandomState(0).dirichlet(np.ones(16), NUM_FRAMES)
+
+    for j, row in enumerate(rows):
+        frames.append(row, '300_108', j)
+        # A reader sees a prefix of the frames appended, all of them labelled and on disk
+        partial = FrameStore.open(path)
+        assert len(partial) > j // 2
+        assert partial.labels == frames.labels[:len(partial)]
+        np.testing.assert_array_equal(partial.frames[:len(partial)], rows[:len(partial)])
+    assert writes == [0, 1, 2, 4, 8, 16, 32, 64]
+
+    frames.flush()
+    reopened = FrameStore.open(path)
+    assert reopened.labels == [('300_108', j) for j in range(NUM_FRAMES)]
+    np.testing.assert_array_equal(reopened[-1], rows[-1])
+
+    with pytest.raises(IndexError):
+        frames.append(rows[0], '300_108', NUM_FRAMES)
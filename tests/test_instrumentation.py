@@ -0,0 +1,54 @@
+from __future__ import unicode_literals, division
+
+import json
+
+from instrumentation import SweepMonitor
+
+def finish(monitor, count):
+    for id in range(count):
+        monitor.finished({'id': id, 'core': 0}, 0, 0)
+
+def test_remaining_and_eta_of_a_known_total():
+    monitor = SweepMonitor(report_interval=None)
+    monitor.started(10, 1)
+    finish(monitor, 4)
+    assert monitor.remaining() == 6
+    assert monitor.eta() is not None and monitor.eta() >= 0
+    assert " 4/10 runs" in monitor.status_line()
+
+def test_unknown_total_has_no_eta():
+    # A QueueWorker's monitor is never told how many runs there are
+    monitor = SweepMonitor(report_interval=None)
+    monitor.started(0, 2)
+    finish(monitor, 5)
+    assert monitor.remaining() is None
+    assert monitor.eta() is None
+    line = monitor.status_line()
+    assert " 5/? runs" in line and "ETA ?" in line
+    assert "-" not in line
+
+def test_exceeded_total_has_no_eta():
+    monitor = SweepMonitor(total=3, report_interval=None)
+    monitor.started(3, 1)
+    finish(monitor, 5)
+    assert monitor.remaining() is None
+    assert "ETA ?" in monitor.status_line()
+
+def test_summary_event_in_jsonl_only(tmp_path):
+    for name in ('events.jsonl', 'events.csv'):
+        path = str(tmp_path / name)
+        monitor = SweepMonitor(path, report_interval=None)
+        monitor.started(2, 1)
+        finish(monitor, 2)
+        monitor.print_summary()
+        monitor.close()
+        with open(path, 'r') as f:
+            lines = f.read().splitlines()
+        if name.endswith('.csv'):
+            # Header, start and two runs, and no row without an event
+            assert len(lines) == 4
+            assert all(',run,' in line or ',start,' in line for line in lines[1:])
+        else:
+            assert len(lines) == 4
+            assert json.loads(lines[-1])['event'] == 'summary'
+            assert json.loads(lines[-1])['summary']['runs'] == 2
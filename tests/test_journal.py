@@ -0,0 +1,74 @@
+from __future__ import unicode_literals, division
+
+import os
+
+import numpy as np
+import pytest
+
+from journal import ResultJournal, read_journal, HEADER
+from run_scaps_parallel import SCAPSrunner
+from run_forward_simulations import scaps_script_generator, scaps_output_processor
+from parameter_grid import SWEEP_GRID
+from instrumentation import SweepMonitor
+from fake_scaps import make_exec_dirs, fake_scaps_cmd
+
+NUM_RUNS = 6
+
+def output(id):
+    return (np.full(3, float(id)), np.linspace(0, 0.5, 3))
+
+def write_journal(path, ids):
+    journal = ResultJournal(path, fsync=False)
+    for id in ids:
+        journal.append(id, output(id))
+    journal.close()
+    return [end for _, _, end in read_journal(path)]
+
+# Cut inside the header of the last record, just after it, and inside its payload
+@pytest.mark.parametrize('cut', [3, HEADER.size, HEADER.size + 10])
+def test_truncated_last_record_is_dropped_and_overwritten(tmp_path, cut):
+    path = str(tmp_path / 'runs.journal')
+    ends = write_journal(path, range(3))
+    with open(path, 'r+b') as f:
+        f.truncate(ends[1] + cut)
+
+    assert [id for id, _, _ in read_journal(path)] == [0, 1]
+    journal = ResultJournal(path)
+    assert sorted(journal.ids) == [0, 1] and 2 not in journal
+    assert os.path.getsize(path) == ends[1]
+
+    # New records follow the last complete one, and the journal reads back whole
+    journal.append(2, output(2))
+    journal.append(3, output(3))
+    journal.close()
+    records = list(read_journal(path))
+    assert [id for id, _, _ in records] == [0, 1, 2, 3]
+    for id, (J, V), _ in records:
+        np.testing.assert_array_equal(J, output(id)[0])
+    assert records[-1][2] == os.path.getsize(path)
+
+    # Reading resumes from the end offset of any record
+    assert [id for id, _, _ in read_journal(path, records[1][2])] == [2, 3]
+
+def test_sweep_resumes_from_journal_with_torn_record(tmp_path):
+    inputs = SWEEP_GRID.inputs({'def': "SnS_base.scaps", "V_max": 0.5}, ids=range(NUM_RUNS))
+    path = str(tmp_path / 'runs.journal')
+    ends = write_journal(path, range(3))
+    with open(path, 'r+b') as f:
+        f.truncate(ends[1] + HEADER.size + 10) # the sweep was killed while writing run 2
+
+    exec_dir = str(tmp_path / 'exec')
+    make_exec_dirs(exec_dir, 1)
+    runner = SCAPSrunner(scaps_script_generator, scaps_output_processor, ncores=1, scaps_exec_dir=exec_dir)
+    runner.SCAPS_CMD = fake_scaps_cmd()
+    monitor = SweepMonitor(report_interval=None)
+    journal = ResultJournal(path)
+    outputs = dict(runner.iter_outputs(inputs, journal=journal, monitor=monitor))
+    journal.close()
+
+    assert sorted(outputs) == list(range(NUM_RUNS))
+    # Runs 0 and 1 are replayed from the journal, the torn run 2 is run again
+    assert monitor.counts['journaled'] == 2
+    assert monitor.counts['dispatched'] == NUM_RUNS - 2
+    np.testing.assert_array_equal(outputs[1][0], output(1)[0])
+    assert sorted(id for id, _, _ in read_journal(path)) == list(range(NUM_RUNS))
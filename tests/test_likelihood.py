@@ -0,0 +1,45 @@
+from __future__ import unicode_literals, division
+
+import numpy as np
+
+from bayes import LikelihoodEngine, likelihood
+
+voltages = np.linspace(0, 0.5, 26)
+temperatures = (280, 300)
+illuminations = (31, 108)
+
+def truncated_results(num_points=40, seed=0):
+    """
+    Nested results {i: {T: {ill: (JArray, VArray)}}} in which some runs stop short of 0.5 V and some are missing
+    """
+    rs = np.random.RandomState(seed)
+    results = {}
+    for i in range(num_points):
+        results[i] = {}
+        for T in temperatures:
+            results[i][T] = {}
+            for ill in illuminations:
+                J = -ill * 0.2 + 1e-3 * (T / 300.0) * np.expm1(voltages / (0.02 + 0.001 * i))
+                length = len(voltages) if rs.rand() < 0.6 else rs.randint(2, len(voltages))
+                results[i][T][ill] = () if rs.rand() < 0.05 else (J[:length], voltages[:length])
+    return results
+
+def test_reference_matches_engine_on_truncated_runs():
+    results = truncated_results()
+    engine = LikelihoodEngine.from_results(results)
+    truncated = sum(len(run[T][ill]) and len(run[T][ill][1]) < len(voltages)
+                    for run in results.values() for T in temperatures for ill in illuminations)
+    assert truncated > 0
+
+    zeros = 0
+    for T in temperatures:
+        for ill in illuminations:
+            # On simulated voltages, between them, and at the end of the sweep
+            for V in (0.0, 0.1, 0.13, 0.31, 0.495, 0.5):
+                I_meas = -ill * 0.2 + 0.5
+                I_error = 0.5
+                reference = likelihood(I_meas, V, T, ill, results, I_error)
+                vectorized = engine.likelihood(I_meas, V, T, ill, I_error)
+                np.testing.assert_allclose(vectorized, reference, rtol=1e-10, atol=1e-300)
+                zeros += np.sum(reference == 0)
+    assert zeros > 0
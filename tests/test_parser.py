@@ -0,0 +1,44 @@
+from __future__ import unicode_literals, division
+
+import os
+
+import numpy as np
+import pytest
+
+from run_forward_simulations import scaps_output_processor
+from synthetic import two_pass_output_processor
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def sample(name):
+    return os.path.join(DATA_DIR, name)
+
+@pytest.mark.parametrize('name, points', [('iv_single.txt', 26), ('iv_multi.txt', 26 + 16), ('iv_nan_rows.txt', 26),
+                                          ('iv_no_table.txt', 0)])
+def test_single_pass_parser_matches_two_pass(name, points):
+    J_ref, V_ref = two_pass_output_processor(sample(name))
+    J, V = scaps_output_processor(sample(name))
+    assert len(J) == len(V) == points
+    np.testing.assert_array_equal(J, J_ref)
+    np.testing.assert_array_equal(V, V_ref)
+
+    # Parsed into a larger buffer, as for SharedResults
+    J_buf, V_buf = scaps_output_processor(sample(name), out=np.zeros((2, points + 5)))
+    np.testing.assert_array_equal(J_buf, J_ref)
+    np.testing.assert_array_equal(V_buf, V_ref)
+
+def test_multi_block_file_keeps_blocks_in_order():
+    J, V = scaps_output_processor(sample('iv_multi.txt'))
+    np.testing.assert_array_equal(V[:26], np.round(np.linspace(0, 0.5, 26), 6))
+    np.testing.assert_array_equal(V[26:], np.round(np.linspace(0, 0.3, 16), 6))
+
+def test_nan_rows_are_kept():
+    J, V = scaps_output_processor(sample('iv_nan_rows.txt'))
+    assert np.isnan(J[20]) and np.isnan(J[21])
+    assert np.all(np.isfinite(np.delete(J, [20, 21])))
+
+def test_unparseable_error_row_raises_like_two_pass():
+    with pytest.raises(ValueError):
+        two_pass_output_processor(sample('iv_error_row.txt'))
+    with pytest.raises(ValueError):
+        scaps_output_processor(sample('iv_error_row.txt'))
@@ -0,0 +1,95 @@
+from __future__ import unicode_literals, division
+
+import os
+import pickle
+import numpy as np
+
+import process_pickles
+from process_pickles import merge, missing_report
+from parameter_grid import MATERIAL_GRID
+from synthetic import write_synthetic_shards
+
+def merge_paths(tmp_dir):
+    return dict(store_path=os.path.join(tmp_dir, 'store'), manifest_path=os.path.join(tmp_dir, 'manifest.json'),
+                missing_path=os.path.join(tmp_dir, 'missing.pickle'))
+
+def expected_report(sim_ids):
+    """
+    Report of a store holding exactly the runs sim_ids, built run by run
+    """
+    conds = [[T, ill] for T in process_pickles.temperatures.tolist() for ill in process_pickles.illuminations.tolist()]
+    report = dict((i, [list(cond) for cond in conds]) for i in range(len(MATERIAL_GRID)))
+    points, T_index, ill_index = process_pickles.store_index(np.asarray(sim_ids))
+    for i, t, l in zip(points.tolist(), T_index.tolist(), ill_index.tolist()):
+        report[i].remove(conds[t * len(process_pickles.illuminations) + l])
+        if not report[i]:
+            del report[i]
+    return report
+
+def read_report(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def test_missing_report_written_once_per_merge(tmp_path, monkeypatch):
+    tmp_dir = str(tmp_path)
+    paths = merge_paths(tmp_dir)
+    write_synthetic_shards(os.path.join(tmp_dir, 'shards'), np.arange(0, 60), 3, process_pickles.voltages)
+
+    dumps = []
+    real_dump = pickle.dump
+    monkeypatch.setattr(process_pickles.pickle, 'dump', lambda obj, f, *a: dumps.append(1) or real_dump(obj, f, *a))
+    store = merge(os.path.join(tmp_dir, 'shards'), **paths)
+    assert len(dumps) == 1
+
+    report = read_report(paths['missing_path'])
+    assert report == missing_report(store)
+    assert report == expected_report(np.arange(0, 60))
+
+def test_missing_report_rebuilt_from_store(tmp_path):
+    tmp_dir = str(tmp_path)
+    paths = merge_paths(tmp_dir)
+    shards = os.path.join(tmp_dir, 'shards')
+    write_synthetic_shards(shards, np.arange(0, 60), 2, process_pickles.voltages)
+    merge(shards, **paths)
+
+    # A store without its report, and a new shard to merge
+    os.remove(paths['missing_path'])
+    write_synthetic_shards(shards, np.arange(60, 66), 1, process_pickles.voltages, node=1)
+    store = merge(shards, **paths)
+
+    report = read_report(paths['missing_path'])
+    assert report == missing_report(store)
+    assert report == expected_report(np.arange(0, 66))
+
+def test_second_merge_skips_merged_shards_and_updates_the_report(tmp_path, monkeypatch):
+    tmp_dir = str(tmp_path)
+    paths = merge_paths(tmp_dir)
+    shards = os.path.join(tmp_dir, 'shards')
+    write_synthetic_shards(shards, np.arange(0, 60), 2, process_pickles.voltages)
+    merge(shards, **paths)
+
+    ingested, full_reports = [], []
+    real_ingest, real_report = process_pickles.ingest_shard, process_pickles.missing_report
+    monkeypatch.setattr(process_pickles, 'ingest_shard',
+                        lambda store, path, *a: ingested.append(os.path.basename(path)) or real_ingest(store, path, *a))
+    monkeypatch.setattr(process_pickles, 'missing_report',
+                        lambda store, points=None: full_reports.append(points is None) or real_report(store, points))
+
+    # Nothing new: no shard is read again and the report is left alone
+    merge(shards, **paths)
+    assert ingested == []
+    assert read_report(paths['missing_path']) == expected_report(np.arange(0, 60))
+
+    # A new shard is merged on its own, and only the report entries of its grid points are rebuilt
+    new_shard, = write_synthetic_shards(shards, np.arange(60, 66), 1, process_pickles.voltages, node=1)
+    store = merge(shards, **paths)
+    assert ingested == [os.path.basename(new_shard)]
+    assert not any(full_reports)
+    assert read_report(paths['missing_path']) == expected_report(np.arange(0, 66))
+
+    with open(new_shard, 'rb') as f:
+        runs = pickle.load(f)
+    for sim_id, (JArray, VArray) in runs.items():
+        i, t, l = process_pickles.store_index(sim_id)
+        assert not store.missing[i, t, l]
+        np.testing.assert_allclose(store.currents[i, t, l], JArray)
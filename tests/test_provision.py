@@ -0,0 +1,111 @@
+from __future__ import unicode_literals, division
+
+import os
+import errno
+
+import pytest
+
+import run_scaps_parallel
+from run_scaps_parallel import SCAPSrunner
+from run_forward_simulations import scaps_script_generator, scaps_output_processor
+
+SCAPS_DIR = os.path.join('drive_c', 'Program Files', 'Scaps3302')
+SHARED = [os.path.join(SCAPS_DIR, 'scaps3303.exe'), os.path.join('drive_c', 'windows', 'system32', 'kernel32.dll')]
+WRITABLE = ['system.reg', os.path.join(SCAPS_DIR, 'def', 'SnS_base.scaps')]
+
+def write(path, text):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(text)
+
+def read(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+@pytest.fixture
+def runner(tmp_path):
+    """
+    Runner over a small reference VM, with two execution VMs and def, absorption and filter directories of its own
+    """
+    install_dir = str(tmp_path / 'reference')
+    for rel in SHARED + WRITABLE:
+        write(os.path.join(install_dir, rel), "reference " + rel)
+    os.makedirs(os.path.join(install_dir, 'dosdevices'))
+    os.symlink('../drive_c', os.path.join(install_dir, 'dosdevices', 'c:'))
+    params = {}
+    for name, sub in (('def', 'def'), ('abs', 'absorption'), ('ftr', 'filter')):
+        params[name] = str(tmp_path / 'params' / sub)
+        write(os.path.join(params[name], sub + '.txt'), "parameters " + sub)
+    return SCAPSrunner(scaps_script_generator, scaps_output_processor, ncores=2, scaps_install_dir=install_dir,
+                       scaps_exec_dir=str(tmp_path / 'exec'), scaps_param_def_dir=params['def'],
+                       scaps_param_abs_dir=params['abs'], scaps_param_ftr_dir=params['ftr'])
+
+def shared_with_reference(runner, core, rel):
+    return os.path.samefile(os.path.join(runner.scaps_install_dir, rel), os.path.join(runner.proc_dir(core), rel))
+
+def check_vms(runner, shared):
+    for core in range(2):
+        for rel in SHARED + WRITABLE:
+            assert read(os.path.join(runner.proc_dir(core), rel)) == "reference " + rel
+        for rel in SHARED:
+            assert shared_with_reference(runner, core, rel) == shared
+        for rel in WRITABLE:
+            assert not shared_with_reference(runner, core, rel)
+        link = os.path.join(runner.proc_dir(core), 'dosdevices', 'c:')
+        assert os.path.islink(link) and os.readlink(link) == '../drive_c'
+
+def test_hardlink_shares_all_but_writable_files(runner):
+    runner.provision('hardlink')
+    check_vms(runner, shared=True)
+
+def test_hardlink_falls_back_to_copy_across_filesystems(runner, monkeypatch):
+    def link(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    monkeypatch.setattr(run_scaps_parallel.os, 'link', link)
+    runner.provision('hardlink')
+    check_vms(runner, shared=False)
+
+def test_reflink_falls_back_to_copy(runner, monkeypatch):
+    def cp(cmd, **options):
+        # cp on a filesystem without copy-on-write: fails, leaving part of the VM behind
+        write(os.path.join(cmd[-1], 'partial'), "")
+        return 1
+    monkeypatch.setattr(run_scaps_parallel.subprocess, 'call', cp)
+    runner.provision('reflink')
+    check_vms(runner, shared=False)
+    assert not os.path.exists(os.path.join(runner.proc_dir(0), 'partial'))
+
+def test_reflink_gives_private_files_on_any_filesystem(runner):
+    # Cloned where the filesystem supports it, copied where it does not
+    runner.provision('reflink')
+    check_vms(runner, shared=False)
+
+def test_copy_and_repair(runner):
+    runner.provision('copy')
+    check_vms(runner, shared=False)
+
+    # Provisioning again restores a missing file and leaves the others alone
+    os.remove(os.path.join(runner.proc_dir(1), SHARED[0]))
+    write(os.path.join(runner.proc_dir(1), WRITABLE[0]), "changed by WINE")
+    runner.provision('hardlink')
+    assert shared_with_reference(runner, 1, SHARED[0])
+    assert read(os.path.join(runner.proc_dir(1), WRITABLE[0])) == "changed by WINE"
+
+def test_sync_replaces_files_without_writing_through_links(runner):
+    runner.provision('hardlink')
+    assert runner.sync_parameters() == 2 * 3
+    assert runner.sync_parameters() == 0
+
+    # A def file that an older provisioning hardlinked to the reference VM
+    rel = os.path.join(SCAPS_DIR, 'def', 'def.txt')
+    reference_def = os.path.join(runner.scaps_install_dir, rel)
+    write(reference_def, "parameters def")
+    os.remove(os.path.join(runner.proc_dir(0), rel))
+    os.link(reference_def, os.path.join(runner.proc_dir(0), rel))
+
+    write(os.path.join(runner.scaps_param_def_dir, 'def.txt'), "new parameters")
+    assert runner.sync_parameters() == 2
+    for core in range(2):
+        assert read(os.path.join(runner.proc_dir(core), rel)) == "new parameters"
+    assert read(reference_def) == "parameters def"
@@ -0,0 +1,32 @@
+from __future__ import unicode_literals, division
+
+import numpy as np
+import pytest
+
+from bayes import PosteriorUpdater
+from synthetic import synthetic_observations
+
+def run(engine, observations, prune):
+    """
+    Sequential update loop of bayes.py. Returns (posterior, updater).
+    """
+    posterior = PosteriorUpdater(len(engine), prune=prune)
+    for J, V, T, ill, J_err in observations:
+        points = posterior.active
+        log_lkls = engine.log_likelihood(J, V, T, ill, J_err, points=points)
+        bounds = engine.log_likelihood_bound(J_err)
+        for j in range(len(J)):
+            prob = posterior.update(log_lkls[j], bounds[j], points)
+    return prob, posterior
+
+@pytest.mark.parametrize('prune', [2.0, 5.0, 10.0])
+def test_pruned_posterior_within_discarded_mass_bound(engine, prune):
+    observations = synthetic_observations(engine, truth=len(engine) // 3, num_V=6, noise=0.3)
+    exact, _ = run(engine, observations, None)
+    pruned, posterior = run(engine, observations, prune)
+
+    assert len(posterior.active) < len(engine)
+    assert np.all(pruned[np.setdiff1d(np.arange(len(engine)), posterior.active)] == 0)
+    distance = 0.5 * np.abs(pruned - exact).sum()
+    assert distance <= posterior.discarded_bound + 1e-12
+    assert pruned.argmax() == exact.argmax()
@@ -0,0 +1,34 @@
+from __future__ import unicode_literals, division
+
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from results_store import ResultStore, voltage_index
+
+voltages = np.linspace(0, 0.5, 26)
+
+@pytest.mark.parametrize('shift', [1e-12, -1e-12, 5e-10, -5e-10])
+def test_voltages_rounded_either_way_are_matched_to_the_nearest(shift):
+    np.testing.assert_array_equal(voltage_index(voltages, voltages + shift), np.arange(len(voltages)))
+    # A run that stops short of the end of the axis
+    np.testing.assert_array_equal(voltage_index(voltages, voltages[:12] + shift), np.arange(12))
+
+def test_voltages_written_as_text_are_matched():
+    # SCAPS writes the IV table with %.6E
+    written = np.array([float("{:.6E}".format(v)) for v in voltages])
+    np.testing.assert_array_equal(voltage_index(voltages, written), np.arange(len(voltages)))
+
+@pytest.mark.parametrize('VArray', [voltages[:3] + 0.01, [0.6], [-0.02]])
+def test_voltages_off_the_axis_are_rejected(VArray):
+    with pytest.raises(ValueError):
+        voltage_index(voltages, VArray)
+
+def test_set_run_with_perturbed_voltages(tmp_path):
+    store = ResultStore.create(str(tmp_path / 'store'), OrderedDict([('x', np.arange(2))]), [300], [31], voltages)
+    J = np.linspace(-10, 5, 20)
+    store.set_run(1, 0, 0, J, voltages[:20] + np.where(np.arange(20) % 2, 1e-12, -1e-12))
+    np.testing.assert_array_equal(store.currents[1, 0, 0, :20], J)
+    assert np.all(np.isnan(store.currents[1, 0, 0, 20:]))
+    assert not store.missing[1, 0, 0] and store.missing[0, 0, 0]
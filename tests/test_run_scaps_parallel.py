@@ -0,0 +1,133 @@
+from __future__ import unicode_literals, division
+
+import os
+import signal
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from run_scaps_parallel import SCAPSrunner
+from shared_results import SharedResults
+from run_forward_simulations import scaps_script_generator, scaps_output_processor
+from parameter_grid import SWEEP_GRID
+from fake_scaps import make_exec_dirs, fake_scaps_cmd, invocations
+
+NUM_RUNS = 8
+
+@pytest.fixture
+def inputs():
+    return SWEEP_GRID.inputs({'def': "SnS_base.scaps", "V_max": 0.5}, ids=range(NUM_RUNS))
+
+def make_runner(tmp_path, ncores=2, **options):
+    exec_dir = str(tmp_path / 'exec')
+    make_exec_dirs(exec_dir, ncores)
+    return SCAPSrunner(scaps_script_generator, scaps_output_processor, ncores=ncores, scaps_exec_dir=exec_dir,
+                       **options)
+
+def script_of(inputs, id):
+    return scaps_script_generator(inputs[id]) + "\nsave results.iv pythonresult.txt\n"
+
+def collect(runner, inputs, **options):
+    return [id for id, output in runner.iter_outputs(inputs, **options)]
+
+def swept(inputs):
+    # Every run sweeps to a voltage of its own, so that its IV curve has a length of its own
+    return dict((id, dict(inputs[id], V_max=0.2 + 0.04 * id)) for id in inputs)
+
+def batch_config(tmp_path, **options):
+    exec_dir = str(tmp_path / 'exec')
+    make_exec_dirs(exec_dir, 1)
+    config = {'SCAPS_ROOT':SCAPSrunner.SCAPS_ROOT, 'SCAPS_CMD':fake_scaps_cmd(), 'SCAPS_EXEC_DIR':exec_dir,
+              'INPUT_PROC':scaps_script_generator, 'OUTPUT_PROC':scaps_output_processor, 'CORE':0}
+    config.update(options)
+    return config
+
+def test_hung_run_is_killed_and_retried(tmp_path, inputs, fail_match):
+    state = str(tmp_path / 'state')
+    os.makedirs(state)
+    runner = make_runner(tmp_path, timeout=3.0)
+    runner.SCAPS_CMD = fake_scaps_cmd(hang=1.0, fail_match=fail_match(3), fail_times=1, state=state)
+
+    ids = collect(runner, inputs)
+
+    assert sorted(ids) == list(range(NUM_RUNS))
+    assert invocations(state, script_of(inputs, 3)) == 2
+    assert runner.failures == {}
+
+def test_crashing_run_is_retried_up_to_the_limit(tmp_path, inputs, fail_match):
+    state = str(tmp_path / 'state')
+    os.makedirs(state)
+    runner = make_runner(tmp_path, max_retries=2)
+    runner.SCAPS_CMD = fake_scaps_cmd(crash=1.0, fail_match=fail_match(5), state=state)
+
+    ids = collect(runner, inputs)
+
+    assert sorted(ids) == [id for id in range(NUM_RUNS) if id != 5]
+    assert invocations(state, script_of(inputs, 5)) == 3
+    assert list(runner.failures) == [5]
+    assert len(runner.failures[5]) == 3
+
+def test_dead_worker_is_respawned(tmp_path, inputs, capsys):
+    runner = make_runner(tmp_path)
+    runner.LIVENESS_INTERVAL = 0.5
+    runner.SCAPS_CMD = fake_scaps_cmd(latency=0.3)
+
+    ids, killed = [], False
+    for id, output in runner.iter_outputs(inputs):
+        ids.append(id)
+        if not killed:
+            # Both workers still hold queued runs after the first output
+            os.kill(multiprocessing.active_children()[0].pid, signal.SIGKILL)
+            killed = True
+
+    assert sorted(ids) == list(range(NUM_RUNS))
+    assert "died" in capsys.readouterr().out
+
+def test_packed_batch_is_split_back_per_run(tmp_path, inputs):
+    inputs = swept(inputs)
+    config = batch_config(tmp_path)
+    batch = [{'id':id, 'calc_param':inputs[id]} for id in (4, 1, 6)]
+
+    outputs = SCAPSrunner.run_scaps_batch(config, batch)
+
+    assert [output['id'] for output in outputs] == [4, 1, 6]
+    for run, output in zip(batch, outputs):
+        assert output['batched'] and 'error' not in output
+        J, V = SCAPSrunner.run_scaps_thread(config, run)['output']
+        assert np.isclose(output['output'][1][-1], run['calc_param']['V_max'])
+        assert np.array_equal(output['output'][0], J) and np.array_equal(output['output'][1], V)
+
+def test_failures_in_a_batch_stay_with_their_runs(tmp_path, inputs):
+    def output_processor(return_path, out=None):
+        if return_path.endswith('pythonresult_1.txt'):
+            raise ValueError("unreadable result")
+        return scaps_output_processor(return_path, out)
+
+    batch = [{'id':id, 'calc_param':inputs[id]} for id in range(3)]
+    outputs = SCAPSrunner.run_scaps_batch(batch_config(tmp_path, OUTPUT_PROC=output_processor), batch)
+    assert [output['id'] for output in outputs] == [0, 1, 2]
+    assert 'output' in outputs[0] and 'output' in outputs[2]
+    assert outputs[1]['error'] == "ValueError: unreadable result" and 'output' not in outputs[1]
+
+    # Without any result, every run of the batch fails with the error of the invocation
+    outputs = SCAPSrunner.run_scaps_batch(batch_config(tmp_path, SCAPS_CMD=fake_scaps_cmd(crash=1.0)), batch)
+    assert [output['id'] for output in outputs] == [0, 1, 2]
+    assert all(output['error'].startswith("SCAPSRunError") and 'output' not in output for output in outputs)
+
+@pytest.mark.parametrize('use_shared', [False, True])
+def test_batched_outputs_match_single_runs(tmp_path, inputs, use_shared):
+    inputs = swept(inputs)
+    runner = make_runner(tmp_path)
+    runner.SCAPS_CMD = fake_scaps_cmd()
+    single = dict(runner.iter_outputs(inputs))
+
+    shared = SharedResults(NUM_RUNS, 64) if use_shared else None
+    batched = dict((id, (np.copy(J), np.copy(V))) for id, (J, V) in runner.iter_outputs(inputs, batch_size=3,
+                                                                                       shared=shared))
+
+    assert sorted(batched) == list(range(NUM_RUNS))
+    assert runner.failures == {}
+    assert len(set(len(V) for J, V in batched.values())) == NUM_RUNS
+    for id in inputs:
+        assert np.array_equal(batched[id][0], single[id][0]) and np.array_equal(batched[id][1], single[id][1])
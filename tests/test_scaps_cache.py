@@ -0,0 +1,109 @@
+from __future__ import unicode_literals, division
+
+import os
+
+import pytest
+
+import scaps_cache
+from scaps_cache import SCAPSCache
+from run_scaps_parallel import SCAPSrunner
+from run_forward_simulations import scaps_script_generator, scaps_output_processor
+from parameter_grid import SWEEP_GRID
+from fake_scaps import make_exec_dirs, fake_scaps_cmd
+
+NUM_RUNS = 4
+
+@pytest.fixture
+def inputs():
+    return SWEEP_GRID.inputs({'def': "SnS_base.scaps", "V_max": 0.5}, ids=range(NUM_RUNS))
+
+@pytest.fixture
+def param_dirs(tmp_path):
+    dirs = {}
+    for name in ('def', 'abs', 'ftr'):
+        path = tmp_path / name
+        path.mkdir()
+        (path / '{}_file.txt'.format(name)).write_text("reference {}\n".format(name))
+        dirs[name] = str(path)
+    return dirs
+
+def make_runner(tmp_path, param_dirs, cache):
+    exec_dir = str(tmp_path / 'exec')
+    make_exec_dirs(exec_dir, 1)
+    runner = SCAPSrunner(scaps_script_generator, scaps_output_processor, ncores=1, scaps_exec_dir=exec_dir,
+                         scaps_param_def_dir=param_dirs['def'], scaps_param_abs_dir=param_dirs['abs'],
+                         scaps_param_ftr_dir=param_dirs['ftr'], cache=cache)
+    runner.SCAPS_CMD = fake_scaps_cmd()
+    return runner
+
+def run(runner, inputs):
+    before = dict(runner.cache.stats())
+    outputs = runner.run_inputs(inputs, print_progress=False)
+    assert sorted(outputs) == list(range(NUM_RUNS))
+    stats = runner.cache.stats()
+    return stats['hits'] - before['hits'], stats['misses'] - before['misses']
+
+@pytest.mark.parametrize('changed', ['def', 'abs', 'ftr'])
+def test_key_changes_with_the_parameter_files(tmp_path, param_dirs, inputs, changed):
+    cache = SCAPSCache(str(tmp_path / 'cache'))
+    runner = make_runner(tmp_path, param_dirs, cache)
+    digest = runner.param_digest()
+    assert run(runner, inputs) == (0, NUM_RUNS)
+    assert run(runner, inputs) == (NUM_RUNS, 0)
+    assert runner.param_digest() == digest
+
+    # Editing a file invalidates every run
+    with open(os.path.join(param_dirs[changed], '{}_file.txt'.format(changed)), 'a') as f:
+        f.write("edited\n")
+    assert runner.param_digest() != digest
+    assert run(runner, inputs) == (0, NUM_RUNS)
+
+    # So does adding one
+    digest = runner.param_digest()
+    with open(os.path.join(param_dirs[changed], 'new.txt'), 'w') as f:
+        f.write("new\n")
+    assert runner.param_digest() != digest
+
+def test_key_depends_on_file_names_and_contents(tmp_path):
+    root = tmp_path / 'dir'
+    root.mkdir()
+    (root / 'a.txt').write_text("x")
+    digest = SCAPSCache.digest_files([str(root)])
+    assert SCAPSCache.digest_files([str(root), str(tmp_path / 'missing')]) == digest
+    os.rename(str(root / 'a.txt'), str(root / 'b.txt'))
+    assert SCAPSCache.digest_files([str(root)]) != digest
+    assert SCAPSCache.key("script", digest) != SCAPSCache.key("script", SCAPSCache.digest_files([str(root)]))
+    assert SCAPSCache.key("script", digest) != SCAPSCache.key("other script", digest)
+
+class Clock(object):
+    # Distinct, increasing times for every use of the cache
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(scaps_cache.time, 'time', Clock())
+    cache_dir = str(tmp_path / 'cache')
+    payload = b'x' * 1000
+    cache = SCAPSCache(cache_dir, max_bytes=10**6)
+    for key in 'abc':
+        cache.put(key, payload)
+    entry_size = cache.total_bytes // 3
+    cache.max_bytes = int(3.5 * entry_size)
+    assert cache.get('a') == (True, payload) # now b is the least recently used
+
+    cache.put('d', payload)
+    assert sorted(cache.entries) == ['a', 'c', 'd']
+    assert not os.path.exists(os.path.join(cache_dir, 'b.pickle'))
+    assert cache.total_bytes == 3 * entry_size
+    assert cache.stats()['evictions'] == 1
+    assert cache.get('b') == (False, None)
+
+    # Recency survives reopening the cache, through the files' modification times
+    reopened = SCAPSCache(cache_dir, max_bytes=int(2.5 * entry_size))
+    assert reopened.total_bytes == 3 * entry_size
+    reopened.put('e', payload)
+    assert sorted(reopened.entries) == ['d', 'e']
@@ -0,0 +1,58 @@
+from __future__ import unicode_literals, division
+
+import pickle
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import grid_chunks
+from bayes import LikelihoodEngine, PosteriorUpdater, FrameStore
+from sharded_posterior import sharded_posterior
+from grid_chunks import chunk_bounds
+from synthetic import synthetic_observations
+
+@pytest.fixture(scope='module')
+def observations(engine):
+    return tuple(np.concatenate(columns) for columns in
+                 zip(*synthetic_observations(engine, truth=len(engine) // 2, num_V=4, noise=0.3)))
+
+def sequential_frames(engine, observations):
+    """
+    Frames of the in-memory PosteriorUpdater loop of bayes.py
+    """
+    J, V, T, ill, J_err = observations
+    posterior = PosteriorUpdater(len(engine))
+    log_lkls = engine.log_likelihood(J, V, T, ill, J_err)
+    return np.array([posterior.update(log_lkl) for log_lkl in log_lkls])
+
+def test_memory_mapped_engine_is_pickled_by_reference(engine):
+    data = pickle.dumps(engine, protocol=pickle.HIGHEST_PROTOCOL)
+    assert len(data) < engine.currents.nbytes
+    copy = pickle.loads(data)
+    assert isinstance(copy.currents, np.memmap)
+    np.testing.assert_array_equal(copy.currents, engine.currents)
+
+    # A slice is not the whole file, so it is pickled by value
+    part = LikelihoodEngine(engine.currents[10:20], engine.voltages, engine.temperatures, engine.illuminations)
+    np.testing.assert_array_equal(pickle.loads(pickle.dumps(part)).currents, engine.currents[10:20])
+
+@pytest.mark.parametrize('ncores', [1, 2])
+def test_sharded_frames_match_sequential_posterior(tmp_path, monkeypatch, engine, observations, ncores, start_method):
+    monkeypatch.setattr(grid_chunks, 'Pool', multiprocessing.get_context(start_method).Pool)
+    frames = FrameStore.create(str(tmp_path / 'probs'), len(observations[0]), len(engine))
+
+    log_norm = sharded_posterior(engine, observations, frames, ncores=ncores, chunk_size=64)
+
+    expected = sequential_frames(engine, observations)
+    np.testing.assert_allclose(frames.frames, expected, rtol=1e-6, atol=1e-12)
+    assert np.all(np.isfinite(log_norm))
+    assert not grid_chunks.worker_state
+
+def test_default_chunks_cover_the_grid_once_per_core():
+    bounds = chunk_bounds(1000, 4, ncores=3)
+    assert len(bounds) == 3
+    assert bounds[0][0] == 0 and bounds[-1][1] == 1000
+    assert all(stop == start for (_, stop), (start, _) in zip(bounds[:-1], bounds[1:]))
+    # Many observations cap the chunks at about 2M likelihood evaluations
+    assert len(chunk_bounds(1000, 2**14, ncores=1)) == 4
@@ -0,0 +1,51 @@
+from __future__ import unicode_literals, division
+
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from shared_results import SharedResults
+from run_forward_simulations import scaps_output_processor
+from synthetic import iv_curve, write_iv_file
+
+def write_results(tmp_path, num_points):
+    # One IV file per slot, each with its own sweep length and temperature
+    paths = []
+    for slot, n in enumerate(num_points):
+        voltages = np.linspace(0, 0.02 * (n - 1), n)
+        paths.append(str(tmp_path / 'pythonresult_{}.txt'.format(slot)))
+        write_iv_file(paths[-1], voltages, iv_curve(voltages, T=280.0 + 10 * slot))
+    return paths
+
+def fill(shared, paths):
+    for slot, path in enumerate(paths):
+        shared.write(slot, scaps_output_processor, path)
+
+def test_slots_written_by_a_worker_are_read_back(tmp_path, start_method):
+    # A spawned worker gets the shared buffers by pickling, and rebuilds its views of them
+    paths = write_results(tmp_path, [26, 11, 19])
+    shared = SharedResults(4, 26)
+
+    worker = multiprocessing.get_context(start_method).Process(target=fill, args=(shared, paths))
+    worker.start()
+    worker.join()
+
+    assert worker.exitcode == 0
+    assert list(shared.points) == [26, 11, 19, 0]
+    for slot, path in enumerate(paths):
+        J, V = shared.get(slot)
+        expected_J, expected_V = scaps_output_processor(path)
+        assert np.array_equal(J, expected_J) and np.array_equal(V, expected_V)
+        assert np.shares_memory(J, shared.J)
+    assert [len(array) for array in shared.get(3)] == [0, 0]
+
+def test_output_longer_than_a_slot_fails_without_touching_it(tmp_path):
+    short, long = write_results(tmp_path, [5, 12])
+    shared = SharedResults(1, 8)
+    shared.write(0, scaps_output_processor, short)
+
+    with pytest.raises(ValueError):
+        shared.write(0, scaps_output_processor, long)
+    assert shared.points[0] == 5
+    assert np.array_equal(shared.get(0)[1], scaps_output_processor(short)[1])
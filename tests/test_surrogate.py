@@ -0,0 +1,71 @@
+from __future__ import unicode_literals, division
+
+import numpy as np
+import pytest
+
+from parameter_grid import ParameterGrid
+from surrogate import GridSurrogate, refine, held_out_error
+
+VOLTAGES = np.linspace(0, 0.5, 6)
+TEMPERATURES = np.array([280, 300])
+ILLUMINATIONS = np.array([31, 108])
+
+@pytest.fixture
+def grid():
+    return ParameterGrid([('mu_n_l', np.linspace(20, 80, 5)), ('Nt_SnS_l', np.logspace(16, 18, 4)),
+                          ('EA_ZnOS_l', np.linspace(3.4, 4.3, 4))])
+
+def multilinear(coords):
+    """
+    Currents that are multilinear in (mu_n, log10 Nt, EA) with cross terms of every order, different at every
+    temperature, illumination and voltage
+    """
+    x, y, z = coords['mu_n_l'] / 80, np.log10(coords['Nt_SnS_l']) - 17, coords['EA_ZnOS_l'] - 4
+    scale = (TEMPERATURES[:, None, None] / 300) * np.log(ILLUMINATIONS)[None, :, None] * (1 + VOLTAGES)[None, None, :]
+    terms = 1 + 2 * x - 3 * y + 0.5 * z + x * y - 4 * y * z + 1.5 * x * z + 2.5 * x * y * z
+    return terms[:, None, None, None] * scale
+
+def surrogate_of(grid, **options):
+    return GridSurrogate(multilinear(grid.coordinate_arrays()), grid, VOLTAGES, TEMPERATURES, ILLUMINATIONS,
+                         **options)
+
+def test_exact_on_a_multilinear_function(grid):
+    surrogate = surrogate_of(grid)
+    assert surrogate.log_axes == ['Nt_SnS_l']
+
+    # Points off the grid, and on it, where the interpolation reduces to the simulated currents
+    rng = np.random.RandomState(0)
+    params = {'mu_n_l': rng.uniform(20, 80, 200), 'Nt_SnS_l': 10**rng.uniform(16, 18, 200),
+              'EA_ZnOS_l': rng.uniform(3.4, 4.3, 200)}
+    assert np.allclose(surrogate.interpolate(params, chunk=64), multilinear(params), rtol=1e-10, atol=1e-12)
+    assert np.allclose(surrogate.interpolate(grid.coordinate_arrays()), surrogate.currents, rtol=1e-12, atol=0)
+
+    fine = refine(grid, 3)
+    assert fine.shape == (13, 10, 10)
+    assert np.allclose(surrogate.engine(fine).currents, multilinear(fine.coordinate_arrays()), rtol=1e-10,
+                       atol=1e-12)
+
+def test_log_axis_is_interpolated_in_log_space(grid):
+    # The function is not linear in Nt itself, so only interpolation in log10 Nt is exact
+    params = refine(grid, 2).coordinate_arrays()
+    linear = surrogate_of(grid, log_axes=[]).interpolate(params)
+    assert not np.allclose(linear, multilinear(params), rtol=1e-6)
+
+    error = held_out_error(multilinear(grid.coordinate_arrays()), grid, VOLTAGES, TEMPERATURES, ILLUMINATIONS, 2)
+    assert error['held_out'] == len(grid) - 3 * 3 * 3
+    assert error['max'] < 1e-10
+
+def test_missing_corner_only_spoils_its_cells(grid):
+    currents = multilinear(grid.coordinate_arrays())
+    currents[0] = np.nan
+    surrogate = GridSurrogate(currents, grid, VOLTAGES, TEMPERATURES, ILLUMINATIONS)
+
+    near = {'mu_n_l': np.array([25.0]), 'Nt_SnS_l': np.array([2e16]), 'EA_ZnOS_l': np.array([3.5])}
+    far = {'mu_n_l': np.array([70.0]), 'Nt_SnS_l': np.array([5e17]), 'EA_ZnOS_l': np.array([4.2])}
+    assert np.all(np.isnan(surrogate.interpolate(near)))
+    assert np.allclose(surrogate.interpolate(far), multilinear(far), rtol=1e-10)
+
+def test_points_outside_the_grid_are_rejected(grid):
+    with pytest.raises(ValueError):
+        surrogate_of(grid).interpolate({'mu_n_l': np.array([90.0]), 'Nt_SnS_l': np.array([1e17]),
+                                        'EA_ZnOS_l': np.array([4.0])})